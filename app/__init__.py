@@ -1,5 +1,6 @@
 import os
 import logging
+import click
 from flask import Flask, redirect
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
@@ -19,20 +20,112 @@ def create_app():
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     
+    # Connection pool of each worker (see gunicorn.conf.py for sizing it against the number of workers)
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 10))
+    app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 5))
+    app.config['DB_POOL_TIMEOUT'] = float(os.getenv('DB_POOL_TIMEOUT', 10))
+    app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+    app.config['DB_STATEMENT_TIMEOUT_MS'] = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', 30000))
+    
+    from app.serve import engine_options
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+    
+    # Backend for pending aggregator commands ('sql' is shared by all workers, 'memory' is not)
+    app.config['COMMAND_STORE'] = os.getenv('COMMAND_STORE', 'sql')
+    app.config['COMMAND_CACHE_TTL'] = float(os.getenv('COMMAND_CACHE_TTL', 1.0))
+    app.config['COMMAND_POLL_INTERVAL'] = float(os.getenv('COMMAND_POLL_INTERVAL', 1.0))
+    app.config['COMMAND_EXPIRY_SECONDS'] = float(os.getenv('COMMAND_EXPIRY_SECONDS', 86400))  # Undelivered configure commands
+    
+    # Load shedding: raise collectors' reporting intervals when ingestion falls behind
+    app.config['SHED_QUEUE_DEPTH'] = int(os.getenv('SHED_QUEUE_DEPTH', 50))
+    app.config['SHED_WRITE_LATENCY_MS'] = float(os.getenv('SHED_WRITE_LATENCY_MS', 250))
+    app.config['SHED_MAX_FACTOR'] = int(os.getenv('SHED_MAX_FACTOR', 8))
+    app.config['SHED_EVALUATE_INTERVAL'] = float(os.getenv('SHED_EVALUATE_INTERVAL', 10))
+    app.config['SHED_ACTIVE_WINDOW'] = float(os.getenv('SHED_ACTIVE_WINDOW', 600))
+    
+    # Ingest admission: concurrent ingest requests per worker, kept below the threads and pooled
+    # connections so that the dashboard and read routes stay responsive, and requests per second
+    # (with bursts) of each aggregator. Requests over a limit get 429 with Retry-After; 0 disables a limit.
+    app.config['INGEST_MAX_CONCURRENCY'] = int(os.getenv('INGEST_MAX_CONCURRENCY', 6))
+    app.config['INGEST_RATE_LIMIT'] = float(os.getenv('INGEST_RATE_LIMIT', 20))
+    app.config['INGEST_RATE_BURST'] = float(os.getenv('INGEST_RATE_BURST', 100))
+    
+    # Exports streamed at once per worker, each holding a pooled connection for the whole download (0 for no
+    # limit), and milliseconds a PostgreSQL export transaction may sit idle waiting for a slow client
+    app.config['EXPORT_MAX_CONCURRENCY'] = int(os.getenv('EXPORT_MAX_CONCURRENCY', 2))
+    app.config['EXPORT_IDLE_TIMEOUT_MS'] = int(os.getenv('EXPORT_IDLE_TIMEOUT_MS', 60000))
+    
+    # Backfill uploads handled at once per worker, in slots apart from the ingest ones as each runs for minutes
+    app.config['IMPORT_MAX_CONCURRENCY'] = int(os.getenv('IMPORT_MAX_CONCURRENCY', 2))
+    
+    # Hours the Idempotency-Key of an ingested batch is remembered, so that a retried batch is not written twice
+    app.config['INGEST_KEY_TTL_HOURS'] = float(os.getenv('INGEST_KEY_TTL_HOURS', 168))
+    
+    # Aggregators not active for this many seconds are shown as stale, then as offline
+    app.config['AGGREGATOR_STALE_SECONDS'] = float(os.getenv('AGGREGATOR_STALE_SECONDS', 300))
+    app.config['AGGREGATOR_OFFLINE_SECONDS'] = float(os.getenv('AGGREGATOR_OFFLINE_SECONDS', 3600))
+    
+    # Self-monitoring: record the server's own health as an aggregator every interval (0 disables it)
+    app.config['SELF_MONITOR_INTERVAL'] = float(os.getenv('SELF_MONITOR_INTERVAL', 60))
+    app.config['SELF_MONITOR_NAME'] = os.getenv('SELF_MONITOR_NAME', 'coc-server')
+    app.config['SELF_MONITOR_LOCK'] = os.getenv('SELF_MONITOR_LOCK')
+    
+    # Development and tests: count SQL statements per request, and 'warn' or 'raise' over budget
+    app.config['QUERY_DEBUG'] = os.getenv('QUERY_DEBUG', 'warn' if app.debug else 'off')
+    app.config['QUERY_BUDGET'] = int(os.getenv('QUERY_BUDGET', 20))
+    app.config['QUERY_REPEAT_THRESHOLD'] = int(os.getenv('QUERY_REPEAT_THRESHOLD', 5))
+    
+    # Dashboard callbacks slower than this are written to the slow log
+    app.config['DASH_SLOW_CALLBACK_MS'] = float(os.getenv('DASH_SLOW_CALLBACK_MS', 500))
+    
+    # Logging: records are written by a background thread, as JSON lines or text
+    app.config['LOG_LEVEL'] = os.getenv('LOG_LEVEL', 'INFO')
+    app.config['LOG_LEVELS'] = os.getenv('LOG_LEVELS', '')  # e.g. "app.routes.api=DEBUG,sqlalchemy.engine=WARNING"
+    app.config['LOG_FORMAT'] = os.getenv('LOG_FORMAT', 'json')
+    app.config['LOG_QUEUE_SIZE'] = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    app.config['LOG_RATE_LIMIT'] = float(os.getenv('LOG_RATE_LIMIT', 10))
+    app.config['LOG_RATE_BURST'] = float(os.getenv('LOG_RATE_BURST', 50))
+    
     # Configure logging
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
+    from app.log import configure_logging
+    configure_logging(app)
     
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db)
     
+    # Initialize the aggregator command store
+    from app.commands import init_command_store
+    init_command_store(app)
+    
+    # Initialize ingest load shedding
+    from app.reporting import init_load_shedder
+    init_load_shedder(app)
+    
+    # Initialize ingest admission control
+    from app.admission import init_ingest_admission
+    init_ingest_admission(app)
+    
+    from app.export import init_exports
+    init_exports(app)
+    
+    # Record per-endpoint request and SQL metrics
+    from app.monitoring import init_request_metrics
+    init_request_metrics(app)
+    
+    # Record the server's own health as metrics
+    from app.selfmonitor import init_self_monitor
+    init_self_monitor(app)
+    
     # Register API routes
     from app.routes.api import api_bp
     app.register_blueprint(api_bp)
     
+    # Register internal operational routes
+    from app.routes.internal import internal_bp
+    app.register_blueprint(internal_bp)
+    
     # Register Dash application
     from app.dashboard import init_dashboard
     init_dashboard(app)
@@ -48,4 +141,39 @@ def create_app():
         db.create_all()
         logging.info('Database initialized.')
     
+    # Command to backfill snapshots from an NDJSON or CSV file, resumable from its checkpoint
+    @app.cli.command('snapshots-import')
+    @click.argument('path', type=click.Path(exists=True, dir_okay=False))
+    @click.option('--format', 'format_', type=click.Choice(['ndjson', 'csv']),
+                  help='File format, by default from the extension (.ndjson, .jsonl or .csv, optionally .gz)')
+    @click.option('--aggregator', help='Aggregator of rows that name a metric without one')
+    @click.option('--batch-size', default=10000, show_default=True, help='Rows written per transaction')
+    @click.option('--checkpoint', help='Checkpoint file [default: PATH.checkpoint]')
+    @click.option('--restart', is_flag=True, help='Ignore the checkpoint and import the whole file again')
+    def snapshots_import(path, format_, aggregator, batch_size, checkpoint, restart):
+        from app.backfill import import_file
+        from app.ingest import IngestError
+
+        def progress(importer):
+            summary = importer.to_dict()
+            click.echo(f"line {summary['line']}: {summary['imported']} imported, {summary['rejected']} rejected, "
+                       f"{summary['rows_per_second']} rows/s", err=True)
+
+        try:
+            result = import_file(path, format_, aggregator, batch_size, checkpoint, restart, progress)
+        except IngestError as e:
+            raise click.ClickException(str(e))
+
+        for error in result.get('errors', []):
+            click.echo(f"line {error['line']}: {error['error']}", err=True)
+        click.echo(f"{result['imported']} snapshots imported, {result['rejected']} rows rejected"
+                   + ('' if 'errors' in result else ' (already complete, pass --restart to import again)'))
+
+    # Command to run the production server, configured by gunicorn.conf.py
+    @app.cli.command('serve', context_settings={'ignore_unknown_options': True})
+    @click.argument('gunicorn_args', nargs=-1, type=click.UNPROCESSED)
+    def serve(gunicorn_args):
+        from app.serve import exec_gunicorn
+        exec_gunicorn(gunicorn_args)
+    
     return app 
\ No newline at end of file
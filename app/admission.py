@@ -0,0 +1,216 @@
+import math
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from threading import BoundedSemaphore, Lock
+
+from flask import current_app, jsonify
+from sqlalchemy import select
+
+from app import db
+from app.models.models import Metric
+
+# Buckets kept before the least recently used ones are dropped
+MAX_BUCKETS = 100000
+
+# Cached metric owners kept before the cache is reset
+MAX_CACHED_METRICS = 100000
+
+class IngestRejected(Exception):
+    """Raised when an ingest request is over a rate or concurrency limit."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f'Too many ingest requests ({reason}), retry in {retry_after} seconds')
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBuckets:
+    """Token buckets keyed by aggregator, refilled at ``rate`` tokens per second up to ``burst``.
+
+    At most MAX_BUCKETS are kept. Beyond that the least recently used bucket is
+    dropped, which is the one most likely to have refilled anyway, so that a
+    burst of new keys never resets the limits of the active aggregators.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def _store(self, tokens, now):
+        for key, available in tokens.items():
+            self._buckets[key] = (available, now)
+            self._buckets.move_to_end(key)
+        while len(self._buckets) > MAX_BUCKETS:
+            self._buckets.popitem(last=False)
+
+    def take(self, keys):
+        """Take a token from each key's bucket, or none at all if one is empty.
+
+        Returns 0 when the tokens were taken, else the seconds until every bucket
+        has one again.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens = {}
+            for key in keys:
+                available, updated = self._buckets.get(key, (self.burst, now))
+                tokens[key] = min(self.burst, available + (now - updated) * self.rate)
+
+            shortfall = max((1 - available for available in tokens.values()), default=0)
+            if shortfall > 0:
+                self._store(tokens, now)
+                return shortfall / self.rate
+
+            self._store({key: available - 1 for key, available in tokens.items()}, now)
+            return 0
+
+class IngestAdmission:
+    """Admission control for the ingest routes of this worker.
+
+    At most ``max_concurrency`` ingest requests are handled at once, so that the
+    remaining threads and pooled connections stay free for the dashboard and read
+    routes. Each aggregator may also send ``rate`` ingest requests per second with
+    bursts of ``burst``, so that one collector stuck in a loop cannot take the
+    capacity of the others. Backfill uploads run for minutes rather than
+    milliseconds, so at most ``max_imports`` of them run at once in slots of their
+    own, and never take the ingest slots. Requests over any limit are rejected
+    right away instead of waiting. A limit of 0 disables it.
+    """
+
+    def __init__(self, max_concurrency=6, rate=20, burst=100, max_imports=2):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_imports = max_imports
+
+        self.buckets = TokenBuckets(rate, burst) if rate > 0 else None
+        self.rejected = {'concurrency': 0, 'rate_limit': 0, 'import_concurrency': 0}
+        self._slots = BoundedSemaphore(max_concurrency) if max_concurrency > 0 else None
+        self._import_slots = BoundedSemaphore(max_imports) if max_imports > 0 else None
+        self._owners = {}
+        self._lock = Lock()
+
+    def _reject(self, reason, retry_after):
+        with self._lock:
+            self.rejected[reason] += 1
+        return IngestRejected(reason, max(1, math.ceil(retry_after)))
+
+    @contextmanager
+    def _hold(self, slots, reason):
+        if slots is None:
+            yield
+            return
+
+        if not slots.acquire(blocking=False):
+            raise self._reject(reason, 1)
+        try:
+            yield
+        finally:
+            slots.release()
+
+    def admit(self):
+        """Hold one of the ingest slots while the block runs, or raise IngestRejected if none is free."""
+        return self._hold(self._slots, 'concurrency')
+
+    def admit_import(self):
+        """Hold one of the import slots while the block runs, or raise IngestRejected if none is free."""
+        return self._hold(self._import_slots, 'import_concurrency')
+
+    def aggregators_of(self, metric_uuids):
+        """The aggregator of each known metric, from a cache filled with one query for the misses.
+
+        A metric never moves to another aggregator, so cached entries stay valid;
+        unknown metrics are not cached and are rejected by the write.
+        """
+        owners = {}
+        missing = []
+        for metric_uuid in metric_uuids:
+            owner = self._owners.get(metric_uuid)
+            if owner is None:
+                missing.append(metric_uuid)
+            else:
+                owners[metric_uuid] = owner
+
+        if missing:
+            found = dict(db.session.execute(
+                select(Metric.uuid, Metric.aggregator_uuid).where(Metric.uuid.in_(missing))
+            ).all())
+            with self._lock:
+                if len(self._owners) + len(found) > MAX_CACHED_METRICS:
+                    self._owners.clear()
+                self._owners.update(found)
+            owners.update(found)
+        return owners
+
+    def check_rate(self, metric_uuids):
+        """Take a token for each aggregator the metrics belong to, or raise IngestRejected.
+
+        Metrics that are not registered take no token, as the write rejects them
+        anyway, so made-up UUIDs cannot create buckets and push out those of the
+        aggregators.
+        """
+        if self.buckets is None:
+            return
+
+        metric_uuids = set(metric_uuids)
+        owners = self.aggregators_of(metric_uuids)
+        keys = {owners[metric_uuid] for metric_uuid in metric_uuids if metric_uuid in owners}
+
+        retry_after = self.buckets.take(keys)
+        if retry_after:
+            raise self._reject('rate_limit', retry_after)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'rate': self.rate,
+                'burst': self.burst,
+                'max_imports': self.max_imports,
+                'rejected': dict(self.rejected),
+            }
+
+def rejected_response(error):
+    """A 429 response telling the client when to retry."""
+    response = jsonify({'error': str(error), 'reason': error.reason, 'retry_after': error.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def ingest_route(view):
+    """Run an ingest view in one of the worker's ingest slots, answering 429 when all are taken."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            with get_ingest_admission().admit():
+                return view(*args, **kwargs)
+        except IngestRejected as e:
+            return rejected_response(e)
+    return wrapper
+
+def import_route(view):
+    """Run a backfill upload view in one of the worker's import slots, answering 429 when all are taken."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            with get_ingest_admission().admit_import():
+                return view(*args, **kwargs)
+        except IngestRejected as e:
+            return rejected_response(e)
+    return wrapper
+
+def init_ingest_admission(app):
+    admission = IngestAdmission(
+        max_concurrency=app.config['INGEST_MAX_CONCURRENCY'],
+        rate=app.config['INGEST_RATE_LIMIT'],
+        burst=app.config['INGEST_RATE_BURST'],
+        max_imports=app.config['IMPORT_MAX_CONCURRENCY'],
+    )
+    app.extensions['ingest_admission'] = admission
+    return admission
+
+def get_ingest_admission():
+    return current_app.extensions['ingest_admission']
@@ -0,0 +1,388 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import math
+import os
+import time
+from datetime import datetime
+from typing import Optional
+
+import msgspec
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.ingest import IngestError, MetricUUID, Offset, Timestamp, decode, iter_lines, to_datetime
+from app.models.models import Aggregator, Metric, Snapshot, SnapshotImport
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+
+# Rows written per transaction, with one COPY on PostgreSQL
+IMPORT_BATCH_SIZE = 10000
+
+# Rejected rows reported with their line number and reason
+MAX_REPORTED_ERRORS = 20
+
+class ImportRecord(msgspec.Struct):
+    """One row of a backfill file: a snapshot of a metric given by UUID, or by aggregator and metric name."""
+    value: float
+    timestamp: Timestamp
+    offset: Offset = 0
+    metric_uuid: Optional[MetricUUID] = None
+    aggregator: Optional[str] = None
+    metric: Optional[str] = None
+
+_record_decoder = msgspec.json.Decoder(ImportRecord)
+
+class MetricCatalog:
+    """Resolve the metrics of import records to UUIDs, loading each aggregator's metrics once."""
+
+    def __init__(self, default_aggregator=None):
+        self.default_aggregator = default_aggregator
+        self._by_name = {}
+        self._known_uuids = {}
+
+    def resolve(self, record):
+        if record.metric_uuid is not None:
+            known = self._known_uuids.get(record.metric_uuid)
+            if known is None:
+                known = self._known_uuids[record.metric_uuid] = db.session.execute(
+                    select(Metric.uuid).where(Metric.uuid == record.metric_uuid)
+                ).first() is not None
+            if not known:
+                raise IngestError(f'Metric with UUID "{record.metric_uuid}" not found')
+            return record.metric_uuid
+
+        aggregator = record.aggregator or self.default_aggregator
+        if aggregator is None or record.metric is None:
+            raise IngestError('Each row needs a metric_uuid, or a metric and its aggregator')
+
+        metrics = self._by_name.get(aggregator)
+        if metrics is None:
+            metrics = self._by_name[aggregator] = dict(db.session.execute(
+                select(Metric.name, Metric.uuid).join(Aggregator).where(Aggregator.name == aggregator)
+            ).all())
+
+        metric_uuid = metrics.get(record.metric)
+        if metric_uuid is None:
+            raise IngestError(f'Metric "{record.metric}" of aggregator "{aggregator}" not found')
+        return metric_uuid
+
+def can_copy(connection):
+    """Whether COPY can be used, which psycopg2 refuses once a gevent worker made it cooperative."""
+    if connection.dialect.name != 'postgresql':
+        return False
+    from psycopg2 import extensions
+    return extensions.get_wait_callback() is None
+
+def copy_snapshots(rows):
+    """Insert snapshot rows with COPY on PostgreSQL, else with one executemany."""
+    connection = db.session.connection()
+    if not can_copy(connection):
+        db.session.execute(insert(Snapshot), rows)
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    created_at = datetime.utcnow().isoformat()
+    for row in rows:
+        writer.writerow((row['metric_uuid'], repr(row['value']), row['timestamp'].isoformat(), row['offset'],
+                         created_at))
+    buffer.seek(0)
+
+    cursor = connection.connection.cursor()
+    try:
+        cursor.copy_expert('COPY snapshots (metric_uuid, value, "timestamp", "offset", created_at) '
+                           'FROM STDIN WITH (FORMAT csv)', buffer)
+    finally:
+        cursor.close()
+
+class SnapshotImporter:
+    """Load snapshots from the lines of an NDJSON or CSV file in large batches, with constant memory.
+
+    Lines are fed one at a time. Each record names its metric by ``metric_uuid``,
+    or by ``metric`` and ``aggregator`` (or the default aggregator), and has a
+    ``value``, a ``timestamp`` (ISO8601 or epoch milliseconds) and an optional
+    ``offset``. CSV files start with a header row naming these columns, and each
+    row must fit on one line. Bad rows are counted and reported, not imported.
+
+    Every ``batch_size`` good rows are written and committed in one transaction,
+    after which ``line`` and ``offset`` (bytes read) mark where an interrupted
+    import can resume, and ``on_batch`` is called with the importer.
+    ``before_commit(line, imported, rejected)`` is called inside each transaction,
+    to record the progress atomically with the rows.
+    Historical snapshots do not mark their aggregators active.
+    """
+
+    def __init__(self, format, default_aggregator=None, batch_size=IMPORT_BATCH_SIZE, on_batch=None,
+                 before_commit=None):
+        if format not in IMPORT_FORMATS:
+            raise ValueError(f'Format must be one of {", ".join(IMPORT_FORMATS)}')
+        self.format = format
+        self.catalog = MetricCatalog(default_aggregator)
+        self.batch_size = batch_size
+        self.on_batch = on_batch
+        self.before_commit = before_commit
+
+        self.columns = None
+        self.line = 0
+        self.offset = None
+        self.imported = 0
+        self.rejected = 0
+        self.errors = []
+        self.started = time.monotonic()
+        self._pending = []
+        self._read_line = 0
+        self._read_offset = None
+
+    def resume_at(self, line, offset=None):
+        """Start after line ``line`` (ending at byte ``offset``), imported by an earlier run."""
+        self.line = self._read_line = line
+        self.offset = self._read_offset = offset
+
+    def read_header(self, line):
+        """Take the column names of a CSV file from its first line."""
+        self.columns = [column.strip() for column in next(csv.reader([line.decode('utf-8')]))]
+        missing = {'value', 'timestamp'} - set(self.columns)
+        if missing:
+            raise IngestError(f'CSV header is missing {", ".join(sorted(missing))}')
+
+    def parse(self, line):
+        if self.format == 'ndjson':
+            return decode(_record_decoder, line)
+
+        try:
+            values = next(csv.reader([line.decode('utf-8')]))
+        except (UnicodeDecodeError, csv.Error) as e:
+            raise IngestError(f'Invalid CSV row: {e}')
+        if len(values) != len(self.columns):
+            raise IngestError(f'Expected {len(self.columns)} columns, got {len(values)}')
+
+        # Empty cells take the field's default
+        fields = {column: value for column, value in zip(self.columns, values) if value != ''}
+        try:
+            return msgspec.convert(fields, ImportRecord, strict=False)
+        except msgspec.ValidationError as e:
+            raise IngestError(str(e))
+
+    def reject(self, number, error):
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': number, 'error': str(error)})
+
+    def feed(self, number, line, end_offset=None):
+        """Parse line ``number`` (ending at byte ``end_offset`` of the input), writing a batch when one is full."""
+        if line.strip():
+            try:
+                record = self.parse(line)
+                # CSV cells such as "nan" and "inf" convert to floats that are not numbers
+                if not math.isfinite(record.value):
+                    raise IngestError('Value must be a finite number')
+                self._pending.append({
+                    'metric_uuid': self.catalog.resolve(record),
+                    'value': record.value,
+                    'timestamp': to_datetime(record.timestamp),
+                    'offset': record.offset,
+                })
+            except IngestError as e:
+                self.reject(number, e)
+
+        self._read_line = number
+        self._read_offset = end_offset
+        if len(self._pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Write and commit the pending rows, then move the checkpoint past the last line read."""
+        if self._pending or self.before_commit is not None:
+            imported = self.imported + len(self._pending)
+            try:
+                if self._pending:
+                    copy_snapshots(self._pending)
+                if self.before_commit is not None:
+                    self.before_commit(self._read_line, imported, self.rejected)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+            self.imported = imported
+            self._pending = []
+
+        self.line = self._read_line
+        self.offset = self._read_offset
+        if self.on_batch is not None:
+            self.on_batch(self)
+
+    def finish(self):
+        self.flush()
+        return self.to_dict()
+
+    def to_dict(self):
+        seconds = time.monotonic() - self.started
+        return {
+            'format': self.format,
+            'line': self.line,
+            'imported': self.imported,
+            'rejected': self.rejected,
+            'errors': self.errors,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(self.imported / seconds, 1) if seconds > 0 else None,
+        }
+
+def format_of(path):
+    """The import format of a file from its extension, ignoring .gz."""
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return None
+
+def load_checkpoint(path, source):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('source') != source:
+        raise IngestError(f'Checkpoint {path} belongs to {checkpoint.get("source")}')
+    return checkpoint
+
+def save_checkpoint(path, checkpoint):
+    # Written to a temporary file and renamed, so that a crash never leaves half a checkpoint
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(temporary, path)
+
+def import_file(path, format=None, default_aggregator=None, batch_size=IMPORT_BATCH_SIZE, checkpoint_path=None,
+                restart=False, progress=None):
+    """Import an NDJSON or CSV file (optionally gzipped), resuming from its checkpoint file.
+
+    After every batch the checkpoint records the line and byte offset imported
+    up to and the running totals, and ``progress`` is called with the importer.
+    A finished import is marked complete, so running it again does nothing
+    unless ``restart`` is set.
+    """
+    source = os.path.abspath(path)
+    format = format or format_of(path)
+    if format is None:
+        raise IngestError(f'Cannot tell the format of {path}, pass it explicitly')
+    checkpoint_path = checkpoint_path or f'{path}.checkpoint'
+
+    checkpoint = None if restart else load_checkpoint(checkpoint_path, source)
+    if checkpoint and checkpoint.get('complete'):
+        return checkpoint
+
+    totals = {'imported': 0, 'rejected': 0}
+    if checkpoint:
+        totals = {'imported': checkpoint['imported'], 'rejected': checkpoint['rejected']}
+
+    def on_batch(importer):
+        save_checkpoint(checkpoint_path, {
+            'source': source,
+            'format': format,
+            'line': importer.line,
+            'offset': importer.offset,
+            'imported': totals['imported'] + importer.imported,
+            'rejected': totals['rejected'] + importer.rejected,
+            'complete': False,
+        })
+        if progress is not None:
+            progress(importer)
+
+    importer = SnapshotImporter(format, default_aggregator, batch_size, on_batch)
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f:
+        number = 0
+        offset = 0
+        if format == 'csv':
+            header = f.readline()
+            importer.read_header(header)
+            number, offset = 1, len(header)
+
+        if checkpoint and checkpoint['offset'] > offset:
+            f.seek(checkpoint['offset'])
+            number, offset = checkpoint['line'], checkpoint['offset']
+        importer.resume_at(number, offset)
+
+        for line in f:
+            number += 1
+            offset += len(line)
+            importer.feed(number, line, offset)
+        result = importer.finish()
+
+    checkpoint = {
+        'source': source,
+        'format': format,
+        'line': importer.line,
+        'offset': importer.offset,
+        'imported': totals['imported'] + importer.imported,
+        'rejected': totals['rejected'] + importer.rejected,
+        'complete': True,
+    }
+    save_checkpoint(checkpoint_path, checkpoint)
+    return {**result, **checkpoint}
+
+def start_import(import_id, format):
+    """The progress of an upload by its import id, created on its first attempt."""
+    progress = db.session.get(SnapshotImport, import_id)
+    if progress is None:
+        try:
+            db.session.add(SnapshotImport(id=import_id, format=format, line=0, imported=0, rejected=0,
+                                          complete=False))
+            db.session.commit()
+        except IntegrityError:
+            # Another attempt with the same id created it first
+            db.session.rollback()
+        progress = db.session.get(SnapshotImport, import_id)
+    if progress.format != format:
+        raise IngestError(f'Import {import_id} was started in {progress.format} format')
+    return progress
+
+def import_stream(chunks, format, default_aggregator=None, start_line=0, batch_size=IMPORT_BATCH_SIZE,
+                  import_id=None):
+    """Import the lines of an uploaded body, skipping those up to ``start_line`` (a previous run's ``line``).
+
+    With an ``import_id``, the line committed up to and the running totals are
+    stored in the same transaction as each batch, and an upload with the same id
+    skips the lines already imported, also after a database failure mid-stream.
+    A completed import is not imported again.
+    """
+    progress = None
+    if import_id is not None:
+        progress = start_import(import_id, format)
+        if progress.complete:
+            return progress.to_dict()
+        start_line = max(start_line, progress.line)
+        totals = (progress.imported, progress.rejected)
+
+    def before_commit(line, imported, rejected):
+        progress.line = line
+        progress.imported = totals[0] + imported
+        progress.rejected = totals[1] + rejected
+        progress.updated_at = datetime.utcnow()
+
+    def on_batch(importer):
+        logger.info('Imported %d snapshots (%d rejected) at line %d', importer.imported, importer.rejected,
+                    importer.line)
+
+    importer = SnapshotImporter(format, default_aggregator, batch_size, on_batch,
+                                before_commit if progress is not None else None)
+    importer.resume_at(start_line)
+    for number, line in enumerate(iter_lines(chunks), 1):
+        if format == 'csv' and number == 1:
+            importer.read_header(line)
+        elif number > start_line:
+            importer.feed(number, line)
+    result = importer.finish()
+    if progress is None:
+        return result
+
+    progress.complete = True
+    db.session.commit()
+    return {**result, **progress.to_dict()}
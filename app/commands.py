@@ -0,0 +1,290 @@
+import math
+import time
+from datetime import datetime, timedelta
+from threading import Event, Lock
+
+from flask import current_app
+from sqlalchemy import delete, or_, update
+
+from app import db
+from app.models.models import Aggregator, AggregatorCommand
+
+# Commands that replace any undelivered command of the same type, and are dropped undelivered once expired:
+# a configure command carries the whole effective config, so only the latest one matters
+SUPERSEDED_COMMANDS = ('configure',)
+
+# Seconds of queued commands that every refresh scans again, for commands committed late
+# by other workers (a row's created_at is set before its transaction commits)
+REFRESH_OVERLAP = 30
+
+class AggregatorNotFound(Exception):
+    """Raised when a command is queued for or claimed by an unknown aggregator."""
+
+class CommandStore:
+    """Pending commands for aggregators, delivered at most once.
+
+    Backends must be safe to share between gunicorn workers: a command queued by one
+    worker has to be claimable by exactly one poll, whichever worker serves it.
+    Queuing one of SUPERSEDED_COMMANDS drops the aggregator's undelivered commands
+    of that type, and those still undelivered after ``expiry`` seconds are never delivered.
+    """
+
+    def __init__(self, expiry=86400):
+        self.expiry = expiry
+        # Aggregator UUID -> [event, number of parked requests] for long polls in this worker
+        self._waiters = {}
+        self._waiters_lock = Lock()
+
+    def enqueue(self, aggregator_uuid, command, payload=None):
+        """Queue a command for an aggregator."""
+        raise NotImplementedError
+
+    def enqueue_many(self, commands):
+        """Queue several (aggregator_uuid, command, payload) tuples for known aggregators at once."""
+        for aggregator_uuid, command, payload in commands:
+            self.enqueue(aggregator_uuid, command, payload)
+
+    def claim(self, aggregator_uuid, commands=None):
+        """Claim and return the pending commands for an aggregator, optionally only of the given types."""
+        raise NotImplementedError
+
+    def _prime(self):
+        """Prepare to detect commands queued by other workers from now on."""
+
+    def _refresh(self, poll_interval):
+        """Wake parked requests for commands queued by other workers."""
+
+    def _notify(self, aggregator_uuid):
+        with self._waiters_lock:
+            waiter = self._waiters.get(aggregator_uuid)
+            if waiter:
+                waiter[0].set()
+
+    def wait(self, aggregator_uuid, timeout, commands=None, poll_interval=1.0):
+        """Claim commands for an aggregator, waiting up to timeout seconds for one to be queued.
+
+        A parked request holds no database connection and only wakes up when this
+        worker queues a command for the aggregator or every ``poll_interval`` seconds
+        to look for commands queued by other workers. Under a gevent worker the wait
+        is a greenlet, not a thread, so thousands of parked requests are cheap.
+        A timeout that is negative or not finite raises ValueError.
+        """
+        if not math.isfinite(timeout) or timeout < 0:
+            raise ValueError(f'Timeout must be a finite number of seconds >= 0, not {timeout}')
+        deadline = time.monotonic() + timeout
+
+        with self._waiters_lock:
+            waiter = self._waiters.setdefault(aggregator_uuid, [Event(), 0])
+            waiter[1] += 1
+        event = waiter[0]
+
+        try:
+            self._prime()
+            claimed = self.claim(aggregator_uuid, commands)
+
+            while not claimed:
+                # Return the connection to the pool while parked
+                db.session.close()
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                if event.wait(min(poll_interval, remaining)):
+                    event.clear()
+                    claimed = self.claim(aggregator_uuid, commands)
+                else:
+                    self._refresh(poll_interval)
+
+            return claimed
+        finally:
+            with self._waiters_lock:
+                waiter[1] -= 1
+                if not waiter[1]:
+                    self._waiters.pop(aggregator_uuid, None)
+
+class MemoryCommandStore(CommandStore):
+    """Process-local command store, only suitable for a single worker."""
+
+    def __init__(self, expiry=86400):
+        super().__init__(expiry)
+        self._pending = {}
+        self._lock = Lock()
+
+    def enqueue(self, aggregator_uuid, command, payload=None):
+        if not Aggregator.query.get(aggregator_uuid):
+            raise AggregatorNotFound(aggregator_uuid)
+
+        with self._lock:
+            pending = self._pending.setdefault(aggregator_uuid, [])
+            if command in SUPERSEDED_COMMANDS:
+                pending[:] = [c for c in pending if c['command'] != command]
+            pending.append({
+                'id': None,
+                'command': command,
+                'payload': payload,
+                'created_at': datetime.utcnow().isoformat()
+            })
+        self._notify(aggregator_uuid)
+
+    def claim(self, aggregator_uuid, commands=None):
+        if not Aggregator.query.get(aggregator_uuid):
+            raise AggregatorNotFound(aggregator_uuid)
+
+        expired = (datetime.utcnow() - timedelta(seconds=self.expiry)).isoformat()
+        with self._lock:
+            pending = self._pending.get(aggregator_uuid, [])
+            taken = [c for c in pending if commands is None or c['command'] in commands]
+            self._pending[aggregator_uuid] = [c for c in pending if c not in taken]
+        return [c for c in taken if c['command'] not in SUPERSEDED_COMMANDS or c['created_at'] >= expired]
+
+class SQLCommandStore(CommandStore):
+    """Command store backed by the aggregator_commands table.
+
+    A command is claimed by setting its delivered_at with a conditional UPDATE, so
+    when several workers race for the same row only one of them gets it. Each worker
+    remembers for ``cache_ttl`` seconds that an aggregator exists and has nothing
+    pending, so idle polls usually do not touch the database at all. A command queued
+    on another worker is therefore delivered at most ``cache_ttl`` seconds late.
+
+    A claim of only some command types caches that none of those are pending, so
+    polls for shutdown alone stay cheap while a configure command waits.
+
+    Parked long polls learn about commands queued by other workers from one query
+    per worker and poll interval for the undelivered commands created in the last
+    REFRESH_OVERLAP seconds that it has not seen yet. Ids are not used as a high-water
+    mark, since a command can commit after one with a higher id.
+    """
+
+    def __init__(self, cache_ttl=1.0, expiry=86400):
+        super().__init__(expiry)
+        self.cache_ttl = cache_ttl
+        self._idle_until = {}
+        self._lock = Lock()
+        self._seen_ids = None
+        self._refreshed_at = 0
+        self._refresh_lock = Lock()
+
+    def _is_idle(self, aggregator_uuid, commands=None):
+        with self._lock:
+            idle_until = self._idle_until.get(aggregator_uuid, {})
+            # Nothing pending at all also means none of the requested types
+            return max(idle_until.get(commands, 0), idle_until.get(None, 0)) > time.monotonic()
+
+    def _mark_idle(self, aggregator_uuid, commands=None):
+        with self._lock:
+            self._idle_until.setdefault(aggregator_uuid, {})[commands] = time.monotonic() + self.cache_ttl
+
+    def _forget(self, aggregator_uuid):
+        with self._lock:
+            self._idle_until.pop(aggregator_uuid, None)
+
+    def _supersede(self, aggregator_uuids, command):
+        """Delete the undelivered commands of a superseded type queued for the aggregators."""
+        db.session.execute(
+            delete(AggregatorCommand)
+            .where(AggregatorCommand.aggregator_uuid.in_(aggregator_uuids), AggregatorCommand.command == command,
+                   AggregatorCommand.delivered_at.is_(None))
+        )
+
+    def enqueue(self, aggregator_uuid, command, payload=None):
+        if not Aggregator.query.get(aggregator_uuid):
+            raise AggregatorNotFound(aggregator_uuid)
+
+        if command in SUPERSEDED_COMMANDS:
+            self._supersede([aggregator_uuid], command)
+        db.session.add(AggregatorCommand(aggregator_uuid=aggregator_uuid, command=command, payload=payload))
+        db.session.commit()
+        self._forget(aggregator_uuid)
+        self._notify(aggregator_uuid)
+
+    def enqueue_many(self, commands):
+        # One transaction for the whole batch, with one delete per superseded command type
+        for superseded in SUPERSEDED_COMMANDS:
+            aggregator_uuids = {uuid for uuid, command, _ in commands if command == superseded}
+            if aggregator_uuids:
+                self._supersede(aggregator_uuids, superseded)
+        for aggregator_uuid, command, payload in commands:
+            db.session.add(AggregatorCommand(aggregator_uuid=aggregator_uuid, command=command, payload=payload))
+        db.session.commit()
+
+        for aggregator_uuid, _, _ in commands:
+            self._forget(aggregator_uuid)
+            self._notify(aggregator_uuid)
+
+    def claim(self, aggregator_uuid, commands=None):
+        commands = tuple(sorted(commands)) if commands is not None else None
+        if self._is_idle(aggregator_uuid, commands):
+            return []
+
+        now = datetime.utcnow()
+        # Expired commands are left for the next command of their type to delete
+        query = AggregatorCommand.query.filter_by(aggregator_uuid=aggregator_uuid, delivered_at=None).filter(or_(
+            AggregatorCommand.command.notin_(SUPERSEDED_COMMANDS),
+            AggregatorCommand.created_at >= now - timedelta(seconds=self.expiry),
+        ))
+        if commands is not None:
+            query = query.filter(AggregatorCommand.command.in_(commands))
+        pending = query.order_by(AggregatorCommand.id).all()
+
+        if not pending:
+            if not Aggregator.query.get(aggregator_uuid):
+                raise AggregatorNotFound(aggregator_uuid)
+            self._mark_idle(aggregator_uuid, commands)
+            return []
+
+        claimed = []
+        for command in pending:
+            result = db.session.execute(
+                update(AggregatorCommand)
+                .where(AggregatorCommand.id == command.id, AggregatorCommand.delivered_at.is_(None))
+                .values(delivered_at=now)
+            )
+            # No row is updated when another worker claimed the command first
+            if result.rowcount == 1:
+                claimed.append(command.to_dict())
+        db.session.commit()
+
+        return claimed
+
+    def _recent_commands(self):
+        return db.session.query(AggregatorCommand.id, AggregatorCommand.aggregator_uuid).filter(
+            AggregatorCommand.created_at >= datetime.utcnow() - timedelta(seconds=REFRESH_OVERLAP),
+            AggregatorCommand.delivered_at.is_(None),
+        ).all()
+
+    def _prime(self):
+        if self._seen_ids is None:
+            with self._refresh_lock:
+                if self._seen_ids is None:
+                    self._seen_ids = {command_id for command_id, _ in self._recent_commands()}
+
+    def _refresh(self, poll_interval):
+        # Only one parked request per worker and interval runs the query
+        with self._refresh_lock:
+            if time.monotonic() - self._refreshed_at < poll_interval:
+                return
+            self._refreshed_at = time.monotonic()
+
+            recent = self._recent_commands()
+            db.session.close()
+            new_commands = [(command_id, uuid) for command_id, uuid in recent if command_id not in self._seen_ids]
+            # Commands that left the window are never returned again, so the set stays small
+            self._seen_ids = {command_id for command_id, _ in recent}
+
+        for _, aggregator_uuid in new_commands:
+            self._forget(aggregator_uuid)
+            self._notify(aggregator_uuid)
+
+def init_command_store(app):
+    """Create the command store selected by the COMMAND_STORE config value (``sql`` or ``memory``)."""
+    expiry = app.config.get('COMMAND_EXPIRY_SECONDS', 86400)
+    if app.config.get('COMMAND_STORE', 'sql') == 'memory':
+        store = MemoryCommandStore(expiry=expiry)
+    else:
+        store = SQLCommandStore(cache_ttl=app.config.get('COMMAND_CACHE_TTL', 1.0), expiry=expiry)
+    app.extensions['command_store'] = store
+    return store
+
+def get_command_store():
+    return current_app.extensions['command_store']
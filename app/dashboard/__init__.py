@@ -50,6 +50,10 @@ def init_dashboard(server: Flask):
         dash.dcc.Store(id="page-store"),
     ])
     
+    # Time every callback registered below
+    from app.dashboard.instrumentation import instrument_callbacks
+    instrument_callbacks(app)
+    
     # Register callbacks
     register_about_callbacks(app)
     register_live_callbacks(app)
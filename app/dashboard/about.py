@@ -273,14 +273,23 @@ layout = dbc.Container([
             
             html.H2("API Endpoints", className="mt-4"),
             html.Ul([
+                html.Li(html.Code("POST /register"), ": Register an aggregator and all its metrics in one request, reusing existing ones"),
                 html.Li(html.Code("POST /register_aggregator"), ": Register a new aggregator"),
                 html.Li(html.Code("POST /register_metric"), ": Register a metric under an aggregator"),
                 html.Li(html.Code("POST /snapshot"), ": Submit a metric snapshot"),
-                html.Li(html.Code("GET /metrics"), ": Fetch all registered metrics"),
+                html.Li(html.Code("POST /snapshots/batch"), ": Submit many snapshots and aggregate snapshots in one request, optionally gzip-compressed"),
+                html.Li(html.Code("GET /snapshots/aggregates"), ": Fetch one page of a metric's client-side pre-aggregated snapshots"),
+                html.Li(html.Code("GET /metrics"), ": Fetch all registered metrics, or one aggregator's"),
                 html.Li(html.Code("GET /snapshots"), ": Fetch historical snapshots for a metric"),
+                html.Li(html.Code("GET /snapshots/page"), ": Fetch one sorted, filtered page of one or more metrics' snapshots (keyset pagination)"),
+                html.Li(html.Code("GET /snapshots/series"), ": Fetch aligned, downsampled series for several metrics in one request"),
                 html.Li(html.Code("GET /latest_snapshots"), ": Fetch the most recent snapshot for all metrics"),
                 html.Li(html.Code("POST /shutdown_aggregator"), ": Initiate shutdown for a specific aggregator"),
-                html.Li(html.Code("GET /poll_shutdown_status/<aggregator_uuid>"), ": Poll to check if an aggregator should shut down")
+                html.Li(html.Code("GET /poll_shutdown_status/<aggregator_uuid>"), ": Poll to check if an aggregator should shut down"),
+                html.Li(html.Code("GET /commands/<aggregator_uuid>?wait=<seconds>"), ": Long-poll for queued commands (such as shutdown)"),
+                html.Li(html.Code("GET /aggregators"), ": Fetch a sorted, filtered page of aggregators with their health status"),
+                html.Li(html.Code("GET /aggregators/<aggregator_uuid>/config"), ": Fetch the reporting config an aggregator should use"),
+                html.Li(html.Code("PUT /aggregators/<aggregator_uuid>/config"), ": Set the reporting interval and batch size of an aggregator or one of its metrics")
             ]),
         ])
     ])
@@ -0,0 +1,180 @@
+// Client-side timezone conversion for the Live and History pages.
+//
+// Snapshots reach the browser once as epoch milliseconds plus the collector's
+// offset in minutes, so switching the timezone dropdown only re-runs these
+// functions and never goes back to the server.
+
+function pad(number, width) {
+    return String(number).padStart(width || 2, '0');
+}
+
+// Shift an epoch timestamp so that its UTC fields read as wall-clock time in
+// the selected timezone.
+function shiftTimestamp(epochMs, offset, timezone) {
+    if (timezone === 'device') {
+        return epochMs + (offset || 0) * 60000;
+    }
+    if (timezone === 'client') {
+        return epochMs - new Date(epochMs).getTimezoneOffset() * 60000;
+    }
+    return epochMs;
+}
+
+function formatTimestamp(epochMs, offset, timezone, withMillis) {
+    const date = new Date(shiftTimestamp(epochMs, offset, timezone));
+    let text = date.getUTCFullYear() + '-' + pad(date.getUTCMonth() + 1) + '-' + pad(date.getUTCDate()) +
+        ' ' + pad(date.getUTCHours()) + ':' + pad(date.getUTCMinutes()) + ':' + pad(date.getUTCSeconds());
+    if (withMillis) {
+        text += '.' + pad(date.getUTCMilliseconds(), 3);
+    }
+    return text;
+}
+
+function timezoneLabel(offset, timezone) {
+    if (timezone === 'device') {
+        offset = offset || 0;
+        const sign = offset >= 0 ? '+' : '-';
+        const minutes = Math.abs(offset);
+        return 'Collector Time (UTC' + sign + pad(Math.floor(minutes / 60)) + ':' + pad(minutes % 60) + ')';
+    }
+    if (timezone === 'client') {
+        return 'Local Time';
+    }
+    return 'UTC';
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    timezone: {
+        // Build the History graph from the cached series for the selected timezone.
+        // Plotly reads epoch milliseconds on a date axis as UTC wall-clock time, so the
+        // precomputed UTC and collector-time columns are used as they are. Metrics that
+        // share a unit share a y axis, every further unit gets its own axis.
+        history_graph: function(frame, selectedMetrics, timezone) {
+            if (!frame || !frame.timestamps.length || !selectedMetrics || !selectedMetrics.length) {
+                return {
+                    layout: {
+                        title: 'No data available',
+                        xaxis: {title: 'Time'},
+                        yaxis: {title: 'Value'},
+                    }
+                };
+            }
+
+            const units = [];
+            frame.series.forEach(series => {
+                if (!units.includes(series.unit)) {
+                    units.push(series.unit);
+                }
+            });
+
+            const localTimestamps = timezone === 'client' ? frame.timestamps.map(t => shiftTimestamp(t, 0, timezone)) : null;
+            const data = frame.series.map(series => {
+                const axisIndex = units.indexOf(series.unit);
+                let x = frame.timestamps;
+                if (timezone === 'device') {
+                    x = series.device_timestamps;
+                } else if (timezone === 'client') {
+                    x = localTimestamps;
+                }
+                return {
+                    x: x,
+                    y: series.values,
+                    text: series.formatted_values,
+                    hovertemplate: '%{x}<br>%{text}<extra>' + series.name + '</extra>',
+                    type: 'scatter',
+                    mode: 'lines+markers',
+                    name: series.name + ' - ' + series.aggregator_name,
+                    yaxis: axisIndex === 0 ? 'y' : 'y' + (axisIndex + 1),
+                    line: frame.series.length === 1 ? {color: '#007bff'} : undefined,
+                };
+            });
+
+            // Alternate extra axes between the left and right edge, pushing the plot inwards
+            const axisSpacing = 0.06;
+            const extraLeft = Math.floor((units.length - 1) / 2);
+            const extraRight = Math.floor((units.length - 2) / 2);
+            const layout = {
+                title: selectedMetrics.length === 1
+                    ? selectedMetrics[0].name + ' (' + selectedMetrics[0].unit + ') - ' + selectedMetrics[0].aggregator_name
+                    : selectedMetrics.length + ' metrics',
+                xaxis: {
+                    title: 'Time (' + timezoneLabel(0, timezone).replace(/ \(.*\)$/, '') + ')',
+                    type: 'date',
+                    gridcolor: '#eee',
+                    domain: [extraLeft * axisSpacing, 1 - Math.max(extraRight, 0) * axisSpacing],
+                },
+                showlegend: frame.series.length > 1,
+                legend: {orientation: 'h'},
+                plot_bgcolor: 'white',
+                paper_bgcolor: 'white',
+                margin: {l: 40, r: 40, t: 60, b: 40},
+            };
+
+            units.forEach((unit, index) => {
+                const axis = {title: 'Value (' + unit + ')', gridcolor: '#eee'};
+                if (index > 0) {
+                    axis.overlaying = 'y';
+                    axis.showgrid = false;
+                    axis.side = index % 2 === 1 ? 'right' : 'left';
+                }
+                if (index > 1) {
+                    // The n-th extra axis on a side sits n spacings outside the plot edge
+                    const nth = Math.floor(index / 2);
+                    axis.anchor = 'free';
+                    axis.position = axis.side === 'left'
+                        ? (extraLeft - nth) * axisSpacing
+                        : 1 - (extraRight - nth) * axisSpacing;
+                }
+                layout[index === 0 ? 'yaxis' : 'yaxis' + (index + 1)] = axis;
+            });
+
+            return {data: data, layout: layout};
+        },
+
+        // Format the timestamps of the visible History table page.
+        history_table: function(rows, timezone) {
+            if (!rows) {
+                return [];
+            }
+            return rows.map(row => Object.assign({}, row, {
+                timestamp: formatTimestamp(row.timestamp, row.offset, timezone) + ' ' + timezoneLabel(row.offset, timezone),
+            }));
+        },
+
+        // Build the tooltips of the visible History table page.
+        history_tooltips: function(tableData, selectedMetrics) {
+            if (!tableData || !selectedMetrics) {
+                return [];
+            }
+            const byUuid = {};
+            selectedMetrics.forEach(metric => { byUuid[metric.uuid] = metric; });
+            return tableData.map(row => {
+                const metric = byUuid[row.metric_uuid] || {};
+                return {
+                    timestamp: {value: 'Recorded at ' + row.timestamp},
+                    value: {value: 'Raw value: ' + row.value + ' ' + (metric.unit || '')},
+                    formatted_value: {
+                        value: 'Metric: ' + (metric.name || '') + '\nAggregator: ' +
+                            (metric.aggregator_name || '') + '\nValue: ' + row.formatted_value
+                    },
+                };
+            });
+        },
+
+        // Fill in the time and timezone label of every Live metric card.
+        live_times: function(ids, timezone, metricsData) {
+            const byUuid = {};
+            (metricsData || []).forEach(metric => { byUuid[metric.metric_uuid] = metric; });
+
+            const displayTimes = ids.map(id => {
+                const metric = byUuid[id.index];
+                return metric ? formatTimestamp(metric.timestamp, metric.offset, timezone) : '';
+            });
+            const labels = ids.map(id => {
+                const metric = byUuid[id.index];
+                return metric ? timezoneLabel(metric.offset, timezone) : '';
+            });
+            return [displayTimes, labels];
+        },
+    }
+});
@@ -1,11 +1,26 @@
-import json
+import logging
 from datetime import datetime
 
 import dash_bootstrap_components as dbc
-import requests
-from dash import html, dcc, Input, Output, State, ALL, callback_context
+from dash import html, dcc, Input, Output, State, callback_context, dash_table
 
-from app.utils import get_server_url
+from app.utils import get_server_url, http_session
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+# Aggregators shown per page of the fleet table
+AGGREGATORS_PAGE_SIZE = 25
+
+# Aggregators offered by the reporting configuration dropdown for a search
+AGGREGATOR_SEARCH_LIMIT = 50
+
+# Background color of each health status in the fleet table
+STATUS_COLORS = {
+    "active": "#d1e7dd",
+    "stale": "#fff3cd",
+    "offline": "#f8d7da",
+}
 
 # Define the layout for the Control page
 layout = dbc.Container([
@@ -15,7 +30,8 @@ layout = dbc.Container([
             html.Hr(),
             html.P(
                 "This page allows you to manage aggregators. "
-                "You can view the status of all aggregators and send shutdown commands.",
+                "You can view the status of all aggregators, change how often they report "
+                "and send shutdown commands.",
                 className="lead"
             ),
             html.Div(id="last-reload-time"),
@@ -27,16 +43,110 @@ layout = dbc.Container([
             dbc.Card([
                 dbc.CardHeader("Aggregators"),
                 dbc.CardBody([
-                    html.Div(id="aggregators-table-container"),
+                    dbc.Row([
+                        dbc.Col([
+                            dbc.Input(id="aggregator-name-filter", type="text", placeholder="Filter by name", debounce=True),
+                        ], md=4),
+                        dbc.Col([
+                            dcc.Dropdown(
+                                id="aggregator-status-filter",
+                                options=[
+                                    {"label": "Active", "value": "active"},
+                                    {"label": "Stale", "value": "stale"},
+                                    {"label": "Offline", "value": "offline"},
+                                ],
+                                multi=True,
+                                placeholder="All statuses",
+                            ),
+                        ], md=4),
+                        dbc.Col([
+                            html.Div(id="aggregators-summary", className="text-muted mt-2"),
+                        ], md=4),
+                    ], className="mb-3"),
+                    dash_table.DataTable(
+                        id="aggregators-table",
+                        columns=[
+                            {"name": "Aggregator Name", "id": "name"},
+                            {"name": "Status", "id": "status"},
+                            {"name": "Last Active", "id": "last_active"},
+                            {"name": "Action", "id": "action"},
+                        ],
+                        page_size=AGGREGATORS_PAGE_SIZE,
+                        page_current=0,
+                        page_count=0,
+                        page_action="custom",
+                        sort_action="custom",
+                        sort_mode="single",
+                        sort_by=[{"column_id": "last_active", "direction": "desc"}],
+                        style_table={"overflowX": "auto"},
+                        style_cell={
+                            "textAlign": "left",
+                            "padding": "10px",
+                            "fontFamily": "'Open Sans', sans-serif"
+                        },
+                        style_header={
+                            "backgroundColor": "#f8f9fa",
+                            "fontWeight": "bold",
+                            "borderBottom": "1px solid #dee2e6"
+                        },
+                        style_data_conditional=[
+                            *[
+                                {
+                                    "if": {"filter_query": f'{{status}} = "{status}"', "column_id": "status"},
+                                    "backgroundColor": color
+                                }
+                                for status, color in STATUS_COLORS.items()
+                            ],
+                            {
+                                "if": {"column_id": "action"},
+                                "color": "#dc3545",
+                                "fontWeight": "bold",
+                                "cursor": "pointer"
+                            },
+                        ]
+                    ),
                 ]),
             ]),
         ]),
     ]),
     
+    dbc.Row([
+        dbc.Col([
+            dbc.Card([
+                dbc.CardHeader("Reporting Configuration"),
+                dbc.CardBody([
+                    dbc.Row([
+                        dbc.Col([
+                            html.Label("Aggregator"),
+                            dcc.Dropdown(id="reporting-aggregator-dropdown", placeholder="Select an aggregator"),
+                        ], md=3),
+                        dbc.Col([
+                            html.Label("Metric"),
+                            dcc.Dropdown(id="reporting-metric-dropdown", placeholder="All metrics"),
+                        ], md=3),
+                        dbc.Col([
+                            html.Label("Interval (seconds)"),
+                            dbc.Input(id="reporting-interval-input", type="number", min=0.1, step=0.1),
+                        ], md=2),
+                        dbc.Col([
+                            html.Label("Batch size"),
+                            dbc.Input(id="reporting-batch-input", type="number", min=1, step=1),
+                        ], md=2),
+                        dbc.Col([
+                            dbc.Button("Apply", id="apply-reporting-button", color="primary", className="mt-4"),
+                        ], md=2),
+                    ]),
+                    html.Div(id="reporting-config-result", className="mt-3"),
+                    html.Div(id="reporting-config-status", className="mt-3 text-muted"),
+                ]),
+            ]),
+        ]),
+    ], className="mt-4"),
+    
     # Modal for shutdown confirmation
     dbc.Modal([
         dbc.ModalHeader("Confirm Shutdown"),
-        dbc.ModalBody("Are you sure you want to shut down this aggregator?"),
+        dbc.ModalBody("Are you sure you want to shut down this aggregator?", id="shutdown-confirmation-body"),
         dbc.ModalFooter([
             dbc.Button("Cancel", id="cancel-shutdown-button", className="ml-auto"),
             dbc.Button("Shutdown", id="confirm-shutdown-button", color="danger"),
@@ -55,128 +165,219 @@ layout = dbc.Container([
     ),
 ], fluid=True)
 
-def create_aggregators_table(aggregators):
-    """Create a table of aggregators with shutdown buttons."""
-    if not aggregators:
-        return html.Div("No aggregators found.")
-    
-    # Sort aggregators by last_active (descending)
-    sorted_aggregators = sorted(
-        aggregators, 
-        key=lambda x: datetime.fromisoformat(x["last_active"]), 
-        reverse=True
-    )
-    
-    # Create table header
-    header = html.Thead(html.Tr([
-        html.Th("Aggregator Name"),
-        html.Th("Last Active"),
-        html.Th("Action"),
-    ]))
-    
-    # Create table rows
+def aggregator_rows(aggregators):
+    """Format one page of aggregators as rows of the fleet table."""
     rows = []
-    for aggregator in sorted_aggregators:
+    for aggregator in aggregators:
         # Format last_active timestamp
         last_active = datetime.fromisoformat(aggregator["last_active"].replace('Z', '+00:00'))
-        last_active_str = last_active.strftime("%Y-%m-%d %H:%M:%S UTC")
-        
-        # Create row
-        row = html.Tr([
-            html.Td(aggregator["name"]),
-            html.Td(last_active_str),
-            html.Td(
-                dbc.Button(
-                    "Shutdown", 
-                    id={"type": "shutdown-button", "index": aggregator["uuid"]},
-                    color="danger", 
-                    size="sm"
-                )
-            ),
-        ])
-        rows.append(row)
-    
-    # Create table body
-    body = html.Tbody(rows)
-    
-    # Create table
-    table = dbc.Table([header, body], bordered=True, hover=True, responsive=True, striped=True)
+        rows.append({
+            "uuid": aggregator["uuid"],
+            "name": aggregator["name"],
+            "status": aggregator["status"],
+            "last_active": last_active.strftime("%Y-%m-%d %H:%M:%S UTC"),
+            "action": "Shutdown",
+        })
+    return rows
+
+def aggregator_query_params(sort_by, name, statuses):
+    """Translate the fleet table's sort and filters into /aggregators query parameters."""
+    params = {"sort": "last_active", "order": "desc"}
+    if sort_by:
+        column, direction = sort_by[0]["column_id"], sort_by[0]["direction"]
+        if column == "status":
+            # Healthiest first is most recently active first
+            params["order"] = "desc" if direction == "asc" else "asc"
+        elif column in ("name", "last_active"):
+            params["sort"], params["order"] = column, direction
     
-    return table
+    if name:
+        params["name"] = name
+    if statuses:
+        params["status"] = statuses
+    return params
 
 def register_control_callbacks(app):
     """Register callbacks for the Control page."""
     
     @app.callback(
-        Output("aggregators-store", "data"),
-        [Input("control-interval-component", "n_intervals")],
+        [Output("aggregators-store", "data"),
+         Output("aggregators-table", "page_count"),
+         Output("aggregators-table", "page_current"),
+         Output("aggregators-summary", "children")],
+        [Input("control-interval-component", "n_intervals"),
+         Input("aggregators-table", "page_current"),
+         Input("aggregators-table", "sort_by"),
+         Input("aggregator-name-filter", "value"),
+         Input("aggregator-status-filter", "value")],
         prevent_initial_call=False
     )
-    def fetch_aggregators(_):
-        """Fetch the list of aggregators."""
+    def fetch_aggregators(_, page_current, sort_by, name, statuses):
+        """Fetch the visible page of aggregators, sorted and filtered by the server."""
+        # Go back to the first page when the sort or filters change
+        triggered = {t["prop_id"] for t in callback_context.triggered}
+        if triggered & {"aggregators-table.sort_by", "aggregator-name-filter.value", "aggregator-status-filter.value"}:
+            page_current = 0
+        page_current = page_current or 0
+        
+        params = aggregator_query_params(sort_by, name, statuses)
+        params["limit"] = AGGREGATORS_PAGE_SIZE
+        params["offset"] = page_current * AGGREGATORS_PAGE_SIZE
+        
         try:
-            response = requests.get(f"{get_server_url()}/aggregators")
+            response = http_session.get(f"{get_server_url()}/aggregators", params=params)
             aggregators = response.json()
-            return aggregators
+            total = int(response.headers.get("X-Total-Count", len(aggregators)))
         except Exception as e:
-            print(f"Error fetching aggregators: {e}")
-            return []
+            logger.warning('Error fetching aggregators: %s', e)
+            return [], 0, 0, ""
+        
+        page_count = max((total + AGGREGATORS_PAGE_SIZE - 1) // AGGREGATORS_PAGE_SIZE, 1)
+        return aggregators, page_count, min(page_current, page_count - 1), f"{total} aggregator(s)"
     
     @app.callback(
-        [Output("aggregators-table-container", "children"),
+        [Output("aggregators-table", "data"),
          Output("last-reload-time", "children")],
         Input("aggregators-store", "data"),
         prevent_initial_call=True
     )
     def update_aggregators_table(aggregators):
-        """Update the aggregators table with the fetched data."""
-        table = create_aggregators_table(aggregators)
-        
+        """Update the aggregators table with the fetched page."""
         # Update the last update time
         now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
         last_reload = html.P(f"Last updated: {now}", className="text-muted")
         
-        return table, last_reload
+        return aggregator_rows(aggregators or []), last_reload
     
     @app.callback(
-        [Output("shutdown-confirmation-modal", "is_open"),
-         Output("selected-aggregator-store", "data")],
-        [Input({"type": "shutdown-button", "index": ALL}, "n_clicks"),
-         Input("cancel-shutdown-button", "n_clicks"),
-         Input("confirm-shutdown-button", "n_clicks")],
-        [State("shutdown-confirmation-modal", "is_open"),
-         State("aggregators-store", "data")],
+        Output("reporting-aggregator-dropdown", "options"),
+        Input("reporting-aggregator-dropdown", "search_value"),
+        [State("reporting-aggregator-dropdown", "value"),
+         State("reporting-aggregator-dropdown", "options")],
         prevent_initial_call=False
     )
-    def toggle_shutdown_modal(shutdown_clicks, cancel_clicks, confirm_clicks, is_open, aggregators):
-        """Toggle the shutdown confirmation modal."""
-        ctx = callback_context
+    def update_reporting_aggregator_options(search_value, selected_uuid, options):
+        """Offer the aggregators whose name matches what was typed into the dropdown."""
+        params = {"sort": "name", "order": "asc", "limit": AGGREGATOR_SEARCH_LIMIT}
+        if search_value:
+            params["name"] = search_value
+        
+        try:
+            response = http_session.get(f"{get_server_url()}/aggregators", params=params)
+            matches = [{"label": a["name"], "value": a["uuid"]} for a in response.json()]
+        except Exception as e:
+            logger.warning('Error fetching aggregators: %s', e)
+            matches = []
         
-        # Check if this is the initial call
-        if not ctx.triggered or all(click is None for click in shutdown_clicks) and cancel_clicks is None and confirm_clicks is None:
-            return False, None
+        # Keep the selected aggregator selectable when it is not among the matches
+        selected = [o for o in options or [] if o["value"] == selected_uuid]
+        if selected and selected[0] not in matches:
+            matches = selected + matches
+        return matches
+    
+    @app.callback(
+        [Output("reporting-metric-dropdown", "options"),
+         Output("reporting-metric-dropdown", "value")],
+        Input("reporting-aggregator-dropdown", "value"),
+        prevent_initial_call=True
+    )
+    def update_reporting_metric_options(aggregator_uuid):
+        """Populate the metric dropdown with the selected aggregator's metrics."""
+        if not aggregator_uuid:
+            return [], None
         
-        # Get the ID of the component that triggered the callback
-        trigger_id = ctx.triggered[0]["prop_id"].split(".")[0]
+        try:
+            response = http_session.get(f"{get_server_url()}/metrics", params={"aggregator_uuid": aggregator_uuid})
+            return [{"label": m["name"], "value": m["uuid"]} for m in response.json()], None
+        except Exception as e:
+            logger.warning('Error fetching metrics: %s', e)
+            return [], None
+    
+    @app.callback(
+        Output("reporting-config-result", "children"),
+        Input("apply-reporting-button", "n_clicks"),
+        [State("reporting-aggregator-dropdown", "value"),
+         State("reporting-metric-dropdown", "value"),
+         State("reporting-interval-input", "value"),
+         State("reporting-batch-input", "value")],
+        prevent_initial_call=True
+    )
+    def apply_reporting_config(n_clicks, aggregator_uuid, metric_uuid, interval_seconds, batch_size):
+        """Send the reporting configuration to the selected aggregator."""
+        if not n_clicks or not aggregator_uuid:
+            return dbc.Alert("Select an aggregator first.", color="warning")
         
-        # Check if a shutdown button was clicked
-        if trigger_id.startswith("{"):
-            # Parse the JSON from the trigger_id
-            button_id = json.loads(trigger_id)
-            if button_id.get("type") == "shutdown-button":
-                aggregator_uuid = button_id["index"]
-                
-                # Find the aggregator in the list
-                selected_aggregator = next((a for a in aggregators if a["uuid"] == aggregator_uuid), None)
-                
-                return True, selected_aggregator
+        try:
+            response = http_session.put(
+                f"{get_server_url()}/aggregators/{aggregator_uuid}/config",
+                json={
+                    "metric_uuid": metric_uuid,
+                    "interval_seconds": interval_seconds,
+                    "batch_size": int(batch_size) if batch_size else None,
+                }
+            )
+            
+            if response.status_code == 200:
+                return dbc.Alert("Reporting configuration sent to the aggregator.", color="success")
+            else:
+                return dbc.Alert(f"Error updating reporting configuration: {response.json().get('error', response.text)}", color="danger")
+        except Exception as e:
+            return dbc.Alert(f"Error updating reporting configuration: {str(e)}", color="danger")
+    
+    @app.callback(
+        Output("reporting-config-status", "children"),
+        [Input("control-interval-component", "n_intervals"),
+         Input("reporting-aggregator-dropdown", "value"),
+         Input("reporting-config-result", "children")],
+        prevent_initial_call=False
+    )
+    def update_reporting_status(_, aggregator_uuid, __):
+        """Show the load shedding factor and the selected aggregator's effective config."""
+        try:
+            shedding = http_session.get(f"{get_server_url()}/internal/load_shedding").json()
+            lines = [html.Div(
+                f"Load shedding: intervals x{shedding['interval_factor']} "
+                f"(ingest queue depth {shedding['queue_depth']}, DB write latency {shedding['write_latency_ms']:.1f} ms)"
+            )]
+            
+            if aggregator_uuid:
+                config = http_session.get(f"{get_server_url()}/aggregators/{aggregator_uuid}/config").json()
+                lines.append(html.Div(
+                    f"Effective config: interval {config['interval_seconds'] or 'default'} s, "
+                    f"batch size {config['batch_size'] or 'default'}, "
+                    f"{len(config['metrics'])} metric override(s)"
+                ))
+            
+            return lines
+        except Exception as e:
+            logger.warning('Error fetching reporting status: %s', e)
+            return ""
+    
+    @app.callback(
+        [Output("shutdown-confirmation-modal", "is_open"),
+         Output("selected-aggregator-store", "data"),
+         Output("shutdown-confirmation-body", "children"),
+         Output("aggregators-table", "active_cell")],
+        [Input("aggregators-table", "active_cell"),
+         Input("cancel-shutdown-button", "n_clicks"),
+         Input("confirm-shutdown-button", "n_clicks")],
+        State("aggregators-table", "data"),
+        prevent_initial_call=True
+    )
+    def toggle_shutdown_modal(active_cell, cancel_clicks, confirm_clicks, rows):
+        """Open the shutdown confirmation when a Shutdown cell of the fleet table is clicked."""
+        # The active cell is cleared so that clicking the same cell again opens the modal again
+        trigger_id = callback_context.triggered[0]["prop_id"].split(".")[0]
+        if trigger_id != "aggregators-table" or not active_cell or active_cell["column_id"] != "action":
+            return False, None, "", None
         
-        # Check if cancel or confirm button was clicked
-        elif trigger_id == "cancel-shutdown-button" or trigger_id == "confirm-shutdown-button":
-            # Cancel or confirm button was clicked
-            return False, None
+        row = (rows or [])[active_cell["row"]] if active_cell["row"] < len(rows or []) else None
+        if row is None:
+            return False, None, "", None
         
-        return is_open, None
+        selected_aggregator = {"uuid": row["uuid"], "name": row["name"]}
+        body = f"Are you sure you want to shut down aggregator '{row['name']}'?"
+        return True, selected_aggregator, body, None
     
     @app.callback(
         Output("error-alert", "children"),
@@ -191,7 +392,7 @@ def register_control_callbacks(app):
         
         try:
             # Send shutdown command
-            response = requests.post(
+            response = http_session.post(
                 f"{get_server_url()}/shutdown_aggregator",
                 json={"aggregator_uuid": selected_aggregator["uuid"]}
             )
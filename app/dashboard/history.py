@@ -1,10 +1,16 @@
+import json
+import logging
 from datetime import datetime, timedelta
+from urllib.parse import urlencode
 
 import dash_bootstrap_components as dbc
-import requests
-from dash import html, dcc, Input, Output, dash_table
+from dash import html, dcc, Input, Output, State, ClientsideFunction, dash_table
 
-from app.utils import get_server_url
+from app.dashboard.transform import snapshots_frame, series_columns, frame_to_records, cached_frame
+from app.utils import get_server_url, http_session
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
 
 # Define the layout for the History page
 layout = dbc.Container([
@@ -14,7 +20,8 @@ layout = dbc.Container([
             html.Hr(),
             html.P(
                 "This page allows you to explore historical metric data. "
-                "Select a metric, time range, and timezone to view the data.",
+                "Select one or more metrics, a time range, and a timezone to view the data. "
+                "Metrics with different units are drawn on separate axes.",
                 className="lead"
             ),
         ])
@@ -27,10 +34,11 @@ layout = dbc.Container([
                 dbc.CardBody([
                     dbc.Row([
                         dbc.Col([
-                            html.Label("Metric"),
+                            html.Label("Metrics"),
                             dcc.Dropdown(
                                 id="metric-dropdown",
-                                placeholder="Select a metric",
+                                placeholder="Select one or more metrics",
+                                multi=True,
                             ),
                         ], md=6),
                         dbc.Col([
@@ -116,7 +124,7 @@ layout = dbc.Container([
                                 id="history-graph",
                                 figure={
                                     "layout": {
-                                        "title": "Select a metric to view its history",
+                                        "title": "Select metrics to view their history",
                                         "xaxis": {"title": "Time"},
                                         "yaxis": {"title": "Value"},
                                     }
@@ -134,7 +142,25 @@ layout = dbc.Container([
     dbc.Row([
         dbc.Col([
             dbc.Card([
-                dbc.CardHeader("Metric History Data"),
+                dbc.CardHeader([
+                    "Metric History Data",
+                    html.Div([
+                        dcc.Dropdown(
+                            id="export-resolution",
+                            options=[
+                                {"label": "Full resolution", "value": "raw"},
+                                {"label": "Graph resolution", "value": "graph"},
+                            ],
+                            value="raw",
+                            clearable=False,
+                            style={"width": "200px"},
+                        ),
+                        html.A("Download CSV", id="export-csv-link", download="",
+                               className="btn btn-outline-primary btn-sm ms-2 disabled"),
+                        html.A("Download Parquet", id="export-parquet-link", download="",
+                               className="btn btn-outline-primary btn-sm ms-2 disabled"),
+                    ], style={"display": "flex", "align-items": "center"}),
+                ], style={"display": "flex", "justify-content": "space-between", "align-items": "center"}),
                 dbc.CardBody([
                     dcc.Loading(
                         id="loading-table",
@@ -143,16 +169,20 @@ layout = dbc.Container([
                             dash_table.DataTable(
                                 id="history-table",
                                 columns=[
+                                    {"name": "Metric", "id": "metric"},
                                     {"name": "Timestamp", "id": "timestamp"},
                                     {"name": "Value", "id": "value", "type": "numeric"},
                                     {"name": "Formatted Value", "id": "formatted_value"}
                                 ],
                                 page_size=10,
                                 page_current=0,
-                                page_action="native",
-                                sort_action="native",
-                                sort_mode="multi",
-                                filter_action="native",
+                                page_count=0,
+                                page_action="custom",
+                                sort_action="custom",
+                                sort_mode="single",
+                                sort_by=[],
+                                filter_action="custom",
+                                filter_query="",
                                 tooltip_data=[],
                                 tooltip_duration=None,
                                 style_table={"overflowX": "auto"},
@@ -184,8 +214,52 @@ layout = dbc.Container([
     dcc.Store(id="metrics-list-store"),
     dcc.Store(id="selected-metric-store"),
     dcc.Store(id="snapshots-store"),
+    dcc.Store(id="history-table-cursor-store"),
+    dcc.Store(id="history-page-store"),
 ], fluid=True)
 
+# Number of buckets the History graph downsamples the selected range into
+GRAPH_POINTS = 1000
+
+# Table columns that map onto a column the /snapshots/page endpoint can sort and filter on
+TABLE_QUERY_COLUMNS = {
+    "timestamp": "timestamp",
+    "value": "value",
+    "formatted_value": "value",
+}
+
+FILTER_OPERATORS = [
+    ("s>=", ">="), ("s<=", "<="), ("s!=", "!="),
+    ("s>", ">"), ("s<", "<"), ("s=", "="),
+    (">=", ">="), ("<=", "<="), ("!=", "!="),
+    ("eq", "="), ("ne", "!="), ("ge", ">="), ("le", "<="), ("gt", ">"), ("lt", "<"),
+    (">", ">"), ("<", "<"), ("=", "="),
+]
+
+def build_filter_params(filter_query):
+    """Translate a DataTable filter query into /snapshots/page filter expressions.
+    
+    Only comparisons are supported, other expressions (e.g. ``contains``) are ignored.
+    """
+    filters = []
+    for part in (filter_query or "").split(" && "):
+        part = part.strip()
+        if not part.startswith("{") or "}" not in part:
+            continue
+        
+        column_id, expression = part[1:].split("}", 1)
+        column = TABLE_QUERY_COLUMNS.get(column_id)
+        expression = expression.strip()
+        
+        for token, operator in FILTER_OPERATORS:
+            if expression.startswith(token):
+                operand = expression[len(token):].strip().strip("\"'`")
+                if column and operand:
+                    filters.append(f"{column} {operator} {operand}")
+                break
+    
+    return filters
+
 def register_history_callbacks(app):
     """Register callbacks for the History page."""
     
@@ -197,11 +271,11 @@ def register_history_callbacks(app):
     def fetch_metrics_list(_):
         """Fetch the list of available metrics."""
         try:
-            response = requests.get(f"{get_server_url()}/metrics")
+            response = http_session.get(f"{get_server_url()}/metrics")
             metrics = response.json()
             return metrics
         except Exception as e:
-            print(f"Error fetching metrics: {e}")
+            logger.warning('Error fetching metrics: %s', e)
             return []
     
     @app.callback(
@@ -229,212 +303,217 @@ def register_history_callbacks(app):
          Input("metrics-list-store", "data")],
         prevent_initial_call=True
     )
-    def store_selected_metric(metric_uuid, metrics):
-        """Store the selected metric details."""
-        if not metric_uuid or not metrics:
+    def store_selected_metric(metric_uuids, metrics):
+        """Store the details of the selected metrics, in selection order."""
+        if not metric_uuids or not metrics:
             return None
         
-        selected_metric = next((m for m in metrics if m["uuid"] == metric_uuid), None)
-        return selected_metric
+        metrics_by_uuid = {m["uuid"]: m for m in metrics}
+        selected_metrics = [metrics_by_uuid[uuid] for uuid in metric_uuids if uuid in metrics_by_uuid]
+        return selected_metrics or None
     
     @app.callback(
         Output("snapshots-store", "data"),
-        [Input("metric-dropdown", "value"),
+        [Input("selected-metric-store", "data"),
          Input("start-date", "date"),
          Input("start-time", "value"),
          Input("end-date", "date"),
          Input("end-time", "value")],
         prevent_initial_call=True
     )
-    def fetch_snapshots(metric_uuid, start_date, start_time, end_date, end_time):
-        """Fetch snapshots for the selected metric and time range."""
-        if not metric_uuid:
-            return []
+    def fetch_snapshots(selected_metrics, start_date, start_time, end_date, end_time):
+        """Fetch aligned, downsampled series for the selected metrics in one request."""
+        if not selected_metrics:
+            return None
         
-        try:
-            # Construct ISO8601 datetime strings
-            start_datetime = f"{start_date}T{start_time}:00Z"
-            end_datetime = f"{end_date}T{end_time}:59Z"
-            
-            # Fetch snapshots
-            response = requests.get(
-                f"{get_server_url()}/snapshots",
+        # Construct ISO8601 datetime strings
+        start_datetime = f"{start_date}T{start_time}:00Z"
+        end_datetime = f"{end_date}T{end_time}:59Z"
+        metric_uuids = tuple(m["uuid"] for m in selected_metrics)
+        
+        def build():
+            response = http_session.get(
+                f"{get_server_url()}/snapshots/series",
                 params={
-                    "metric_uuid": metric_uuid,
+                    "metric_uuid": metric_uuids,
                     "start": start_datetime,
-                    "end": end_datetime
+                    "end": end_datetime,
+                    "points": GRAPH_POINTS
                 }
             )
-            
-            snapshots = response.json()
-            return snapshots
+            return series_columns(response.json(), {m["uuid"]: m for m in selected_metrics})
+        
+        try:
+            # The range is parsed and transformed once per fetch and reused by later requests
+            return cached_frame((metric_uuids, start_datetime, end_datetime), build)
         except Exception as e:
-            print(f"Error fetching snapshots: {e}")
-            return []
+            logger.warning('Error fetching snapshots: %s', e)
+            return None
     
-    @app.callback(
+    # Timezone conversion and formatting happen in the browser (assets/timezone.js)
+    app.clientside_callback(
+        ClientsideFunction(namespace="timezone", function_name="history_graph"),
         Output("history-graph", "figure"),
         [Input("snapshots-store", "data"),
          Input("selected-metric-store", "data"),
          Input("timezone-dropdown", "value")],
         prevent_initial_call=True
     )
-    def update_history_graph(snapshots, selected_metric, timezone):
-        """Update the history graph with the fetched snapshots."""
-        if not snapshots or not selected_metric:
-            return {
-                "layout": {
-                    "title": "No data available",
-                    "xaxis": {"title": "Time"},
-                    "yaxis": {"title": "Value"},
-                }
-            }
-        
-        # Extract data for plotting
-        timestamps = []
-        values = []
+    
+    @app.callback(
+        [Output("history-page-store", "data"),
+         Output("history-table", "page_count"),
+         Output("history-table", "page_current"),
+         Output("history-table-cursor-store", "data")],
+        [Input("selected-metric-store", "data"),
+         Input("start-date", "date"),
+         Input("start-time", "value"),
+         Input("end-date", "date"),
+         Input("end-time", "value"),
+         Input("history-table", "page_current"),
+         Input("history-table", "page_size"),
+         Input("history-table", "sort_by"),
+         Input("history-table", "filter_query")],
+        State("history-table-cursor-store", "data"),
+        prevent_initial_call=True
+    )
+    def update_history_table(selected_metrics, start_date, start_time, end_date, end_time,
+                             page_current, page_size, sort_by, filter_query, cursor_store):
+        """Fetch the visible page of the history table."""
+        if not selected_metrics:
+            return [], 0, 0, None
         
-        for snapshot in snapshots:
-            # Parse timestamp based on selected timezone
-            timestamp = datetime.fromisoformat(snapshot["timestamp"].replace('Z', '+00:00'))
-            
-            # Apply timezone conversion if needed
-            if timezone == "client":
-                # Client-side conversion will be handled by JavaScript
-                pass
-            elif timezone == "device":
-                # Convert to device's timezone using the offset
-                timestamp = timestamp + timedelta(minutes=snapshot.get("offset", 0))
-            # For UTC, no conversion needed
-            
-            timestamps.append(timestamp)
-            values.append(snapshot["value"])
+        sort = "timestamp"
+        order = "asc"
+        if sort_by:
+            sort = TABLE_QUERY_COLUMNS.get(sort_by[0]["column_id"], "timestamp")
+            order = sort_by[0]["direction"]
         
-        # Create the figure
-        figure = {
-            "data": [
-                {
-                    "x": timestamps,
-                    "y": values,
-                    "type": "scatter",
-                    "mode": "lines+markers",
-                    "name": selected_metric["name"],
-                    "line": {"color": "#007bff"},
-                }
-            ],
-            "layout": {
-                "title": f"{selected_metric['name']} ({selected_metric['unit']}) - {selected_metric['aggregator_name']}",
-                "xaxis": {
-                    "title": f"Time ({timezone.upper()})",
-                    "gridcolor": "#eee",
-                },
-                "yaxis": {
-                    "title": f"Value ({selected_metric['unit']})",
-                    "gridcolor": "#eee",
-                },
-                "plot_bgcolor": "white",
-                "paper_bgcolor": "white",
-                "margin": {"l": 40, "r": 40, "t": 60, "b": 40},
-            }
+        params = {
+            "metric_uuid": [m["uuid"] for m in selected_metrics],
+            "start": f"{start_date}T{start_time}:00Z",
+            "end": f"{end_date}T{end_time}:59Z",
+            "sort": sort,
+            "order": order,
+            "filter": build_filter_params(filter_query),
+            "time_format": "epoch_ms",
         }
         
-        return figure
+        # Cursors are only valid for the query they were produced by, so start over
+        # from the first page whenever the metric, range, sort or filter changes
+        query_key = json.dumps(params, sort_keys=True)
+        if not cursor_store or cursor_store.get("query_key") != query_key:
+            cursor_store = {"query_key": query_key, "page_size": page_size, "cursors": {"0": None}, "total": None}
+            page_current = 0
+        elif cursor_store.get("page_size") != page_size:
+            cursor_store.update({"page_size": page_size, "cursors": {"0": None}})
+            page_current = 0
+        
+        page_current = page_current or 0
+        cursors = cursor_store["cursors"]
+        page_count = cursor_store["total"] and -(-cursor_store["total"] // page_size)
+        reverse_last_page = False
+        
+        params["limit"] = page_size
+        if str(page_current) in cursors:
+            if cursors[str(page_current)]:
+                params["cursor"] = cursors[str(page_current)]
+        elif page_count and page_current == page_count - 1:
+            # Walk the last page backwards from the end instead of skipping every row before it
+            params["order"] = "desc" if order == "asc" else "asc"
+            params["limit"] = cursor_store["total"] - page_current * page_size
+            reverse_last_page = True
+        else:
+            # Skip forward from the nearest earlier page whose cursor is known
+            known_page = max(int(page) for page in cursors if int(page) < page_current)
+            if cursors[str(known_page)]:
+                params["cursor"] = cursors[str(known_page)]
+            params["offset"] = (page_current - known_page) * page_size
+        
+        if cursor_store["total"] is None:
+            params["with_total"] = 1
+        
+        try:
+            response = http_session.get(f"{get_server_url()}/snapshots/page", params=params)
+            page = response.json()
+        except Exception as e:
+            logger.warning('Error fetching snapshots page: %s', e)
+            return [], 0, 0, None
+        
+        if not response.ok:
+            # Such as an offset too deep to skip, the cursors fetched so far stay usable
+            logger.warning('Error fetching snapshots page: %s', page.get("error"))
+        
+        if page.get("total") is not None:
+            cursor_store["total"] = page["total"]
+        snapshots = page.get("snapshots", [])
+        if reverse_last_page:
+            snapshots.reverse()
+        elif page.get("next_cursor"):
+            cursors[str(page_current + 1)] = page["next_cursor"]
+        
+        # Prepare table data for the visible page only
+        frame = snapshots_frame(snapshots, {m["uuid"]: m["unit"] for m in selected_metrics})
+        frame["metric"] = frame["metric_uuid"].map({m["uuid"]: m["name"] for m in selected_metrics})
+        table_data = frame_to_records(frame[["metric_uuid", "metric", "timestamp", "offset", "value", "formatted_value"]])
+        
+        page_count = -(-cursor_store["total"] // page_size) if cursor_store["total"] else 0
+        return table_data, page_count, page_current, cursor_store
     
-    # Add JavaScript for client-side timezone conversion
-    app.clientside_callback(
+    @app.callback(
+        [Output("export-csv-link", "href"),
+         Output("export-csv-link", "className"),
+         Output("export-parquet-link", "href"),
+         Output("export-parquet-link", "className")],
+        [Input("selected-metric-store", "data"),
+         Input("start-date", "date"),
+         Input("start-time", "value"),
+         Input("end-date", "date"),
+         Input("end-time", "value"),
+         Input("export-resolution", "value")],
+        prevent_initial_call=True
+    )
+    def update_export_links(selected_metrics, start_date, start_time, end_date, end_time, resolution):
+        """Point the download links at /snapshots/export for the selected metrics and range.
+        
+        The browser downloads the file straight from the server, which streams it,
+        so an export of any size never passes through the dashboard.
         """
-        function(snapshots, timezone) {
-            if (!snapshots || timezone !== 'client') return window.dash_clientside.no_update;
-            
-            // Convert timestamps to client local time for display
-            const graph = document.getElementById('history-graph');
-            if (graph && graph.layout && graph.layout.xaxis) {
-                graph.layout.xaxis.title.text = 'Time (Local Time)';
-            }
-            
-            return window.dash_clientside.no_update;
+        class_name = "btn btn-outline-primary btn-sm ms-2"
+        if not selected_metrics:
+            return None, f"{class_name} disabled", None, f"{class_name} disabled"
+        
+        params = {
+            "metric_uuid": [m["uuid"] for m in selected_metrics],
+            "start": f"{start_date}T{start_time}:00Z",
+            "end": f"{end_date}T{end_time}:59Z",
         }
-        """,
-        Output("snapshots-store", "data", allow_duplicate=True),
-        [Input("snapshots-store", "data"),
-         Input("timezone-dropdown", "value")],
-        prevent_initial_call=True
-    ) 
+        if resolution == "graph":
+            params["points"] = GRAPH_POINTS
+        
+        links = []
+        for format in ("csv", "parquet"):
+            links += [f"/snapshots/export?{urlencode({**params, 'format': format}, doseq=True)}", class_name]
+        return links
     
-    @app.callback(
+    app.clientside_callback(
+        ClientsideFunction(namespace="timezone", function_name="history_table"),
         Output("history-table", "data"),
-        [Input("snapshots-store", "data"),
-         Input("selected-metric-store", "data"),
+        [Input("history-page-store", "data"),
          Input("timezone-dropdown", "value")],
         prevent_initial_call=True
     )
-    def update_history_table(snapshots, selected_metric, timezone):
-        """Update the history table with the fetched snapshots."""
-        if not snapshots or not selected_metric:
-            return []
-        
-        # Prepare table data
-        table_data = []
-        
-        for snapshot in snapshots:
-            # Parse timestamp based on selected timezone
-            timestamp = datetime.fromisoformat(snapshot["timestamp"].replace('Z', '+00:00'))
-            
-            # Apply timezone conversion if needed
-            if timezone == "device":
-                # Convert to device's timezone using the offset
-                timestamp = timestamp + timedelta(minutes=snapshot.get("offset", 0))
-                offset = snapshot.get("offset", 0)
-                timezone_label = f"Collector Time (UTC{'+' if offset >= 0 else ''}{offset//60:02d}:{abs(offset%60):02d})"
-            elif timezone == "utc":
-                timezone_label = "UTC"
-            else:  # client/local time
-                timezone_label = "Local Time"
-            
-            # Format timestamp for display
-            formatted_timestamp = timestamp.strftime("%Y-%m-%d %H:%M:%S")
-            formatted_timestamp += f" {timezone_label}"
-            
-            # Format value based on metric type
-            value = snapshot["value"]
-            
-            # Format the value based on the type
-            formatted_value = value
-            if isinstance(value, (int, float)):
-                if selected_metric.get("unit") in ["percent", "%"]:
-                    formatted_value = f"{value:.2f}%"
-                elif selected_metric.get("unit") in ["bytes", "B"]:
-                    # Format bytes to appropriate unit (KB, MB, GB)
-                    if value >= 1024**3:
-                        formatted_value = f"{value/1024**3:.2f} GB"
-                    elif value >= 1024**2:
-                        formatted_value = f"{value/1024**2:.2f} MB"
-                    elif value >= 1024:
-                        formatted_value = f"{value/1024:.2f} KB"
-                    else:
-                        formatted_value = f"{value} B"
-                else:
-                    # For other numeric values, format with 2 decimal places
-                    formatted_value = f"{value:.2f} {selected_metric.get('unit', '')}"
-            
-            # Add row to table data
-            table_data.append({
-                "timestamp": formatted_timestamp,
-                "value": value,
-                "formatted_value": formatted_value
-            })
-        
-        return table_data
     
     @app.callback(
         Output("history-table", "columns"),
         [Input("selected-metric-store", "data")],
         prevent_initial_call=True
     )
-    def update_table_columns(selected_metric):
-        """Update table columns based on selected metric."""
-        if not selected_metric:
+    def update_table_columns(selected_metrics):
+        """Update table columns based on the selected metrics."""
+        if not selected_metrics:
             return [
+                {"name": "Metric", "id": "metric"},
                 {"name": "Timestamp", "id": "timestamp"},
                 {"name": "Value", "id": "value"},
                 {"name": "Formatted Value", "id": "formatted_value"}
@@ -442,28 +521,16 @@ def register_history_callbacks(app):
         
         # Create columns with appropriate headers
         return [
+            {"name": "Metric", "id": "metric"},
             {"name": "Timestamp", "id": "timestamp"},
             {"name": f"Raw Value", "id": "value", "type": "numeric"},
             {"name": f"Formatted Value", "id": "formatted_value"},
         ] 
     
-    @app.callback(
+    app.clientside_callback(
+        ClientsideFunction(namespace="timezone", function_name="history_tooltips"),
         Output("history-table", "tooltip_data"),
         [Input("history-table", "data"),
          Input("selected-metric-store", "data")],
         prevent_initial_call=True
     )
-    def update_tooltip_data(table_data, selected_metric):
-        """Update tooltip data for the table rows."""
-        if not table_data or not selected_metric:
-            return []
-        
-        tooltip_data = []
-        for row in table_data:
-            tooltip_data.append({
-                "timestamp": {"value": f"Recorded at {row['timestamp']}"},
-                "value": {"value": f"Raw value: {row['value']} {selected_metric.get('unit', '')}"},
-                "formatted_value": {"value": f"Metric: {selected_metric.get('name', '')}\nAggregator: {selected_metric.get('aggregator_name', '')}\nValue: {row['formatted_value']}"}
-            })
-        
-        return tooltip_data
\ No newline at end of file
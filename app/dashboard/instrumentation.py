@@ -0,0 +1,150 @@
+import functools
+import logging
+import time
+from collections import deque
+from datetime import datetime, timezone
+from threading import Lock, local
+
+from flask import g, request
+
+from app.telemetry import Histogram, LATENCY_BUCKETS_MS, SIZE_BUCKETS_BYTES
+from app.utils import http_session
+
+# Get logger for slow callbacks
+slow_logger = logging.getLogger('app.dashboard.slow')
+
+# Number of slow callbacks kept in memory for the stats endpoint
+SLOW_LOG_SIZE = 100
+
+# Timings of the callback running on the current thread
+_current = local()
+
+class CallbackStats:
+    """Latency and payload histograms for one dashboard callback."""
+
+    def __init__(self):
+        self.wall_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.http_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.db_ms = Histogram(LATENCY_BUCKETS_MS)
+        self.payload_in_bytes = Histogram(SIZE_BUCKETS_BYTES)
+        self.payload_out_bytes = Histogram(SIZE_BUCKETS_BYTES)
+
+    def to_dict(self):
+        return {
+            'wall_ms': self.wall_ms.to_dict(),
+            'http_ms': self.http_ms.to_dict(),
+            'db_ms': self.db_ms.to_dict(),
+            'payload_in_bytes': self.payload_in_bytes.to_dict(),
+            'payload_out_bytes': self.payload_out_bytes.to_dict(),
+        }
+
+callback_stats = {}
+slow_callbacks = deque(maxlen=SLOW_LOG_SIZE)
+_stats_lock = Lock()
+
+def get_callback_stats(name):
+    with _stats_lock:
+        if name not in callback_stats:
+            callback_stats[name] = CallbackStats()
+        return callback_stats[name]
+
+def stats_to_dict():
+    """Return the histograms of every callback and the most recent slow callbacks."""
+    with _stats_lock:
+        stats = dict(callback_stats)
+    return {
+        'callbacks': {name: callback.to_dict() for name, callback in sorted(stats.items())},
+        'slow_callbacks': list(slow_callbacks),
+    }
+
+def _record_http_time(response, *args, **kwargs):
+    """requests response hook adding the round trip to the current callback's HTTP time.
+
+    Callbacks reach the database through the API, so the SQL time the API reports in
+    its X-DB-Time header is added to the callback's DB time.
+    """
+    timings = getattr(_current, 'timings', None)
+    if timings is not None:
+        timings['http_ms'] += response.elapsed.total_seconds() * 1000
+        try:
+            timings['db_ms'] += float(response.headers.get('X-DB-Time', 0))
+        except ValueError:
+            pass
+    return response
+
+def timed_callback(func):
+    """Wrap a callback function to measure its wall time and downstream HTTP and DB time."""
+    name = f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        timings = {'http_ms': 0.0, 'db_ms': 0.0}
+        _current.timings = timings
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings['wall_ms'] = (time.perf_counter() - start) * 1000
+            _current.timings = None
+            # The response size is only known once Dash has serialized the outputs
+            g.dash_callback = (name, timings, request.content_length or 0)
+
+    return wrapper
+
+def instrument_callbacks(app):
+    """Time every server-side callback registered on the Dash app from now on.
+
+    Per-callback histograms of wall time, payload size in and out, and HTTP and DB
+    time spent by the callback are kept in memory. DB time is the SQL time of the
+    API requests the callback made. Callbacks slower than the
+    DASH_SLOW_CALLBACK_MS config value are written to the slow log.
+    """
+    server = app.server
+    threshold_ms = server.config.get('DASH_SLOW_CALLBACK_MS', 500)
+
+    original_callback = app.callback
+
+    @functools.wraps(original_callback)
+    def callback(*args, **kwargs):
+        decorator = original_callback(*args, **kwargs)
+
+        def register(func):
+            return decorator(timed_callback(func))
+
+        return register
+
+    app.callback = callback
+
+    if _record_http_time not in http_session.hooks['response']:
+        http_session.hooks['response'].append(_record_http_time)
+
+    @server.after_request
+    def record_callback(response):
+        if 'dash_callback' not in g:
+            return response
+
+        name, timings, payload_in = g.pop('dash_callback')
+        payload_out = response.calculate_content_length() or 0
+
+        stats = get_callback_stats(name)
+        stats.wall_ms.observe(timings['wall_ms'])
+        stats.http_ms.observe(timings['http_ms'])
+        stats.db_ms.observe(timings['db_ms'])
+        stats.payload_in_bytes.observe(payload_in)
+        stats.payload_out_bytes.observe(payload_out)
+
+        if timings['wall_ms'] >= threshold_ms:
+            entry = {
+                'callback': name,
+                'time': datetime.now(timezone.utc).isoformat(),
+                'wall_ms': round(timings['wall_ms'], 1),
+                'http_ms': round(timings['http_ms'], 1),
+                'db_ms': round(timings['db_ms'], 1),
+                'payload_in_bytes': payload_in,
+                'payload_out_bytes': payload_out,
+            }
+            slow_callbacks.append(entry)
+            slow_logger.warning('Slow dashboard callback %s took %.1f ms (http %.1f ms, db %.1f ms, in %d B, out %d B)',
+                                name, entry['wall_ms'], entry['http_ms'], entry['db_ms'], payload_in, payload_out)
+
+        return response
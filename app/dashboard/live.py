@@ -1,10 +1,13 @@
-from datetime import datetime, timedelta
+import logging
+from datetime import datetime
 
 import dash_bootstrap_components as dbc
-import requests
-from dash import html, dcc, Input, Output
+from dash import html, dcc, Input, Output, State, ALL, ClientsideFunction
 
-from app.utils import get_server_url
+from app.utils import get_server_url, http_session
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
 
 # Define the layout for the Live page
 layout = dbc.Container([
@@ -50,33 +53,21 @@ layout = dbc.Container([
     dcc.Store(id="metrics-data-store"),
 ], fluid=True)
 
-def create_metric_card(metric_uuid, metric_name, unit, value, timestamp, offset, timezone="utc"):
-    """Create a card for a metric."""
-    # Convert timestamp to different timezones
-    utc_time = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-    
-    # Format time based on selected timezone
-    if timezone == "utc":
-        display_time = utc_time.strftime("%Y-%m-%d %H:%M:%S")
-        timezone_label = "UTC"
-    elif timezone == "device":
-        # Convert to device's timezone using the offset (previously aggregator time)
-        device_time = utc_time + timedelta(minutes=offset)
-        display_time = device_time.strftime("%Y-%m-%d %H:%M:%S")
-        timezone_label = f"Collector Time (UTC{'+' if offset >= 0 else ''}{offset//60:02d}:{abs(offset%60):02d})"
-    else:  # client/local time
-        display_time = utc_time.strftime("%Y-%m-%d %H:%M:%S")
-        timezone_label = "Local Time"
+def create_metric_card(metric_uuid, metric_name, unit, value):
+    """Create a card for a metric.
     
+    The time and timezone label are left empty and filled in by the browser, so that
+    changing the timezone never re-renders the cards on the server.
+    """
     return dbc.Card([
         dbc.CardHeader(html.H4(metric_name, className="card-title")),
         dbc.CardBody([
             html.H2(f"{value:.2f} {unit}", className="card-text text-center"),
             html.Hr(),
             html.P([
-                html.Span(display_time, className="metric-time"),
+                html.Span(id={"type": "metric-time", "index": metric_uuid}, className="metric-time"),
                 " ",
-                html.Span(timezone_label, className="timezone-label")
+                html.Span(id={"type": "metric-timezone-label", "index": metric_uuid}, className="timezone-label")
             ])
         ]),
     ], className="mb-4")
@@ -93,11 +84,14 @@ def register_live_callbacks(app):
         """Fetch the latest metrics data."""
         try:
             # Fetch metrics data
-            metrics_response = requests.get(f"{get_server_url()}/metrics")
+            metrics_response = http_session.get(f"{get_server_url()}/metrics")
             metrics = metrics_response.json()
             
             # Fetch latest snapshots
-            snapshots_response = requests.get(f"{get_server_url()}/latest_snapshots")
+            snapshots_response = http_session.get(
+                f"{get_server_url()}/latest_snapshots",
+                params={"time_format": "epoch_ms"}
+            )
             snapshots = snapshots_response.json()
             
             # Combine metrics and snapshots
@@ -118,17 +112,16 @@ def register_live_callbacks(app):
             
             return metrics_data
         except Exception as e:
-            print(f"Error fetching metrics data: {e}")
+            logger.warning('Error fetching metrics data: %s', e)
             return []
     
     @app.callback(
         [Output("metrics-grid", "children"),
          Output("last-update-time", "children")],
-        [Input("metrics-data-store", "data"),
-         Input("timezone-dropdown", "value")],
+        Input("metrics-data-store", "data"),
         prevent_initial_call=False
     )
-    def update_metrics_grid(metrics_data, timezone):
+    def update_metrics_grid(metrics_data):
         """Update the metrics grid with the latest data."""
         if not metrics_data:
             return html.Div("No metrics data available."), ""
@@ -142,10 +135,7 @@ def register_live_callbacks(app):
                 metric["metric_uuid"],
                 metric["name"],
                 metric["unit"],
-                metric["value"],
-                metric["timestamp"],
-                metric["offset"],
-                timezone
+                metric["value"]
             )
             cards.append(dbc.Col(card, md=4))
             
@@ -160,29 +150,13 @@ def register_live_callbacks(app):
         
         return rows, last_update
     
-    # Add JavaScript for client-side timezone conversion
+    # Timezone conversion and formatting happen in the browser (assets/timezone.js)
     app.clientside_callback(
-        """
-        function(metrics_data, timezone) {
-            if (!metrics_data) return window.dash_clientside.no_update;
-            
-            // Convert timestamps to client local time only when local time is selected
-            if (timezone === 'client') {
-                setTimeout(function() {
-                    const timeElements = document.querySelectorAll('.metric-time');
-                    timeElements.forEach(elem => {
-                        const timeStr = elem.textContent;
-                        const utcTime = new Date(timeStr + ' UTC');
-                        elem.textContent = utcTime.toLocaleString();
-                    });
-                }, 100);
-            }
-            
-            return window.dash_clientside.no_update;
-        }
-        """,
-        Output("metrics-data-store", "data", allow_duplicate=True),
-        [Input("metrics-data-store", "data"),
+        ClientsideFunction(namespace="timezone", function_name="live_times"),
+        [Output({"type": "metric-time", "index": ALL}, "children"),
+         Output({"type": "metric-timezone-label", "index": ALL}, "children")],
+        [Input({"type": "metric-time", "index": ALL}, "id"),
          Input("timezone-dropdown", "value")],
-        prevent_initial_call=True
-    )
\ No newline at end of file
+        State("metrics-data-store", "data"),
+        prevent_initial_call=False
+    )
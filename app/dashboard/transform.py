@@ -0,0 +1,100 @@
+import time
+from threading import Lock
+
+import numpy as np
+import pandas as pd
+
+# Columns of a snapshot frame, in the order they are sent to the browser
+FRAME_COLUMNS = ["metric_uuid", "timestamp", "device_timestamp", "offset", "value", "formatted_value"]
+
+# How long a fetched range is reused before it is fetched again, in seconds
+FRAME_CACHE_TTL = 30
+FRAME_CACHE_SIZE = 32
+
+_frame_cache = {}
+_frame_cache_lock = Lock()
+
+def format_values(values, unit):
+    """Format an array of snapshot values for display based on the metric unit."""
+    values = np.asarray(values, dtype=np.float64)
+
+    if unit in ["percent", "%"]:
+        return np.char.mod("%.2f%%", values)
+    elif unit in ["bytes", "B"]:
+        # Format bytes to appropriate unit (KB, MB, GB)
+        thresholds = [values >= 1024**3, values >= 1024**2, values >= 1024]
+        scaled = np.select(thresholds, [values / 1024**3, values / 1024**2, values / 1024], values)
+        suffixes = np.select(thresholds, [" GB", " MB", " KB"], " B")
+        formatted = np.char.add(np.char.mod("%.2f", scaled), suffixes)
+        return np.where(suffixes == " B", np.char.mod("%s B", values), formatted)
+    else:
+        # For other numeric values, format with 2 decimal places
+        return np.char.add(np.char.mod("%.2f", values), f" {unit}")
+
+def snapshots_frame(snapshots, units):
+    """Parse a snapshot payload (epoch millisecond timestamps) into a frame in one pass.
+
+    ``units`` maps metric UUIDs to their unit. Adds the collector-time timestamp and
+    the unit-formatted value as vectorized columns.
+    """
+    frame = pd.DataFrame.from_records(snapshots, columns=["metric_uuid", "timestamp", "offset", "value"])
+    frame = frame.astype({"timestamp": np.int64, "offset": np.int64, "value": np.float64})
+
+    frame["device_timestamp"] = frame["timestamp"] + frame["offset"] * 60_000
+    frame["formatted_value"] = ""
+    for metric_uuid, rows in frame.groupby("metric_uuid").groups.items():
+        frame.loc[rows, "formatted_value"] = format_values(frame.loc[rows, "value"].to_numpy(), units.get(metric_uuid, ""))
+
+    return frame[FRAME_COLUMNS]
+
+def series_columns(payload, metrics):
+    """Transform a /snapshots/series payload into column lists for the History graph.
+
+    ``metrics`` maps metric UUIDs to metric dicts. Every series gets its collector-time
+    timestamps and unit-formatted values computed as arrays, with gaps kept as None.
+    """
+    timestamps = np.asarray(payload["timestamps"], dtype=np.int64)
+    series = []
+
+    for entry in payload["series"]:
+        metric = metrics.get(entry["metric_uuid"])
+        if not metric:
+            continue
+
+        values = np.array(entry["values"], dtype=np.float64)
+        offsets = np.nan_to_num(np.array(entry["offsets"], dtype=np.float64)).astype(np.int64)
+        missing = np.isnan(values)
+
+        series.append({
+            "metric_uuid": metric["uuid"],
+            "name": metric["name"],
+            "unit": metric["unit"],
+            "aggregator_name": metric["aggregator_name"],
+            "values": np.where(missing, None, values).tolist(),
+            "device_timestamps": (timestamps + offsets * 60_000).tolist(),
+            "formatted_values": np.where(missing, None, format_values(np.nan_to_num(values), metric["unit"])).tolist(),
+        })
+
+    return {"timestamps": timestamps.tolist(), "series": series}
+
+def frame_to_records(frame):
+    """Convert a frame to a list of row dicts for a DataTable."""
+    return frame.to_dict("records")
+
+def cached_frame(key, build):
+    """Return the frame cached under key, calling build() to create it when missing or expired."""
+    now = time.monotonic()
+    with _frame_cache_lock:
+        entry = _frame_cache.get(key)
+        if entry and now - entry[0] < FRAME_CACHE_TTL:
+            return entry[1]
+
+    frame = build()
+
+    with _frame_cache_lock:
+        if len(_frame_cache) >= FRAME_CACHE_SIZE:
+            # Evict the oldest entry
+            del _frame_cache[min(_frame_cache, key=lambda k: _frame_cache[k][0])]
+        _frame_cache[key] = (now, frame)
+
+    return frame
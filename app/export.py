@@ -0,0 +1,203 @@
+import calendar
+import csv
+import heapq
+import io
+from itertools import chain
+from operator import itemgetter
+from threading import BoundedSemaphore
+
+from flask import current_app
+from sqlalchemy import literal, select, text
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from app import db
+from app.models.models import AggregateSnapshot, Snapshot
+
+# Content-Types of the export formats
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Rows fetched from the database cursor, and written as one CSV chunk or Parquet row group
+EXPORT_CHUNK_ROWS = 50000
+
+EXPORT_COLUMNS = ('metric', 'metric_uuid', 'timestamp', 'value', 'offset', 'count')
+
+class ExportUnavailable(Exception):
+    """Raised when an export format needs a package that is not installed."""
+
+def init_exports(app):
+    # Each export pins a pooled connection and an open transaction until its last chunk is sent
+    limit = app.config['EXPORT_MAX_CONCURRENCY']
+    app.extensions['export_slots'] = BoundedSemaphore(limit) if limit > 0 else None
+
+def acquire_export_slot():
+    """Take one of this worker's export slots, returning the function that frees it, or None if all are taken."""
+    slots = current_app.extensions['export_slots']
+    if slots is None:
+        return lambda: None
+    if not slots.acquire(blocking=False):
+        return None
+    return slots.release
+
+def limit_idle_transaction(timeout_ms):
+    """Have PostgreSQL end the current transaction once it is idle for timeout_ms, as when a client stops reading.
+
+    Server-side cursors keep the transaction open between fetches, while the
+    previous chunk waits to be sent, which the statement timeout does not bound.
+    """
+    if timeout_ms and db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(text(f'SET LOCAL idle_in_transaction_session_timeout = {int(timeout_ms)}'))
+
+def _partitions(connection, query, chunk_rows):
+    result = connection.execute(query.execution_options(yield_per=chunk_rows))
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+def _merged_batches(snapshot_partitions, aggregate_rows, chunk_rows):
+    """Merge snapshot and aggregate rows by timestamp into batches of ``chunk_rows``."""
+    batch = []
+    for row in heapq.merge(chain.from_iterable(snapshot_partitions), aggregate_rows, key=itemgetter(1)):
+        batch.append(row)
+        if len(batch) >= chunk_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def snapshot_batches(metric_uuids, start=None, end=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Yield lists of (metric_uuid, timestamp, value, offset, count) rows of each metric in turn, oldest first.
+
+    Aggregate snapshots are rows at their window start, with the window's mean as
+    value and its sample count, as /snapshots/series counts them; snapshots have
+    a count of 1. Each metric is read with index range scans through server-side
+    cursors on PostgreSQL, fetching ``chunk_rows`` at a time, so that a range of
+    any size is never held in memory. Rows come from the connection rather than
+    the ORM session, which skips building ORM rows, and are only merged one by
+    one for metrics that have aggregates.
+    """
+    connection = db.session.connection()
+    for metric_uuid in metric_uuids:
+        snapshots = select(Snapshot.metric_uuid, Snapshot.timestamp, Snapshot.value, Snapshot.offset,
+                           literal(1)).where(Snapshot.metric_uuid == metric_uuid)
+        aggregates = select(AggregateSnapshot.metric_uuid, AggregateSnapshot.window_start,
+                            AggregateSnapshot.sum / AggregateSnapshot.count, AggregateSnapshot.offset,
+                            AggregateSnapshot.count).where(AggregateSnapshot.metric_uuid == metric_uuid)
+        if start is not None:
+            snapshots = snapshots.where(Snapshot.timestamp >= start)
+            aggregates = aggregates.where(AggregateSnapshot.window_start >= start)
+        if end is not None:
+            snapshots = snapshots.where(Snapshot.timestamp <= end)
+            aggregates = aggregates.where(AggregateSnapshot.window_start <= end)
+        snapshots = snapshots.order_by(Snapshot.timestamp, Snapshot.id)
+        aggregates = aggregates.order_by(AggregateSnapshot.window_start, AggregateSnapshot.id)
+
+        aggregate_partitions = _partitions(connection, aggregates, chunk_rows)
+        first = next(aggregate_partitions, None)
+        if first is None:
+            yield from _partitions(connection, snapshots, chunk_rows)
+            continue
+
+        aggregate_rows = chain.from_iterable(chain([first], aggregate_partitions))
+        yield from _merged_batches(_partitions(connection, snapshots, chunk_rows), aggregate_rows, chunk_rows)
+
+def iso_timestamp(timestamp):
+    # Naive timestamps are stored as UTC
+    return timestamp.isoformat() if timestamp.tzinfo else timestamp.isoformat() + '+00:00'
+
+def epoch_ms_timestamp(timestamp):
+    return calendar.timegm(timestamp.utctimetuple()) * 1000 + timestamp.microsecond // 1000
+
+def csv_chunks(batches, names, epoch_ms=False):
+    """Encode row batches as CSV with a header row, one chunk of bytes per batch."""
+    format_timestamp = epoch_ms_timestamp if epoch_ms else iso_timestamp
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        writer.writerows(
+            (names.get(metric_uuid), metric_uuid, format_timestamp(timestamp), value, offset, count)
+            for metric_uuid, timestamp, value, offset, count in batch
+        )
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+
+    # An empty export still has its header
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+class _Drain(io.RawIOBase):
+    """A write-only file whose contents are taken out as they are written, but whose position keeps counting.
+
+    The Parquet footer records the absolute file offset of every row group.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def parquet_schema():
+    return pyarrow.schema([
+        ('metric', pyarrow.string()),
+        ('metric_uuid', pyarrow.string()),
+        ('timestamp', pyarrow.timestamp('ms', tz='UTC')),
+        ('value', pyarrow.float64()),
+        ('offset', pyarrow.int32()),
+        ('count', pyarrow.int64()),
+    ])
+
+def parquet_chunks(batches, names):
+    """Encode row batches as a Parquet file with one row group per batch, yielding each as it is written."""
+    schema = parquet_schema()
+    sink = _Drain()
+    with pyarrow.parquet.ParquetWriter(sink, schema, compression='zstd') as writer:
+        for batch in batches:
+            metric_uuids, timestamps, values, offsets, counts = zip(*batch) if batch else ((), (), (), (), ())
+            # pyarrow reads naive timestamps as UTC
+            writer.write_table(pyarrow.table([
+                pyarrow.array([names.get(metric_uuid) for metric_uuid in metric_uuids], pyarrow.string()),
+                pyarrow.array(metric_uuids, pyarrow.string()),
+                pyarrow.array(timestamps, schema.field('timestamp').type),
+                pyarrow.array(values, pyarrow.float64()),
+                pyarrow.array(offsets, pyarrow.int32()),
+                pyarrow.array(counts, pyarrow.int64()),
+            ], schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+def export_chunks(format, batches, names, epoch_ms=False):
+    """Encode row batches in an export format, as chunks of bytes to stream.
+
+    Raises ExportUnavailable before anything is encoded if the format cannot be written.
+    """
+    if format == 'parquet':
+        if pyarrow is None:
+            raise ExportUnavailable('Parquet export needs the pyarrow package')
+        return parquet_chunks(batches, names)
+    return csv_chunks(batches, names, epoch_ms)
@@ -0,0 +1,396 @@
+import logging
+import math
+import time
+import zlib
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
+from typing import Annotated, List, Optional, Union
+from uuid import UUID
+
+import msgspec
+from flask import current_app
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from app import db
+from app.models.models import AggregateSnapshot, Aggregator, IngestBatch, Metric, Snapshot
+from app.reporting import after_ingest_write, get_load_shedder
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+# Largest request body accepted after decompression, in bytes
+MAX_DECOMPRESSED_BYTES = 64 * 1024 * 1024
+
+# Largest JSON or MessagePack batch body accepted after decompression, in bytes. These are decoded
+# as one document, so the whole body is held in memory; 10000 records take well under 4 MB.
+MAX_BUFFERED_BODY_BYTES = 16 * 1024 * 1024
+
+# Bytes read from the request body, and produced by decompression, at a time
+READ_CHUNK_BYTES = 64 * 1024
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# Latest timestamp accepted in epoch milliseconds (the end of year 9999)
+MAX_EPOCH_MS = 253402300799999
+
+# Longest Idempotency-Key accepted, and seconds between deletions of expired keys in each worker
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+KEY_PRUNE_INTERVAL = 3600
+
+# Content types of the batch formats other than JSON
+LINE_PROTOCOL_TYPES = ('text/plain',)
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+# Field types of submitted records. Timestamps are ISO8601 strings (naive ones are UTC)
+# or milliseconds since the Unix epoch; offsets are the client's UTC offset in minutes.
+MetricUUID = Annotated[str, msgspec.Meta(max_length=36)]
+Timestamp = Union[datetime, Annotated[int, msgspec.Meta(ge=0, le=MAX_EPOCH_MS)]]
+Offset = Annotated[int, msgspec.Meta(ge=-1440, le=1440)]
+
+class IngestError(ValueError):
+    """Raised when submitted snapshots are malformed."""
+
+class UnknownMetrics(IngestError):
+    """Raised when snapshots reference metrics that are not registered."""
+
+    def __init__(self, metric_uuids):
+        super().__init__(f'Metrics not found: {", ".join(sorted(metric_uuids))}')
+        self.metric_uuids = metric_uuids
+
+class UnsupportedFormat(IngestError):
+    """Raised when a body is sent with a Content-Type that has no decoder."""
+
+class BodyTooLarge(IngestError):
+    """Raised when a body is larger than allowed once decompressed."""
+
+class TooManyRecords(IngestError):
+    """Raised when a body holds more records than one request may submit."""
+
+    def __init__(self, max_records):
+        super().__init__(f'At most {max_records} snapshots and aggregates can be submitted at once')
+        self.max_records = max_records
+
+def _read_chunks(stream):
+    return iter(lambda: stream.read(READ_CHUNK_BYTES), b'')
+
+def _inflate(stream):
+    # Bound each output chunk, so that a small compressed body cannot expand all at once
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+    for compressed in _read_chunks(stream):
+        while compressed:
+            yield decompressor.decompress(compressed, READ_CHUNK_BYTES)
+            compressed = decompressor.unconsumed_tail
+    yield decompressor.flush()
+    if not decompressor.eof:
+        raise zlib.error('Compressed body is truncated')
+
+def decompressed_chunks(stream, content_encoding, max_bytes=MAX_DECOMPRESSED_BYTES):
+    """Read a request body in chunks, decompressing Content-Encoding gzip, deflate or zstd as it is read.
+
+    At most max_bytes are produced in total (None for no limit, when the chunks
+    are consumed as they come).
+    """
+    encoding = (content_encoding or '').strip().lower()
+    if encoding in ('', 'identity'):
+        chunks = _read_chunks(stream)
+    elif encoding in ('gzip', 'deflate'):
+        chunks = _inflate(stream)
+    elif encoding == 'zstd' and zstandard is not None:
+        reader = zstandard.ZstdDecompressor().stream_reader(stream)
+        chunks = iter(lambda: reader.read(READ_CHUNK_BYTES), b'')
+    else:
+        raise IngestError(f'Unsupported Content-Encoding "{encoding}"')
+
+    errors = (zlib.error, zstandard.ZstdError) if zstandard is not None else zlib.error
+    total = 0
+    try:
+        for chunk in chunks:
+            total += len(chunk)
+            if max_bytes is not None and total > max_bytes:
+                raise BodyTooLarge(f'Decompressed body is larger than {max_bytes} bytes')
+            if chunk:
+                yield chunk
+    except errors as e:
+        raise IngestError(f'Invalid {encoding} body: {e}')
+
+class SnapshotIn(msgspec.Struct):
+    """A submitted snapshot."""
+    metric_uuid: MetricUUID
+    value: float
+    timestamp: Timestamp
+    offset: Offset
+
+class AggregateIn(msgspec.Struct):
+    """A submitted summary of a metric's samples over a client-side window."""
+    metric_uuid: MetricUUID
+    window_start: Timestamp
+    window_seconds: Annotated[float, msgspec.Meta(gt=0)]
+    count: Annotated[int, msgspec.Meta(ge=1)]
+    min: float
+    max: float
+    sum: float
+    last: float
+    offset: Offset
+
+class PackedSnapshot(msgspec.Struct, array_like=True):
+    """A snapshot packed as [metric_uuid, value, timestamp, offset], the UUID as its 16 bytes."""
+    metric_uuid: Annotated[bytes, msgspec.Meta(min_length=16, max_length=16)]
+    value: float
+    timestamp: Timestamp
+    offset: Offset
+
+class BatchIn(msgspec.Struct):
+    """The body of /snapshots/batch, either list optional."""
+    snapshots: Optional[List[SnapshotIn]] = None
+    aggregates: Optional[List[AggregateIn]] = None
+
+# Decoders are built once per type, decoding then validates and converts in the same pass
+_snapshot_decoder = msgspec.json.Decoder(SnapshotIn)
+_batch_decoder = msgspec.json.Decoder(BatchIn)
+_packed_decoder = msgspec.msgpack.Decoder(List[PackedSnapshot])
+
+def to_datetime(timestamp):
+    """A decoded timestamp as a datetime, converting milliseconds since the Unix epoch to UTC."""
+    if isinstance(timestamp, int):
+        # Positional (days, seconds, microseconds, milliseconds), which is faster than the keyword
+        return EPOCH + timedelta(0, 0, 0, timestamp)
+    return timestamp
+
+def snapshot_row(snapshot):
+    """A decoded snapshot as a row for the snapshots table."""
+    return {
+        'metric_uuid': snapshot.metric_uuid,
+        'value': snapshot.value,
+        'timestamp': to_datetime(snapshot.timestamp),
+        'offset': snapshot.offset,
+    }
+
+def aggregate_row(aggregate):
+    """A decoded aggregate as a row for the aggregate_snapshots table."""
+    if not aggregate.min <= aggregate.last <= aggregate.max:
+        raise IngestError('Aggregates must have min <= last <= max')
+
+    return {
+        'metric_uuid': aggregate.metric_uuid,
+        'window_start': to_datetime(aggregate.window_start),
+        'window_seconds': aggregate.window_seconds,
+        'count': aggregate.count,
+        'min': aggregate.min,
+        'max': aggregate.max,
+        'sum': aggregate.sum,
+        'last': aggregate.last,
+        'offset': aggregate.offset,
+    }
+
+def decode(decoder, body, format_name='JSON'):
+    """Decode and validate a body, raising IngestError with the path of the first bad field."""
+    try:
+        return decoder.decode(body)
+    except msgspec.ValidationError as e:
+        raise IngestError(str(e))
+    except msgspec.DecodeError as e:
+        raise IngestError(f'Body must be {format_name}: {e}')
+
+def decode_snapshot(body):
+    """Decode the body of /snapshot into a row for the snapshots table."""
+    return snapshot_row(decode(_snapshot_decoder, body))
+
+def decode_batch(body):
+    """Decode the body of /snapshots/batch into snapshot rows and aggregate rows.
+
+    Every record is type checked before any is returned, so a bad record rejects
+    the batch without touching the database.
+    """
+    batch = decode(_batch_decoder, body)
+    if batch.snapshots is None and batch.aggregates is None:
+        raise IngestError('Snapshots or aggregates are required')
+
+    return ([snapshot_row(snapshot) for snapshot in batch.snapshots or ()],
+            [aggregate_row(aggregate) for aggregate in batch.aggregates or ()])
+
+def decode_packed(body):
+    """Decode a MessagePack array of packed snapshots into snapshot rows."""
+    # A batch repeats a few metrics many times, so each UUID is formatted once
+    metric_uuids = {}
+    rows = []
+    for index, snapshot in enumerate(decode(_packed_decoder, body, 'MessagePack')):
+        # MessagePack floats, unlike JSON numbers, can be NaN or infinite
+        if not math.isfinite(snapshot.value):
+            raise IngestError(f'Expected a finite number - at `$[{index}][1]`')
+        metric_uuid = metric_uuids.get(snapshot.metric_uuid)
+        if metric_uuid is None:
+            metric_uuid = metric_uuids[snapshot.metric_uuid] = str(UUID(bytes=snapshot.metric_uuid))
+        rows.append({
+            'metric_uuid': metric_uuid,
+            'value': snapshot.value,
+            'timestamp': to_datetime(snapshot.timestamp),
+            'offset': snapshot.offset,
+        })
+    return rows
+
+def parse_line(line, number):
+    """Parse one ``metric_uuid value epoch_ms offset`` line of the line protocol into a snapshot row."""
+    fields = line.split()
+    if len(fields) != 4:
+        raise IngestError(f'Line {number}: expected "metric_uuid value epoch_ms offset"')
+
+    try:
+        metric_uuid = fields[0].decode('ascii')
+        value = float(fields[1])
+        timestamp = int(fields[2])
+        offset = int(fields[3])
+    except ValueError:
+        raise IngestError(f'Line {number}: value must be a number, epoch_ms and offset integers')
+
+    if len(metric_uuid) > 36 or not math.isfinite(value):
+        raise IngestError(f'Line {number}: invalid metric UUID or value')
+    if not 0 <= timestamp <= MAX_EPOCH_MS or not -1440 <= offset <= 1440:
+        raise IngestError(f'Line {number}: epoch_ms or offset out of range')
+
+    return {'metric_uuid': metric_uuid, 'value': value, 'timestamp': to_datetime(timestamp), 'offset': offset}
+
+def iter_lines(chunks):
+    """Split chunks of a body into lines, without their newline, holding at most one partial line."""
+    pending = b''
+    for chunk in chunks:
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+def decode_lines(chunks, max_records):
+    """Parse line protocol from chunks of the body as they are read, into snapshot rows.
+
+    Blank lines are skipped. Parsing stops at the first bad line, or as soon as
+    there are more than max_records lines, without reading the rest of the body.
+    """
+    rows = []
+    for number, line in enumerate(iter_lines(chunks), 1):
+        if line.strip():
+            rows.append(parse_line(line, number))
+            if len(rows) > max_records:
+                raise TooManyRecords(max_records)
+    return rows
+
+def decode_batch_stream(stream, content_type, content_encoding, max_records):
+    """Decode a /snapshots/batch body in the format of its Content-Type into snapshot and aggregate rows.
+
+    ``text/plain`` is the line protocol, parsed as the body streams in, so only
+    the decoded rows are held in memory. ``application/msgpack`` is an array of
+    packed snapshots, and JSON (the default) the {"snapshots", "aggregates"}
+    object. msgspec has no incremental decoder for these, so their decompressed
+    body is read into memory and decoded in one pass, which is why it is limited
+    to MAX_BUFFERED_BODY_BYTES rather than MAX_DECOMPRESSED_BYTES.
+    """
+    content_type = (content_type or 'application/json').lower()
+    if content_type not in LINE_PROTOCOL_TYPES + MSGPACK_TYPES + ('application/json',):
+        raise UnsupportedFormat(f'Unsupported Content-Type "{content_type}"')
+
+    if content_type in LINE_PROTOCOL_TYPES:
+        return decode_lines(decompressed_chunks(stream, content_encoding), max_records), []
+
+    chunks = decompressed_chunks(stream, content_encoding, MAX_BUFFERED_BODY_BYTES)
+
+    if content_type in MSGPACK_TYPES:
+        rows, aggregate_rows = decode_packed(b''.join(chunks)), []
+    else:
+        rows, aggregate_rows = decode_batch(b''.join(chunks))
+    if len(rows) + len(aggregate_rows) > max_records:
+        raise TooManyRecords(max_records)
+    return rows, aggregate_rows
+
+def accepted_by_key(idempotency_key):
+    """The number of rows accepted by an earlier batch sent with the key, or None."""
+    return db.session.execute(
+        select(IngestBatch.accepted).where(IngestBatch.key == idempotency_key)
+    ).scalar_one_or_none()
+
+_pruned_at = 0.0
+
+def prune_ingest_keys():
+    """Delete idempotency keys older than INGEST_KEY_TTL_HOURS, at most every KEY_PRUNE_INTERVAL seconds."""
+    global _pruned_at
+    if time.monotonic() - _pruned_at < KEY_PRUNE_INTERVAL:
+        return
+    _pruned_at = time.monotonic()
+
+    expired = datetime.utcnow() - timedelta(hours=current_app.config['INGEST_KEY_TTL_HOURS'])
+    try:
+        db.session.execute(delete(IngestBatch).where(IngestBatch.created_at < expired))
+        db.session.commit()
+    except Exception as e:
+        # The batch itself is committed, so only the cleanup is retried next interval
+        db.session.rollback()
+        logger.warning('Could not delete expired idempotency keys: %s', e)
+
+def write_snapshots(rows, aggregate_rows=(), idempotency_key=None, track_load=True):
+    """Insert snapshot and aggregate rows in one transaction and mark their aggregators active.
+
+    Metrics are checked with one query and each table gets one executemany, however
+    many rows there are. The whole batch is rejected if any metric is unknown.
+    A batch sent again with the ``idempotency_key`` of one already written is not
+    written twice; the earlier batch's count is returned instead. With
+    ``track_load=False`` the write is left out of the load shedder's queue depth
+    and write latency, for the server's own metrics.
+    """
+    if not rows and not aggregate_rows:
+        return 0
+
+    if idempotency_key is not None:
+        accepted = accepted_by_key(idempotency_key)
+        if accepted is not None:
+            return accepted
+
+    with get_load_shedder().track_ingest() if track_load else nullcontext():
+        metric_uuids = {row['metric_uuid'] for row in rows} | {row['metric_uuid'] for row in aggregate_rows}
+        known = dict(db.session.execute(
+            select(Metric.uuid, Metric.aggregator_uuid).where(Metric.uuid.in_(metric_uuids))
+        ).all())
+
+        missing = metric_uuids - known.keys()
+        if missing:
+            raise UnknownMetrics(missing)
+
+        accepted = len(rows) + len(aggregate_rows)
+        try:
+            if rows:
+                db.session.execute(insert(Snapshot), rows)
+            if aggregate_rows:
+                db.session.execute(insert(AggregateSnapshot), aggregate_rows)
+            if idempotency_key is not None:
+                # Written in the same transaction, so the key exists exactly when the rows do
+                db.session.add(IngestBatch(key=idempotency_key, accepted=accepted))
+
+            # Update the aggregators' last_active timestamp
+            db.session.execute(
+                update(Aggregator)
+                .where(Aggregator.uuid.in_(set(known.values())))
+                .values(last_active=datetime.utcnow())
+            )
+
+            write_started = time.perf_counter()
+            db.session.commit()
+            write_ms = (time.perf_counter() - write_started) * 1000
+        except IntegrityError:
+            db.session.rollback()
+            # A concurrent request with the same key committed first
+            earlier = accepted_by_key(idempotency_key) if idempotency_key is not None else None
+            if earlier is None:
+                raise
+            return earlier
+        except Exception:
+            db.session.rollback()
+            raise
+
+    if track_load:
+        after_ingest_write(write_ms)
+    if idempotency_key is not None:
+        prune_ingest_keys()
+    return accepted
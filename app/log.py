@@ -0,0 +1,181 @@
+import atexit
+import json
+import logging
+import queue
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+
+# Attributes every LogRecord has, anything else was passed with extra= and is emitted as a field
+RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+# Message templates tracked by the rate limit before its state is reset
+MAX_RATE_LIMIT_KEYS = 10000
+
+# Listener of the current logging pipeline, replaced when the app is created again
+_listener = None
+
+class JsonFormatter(logging.Formatter):
+    """Format records as one JSON object per line.
+
+    Fields passed with ``extra=`` are included as top-level keys, so that a log line
+    can be filtered on e.g. ``aggregator_uuid`` without parsing the message.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+class RateLimitFilter(logging.Filter):
+    """Let each message template through at most ``rate`` times per second, with bursts of ``burst``.
+
+    Records are keyed by logger, level and unformatted message, so a flood of the
+    same event (one log per snapshot, 404s for one unknown metric) is thinned out
+    while other messages are unaffected. The first record let through after some
+    were suppressed carries their number in a ``suppressed`` field.
+    """
+
+    def __init__(self, rate=10, burst=50):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.suppressed_total = 0
+        self._buckets = {}
+        self._lock = Lock()
+
+    def filter(self, record):
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            if key not in self._buckets and len(self._buckets) >= MAX_RATE_LIMIT_KEYS:
+                self._buckets.clear()
+            tokens, updated, suppressed = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                self.suppressed_total += 1
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Hand records to the listener thread without formatting them or waiting for room.
+
+    Messages are formatted by the listener, so arguments of records that are
+    dropped or filtered out are never formatted. When the queue is full the
+    record is dropped and counted instead of blocking the request.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Render tracebacks now, the frames they reference are gone by the time the listener runs
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def parse_levels(levels):
+    """Parse per-logger levels written as ``name=LEVEL,name=LEVEL``."""
+    parsed = {}
+    for entry in (levels or '').split(','):
+        if not entry.strip():
+            continue
+        name, _, level = entry.partition('=')
+        parsed[name.strip()] = level.strip().upper()
+    return parsed
+
+@atexit.register
+def stop_logging():
+    """Write out the records still queued and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def configure_logging(app):
+    """Send log records through a queue to a listener thread that writes them to stderr.
+
+    Request threads only filter records and put them on the queue. LOG_LEVEL sets
+    the root level and LOG_LEVELS per-logger levels. LOG_FORMAT is ``json`` or
+    ``text``. Each message template is rate limited to LOG_RATE_LIMIT records per
+    second (0 disables it) with bursts of LOG_RATE_BURST.
+    """
+    stop_logging()
+
+    if app.config['LOG_FORMAT'] == 'json':
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(formatter)
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=app.config['LOG_QUEUE_SIZE']))
+    rate_limit = None
+    if app.config['LOG_RATE_LIMIT'] > 0:
+        rate_limit = RateLimitFilter(app.config['LOG_RATE_LIMIT'], app.config['LOG_RATE_BURST'])
+        queue_handler.addFilter(rate_limit)
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(app.config['LOG_LEVEL'].upper())
+
+    for name, level in parse_levels(app.config['LOG_LEVELS']).items():
+        logging.getLogger(name).setLevel(level)
+
+    global _listener
+    _listener = QueueListener(queue_handler.queue, stream_handler)
+    _listener.start()
+
+    app.extensions['logging'] = {'handler': queue_handler, 'rate_limit': rate_limit}
+    return queue_handler
+
+def log_stats(app):
+    """Records dropped because the queue was full and suppressed by the rate limit."""
+    pipeline = app.extensions.get('logging')
+    if pipeline is None:
+        return {'dropped': 0, 'suppressed': 0}
+    rate_limit = pipeline['rate_limit']
+    return {
+        'dropped': pipeline['handler'].dropped,
+        'suppressed': rate_limit.suppressed_total if rate_limit else 0,
+    }
+
+def restart_logging_after_fork(app):
+    """Start a new logging pipeline in a forked worker.
+
+    The listener thread of the parent does not exist in the child, and its queue
+    may have been locked mid-operation when the process forked, so both are
+    abandoned rather than stopped.
+    """
+    global _listener
+    _listener = None
+    configure_logging(app)
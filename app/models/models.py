@@ -1,4 +1,5 @@
 import uuid
+import calendar
 from datetime import datetime
 from app import db
 
@@ -13,6 +14,11 @@ class Aggregator(db.Model):
     # Relationship with metrics
     metrics = db.relationship('Metric', backref='aggregator', lazy=True, cascade='all, delete-orphan')
     
+    # Serves sorting the fleet by activity and filtering it by health status
+    __table_args__ = (
+        db.Index('ix_aggregators_last_active', 'last_active'),
+    )
+    
     def __init__(self, name):
         self.uuid = str(uuid.uuid4())
         self.name = name
@@ -40,6 +46,7 @@ class Metric(db.Model):
     
     # Relationship with snapshots
     snapshots = db.relationship('Snapshot', backref='metric', lazy=True, cascade='all, delete-orphan')
+    aggregate_snapshots = db.relationship('AggregateSnapshot', backref='metric', lazy=True, cascade='all, delete-orphan')
     
     # Composite unique constraint
     __table_args__ = (
@@ -58,6 +65,7 @@ class Metric(db.Model):
             'uuid': self.uuid,
             'name': self.name,
             'unit': self.unit,
+            'aggregator_uuid': self.aggregator_uuid,
             'aggregator_name': self.aggregator.name,
             'created_at': self.created_at.isoformat()
         }
@@ -74,6 +82,11 @@ class Snapshot(db.Model):
     # Foreign key to metric
     metric_uuid = db.Column(db.String(36), db.ForeignKey('metrics.uuid'), nullable=False)
     
+    # Covering index for range scans and keyset pagination over a metric's history
+    __table_args__ = (
+        db.Index('ix_snapshots_metric_timestamp_id', 'metric_uuid', 'timestamp', 'id'),
+    )
+    
     def __init__(self, metric_uuid, value, timestamp, offset):
         self.metric_uuid = metric_uuid
         self.value = value
@@ -81,17 +94,211 @@ class Snapshot(db.Model):
         self.offset = offset
         self.created_at = datetime.utcnow()
     
-    def to_dict(self):
+    @property
+    def timestamp_ms(self):
+        """The snapshot timestamp as milliseconds since the Unix epoch (naive values are UTC)."""
+        return calendar.timegm(self.timestamp.utctimetuple()) * 1000 + self.timestamp.microsecond // 1000
+    
+    def serialize_timestamp(self, epoch_ms=False):
+        return self.timestamp_ms if epoch_ms else self.timestamp.isoformat()
+    
+    def to_dict(self, epoch_ms=False):
         return {
             'value': self.value,
-            'timestamp': self.timestamp.isoformat(),
+            'timestamp': self.serialize_timestamp(epoch_ms),
             'offset': self.offset
         }
     
-    def to_dict_with_metric(self):
+    def to_dict_with_id(self, epoch_ms=False):
         return {
+            'id': self.id,
             'metric_uuid': self.metric_uuid,
             'value': self.value,
-            'timestamp': self.timestamp.isoformat(),
+            'timestamp': self.serialize_timestamp(epoch_ms),
             'offset': self.offset
-        } 
\ No newline at end of file
+        }
+    
+    def to_dict_with_metric(self, epoch_ms=False):
+        return {
+            'metric_uuid': self.metric_uuid,
+            'value': self.value,
+            'timestamp': self.serialize_timestamp(epoch_ms),
+            'offset': self.offset
+        }
+
+class AggregateSnapshot(db.Model):
+    """Count, min, max, sum and last value of a metric's samples over a client-side window."""
+    __tablename__ = 'aggregate_snapshots'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    window_start = db.Column(db.DateTime(timezone=True), nullable=False)
+    window_seconds = db.Column(db.Float, nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    min = db.Column(db.Float, nullable=False)
+    max = db.Column(db.Float, nullable=False)
+    sum = db.Column(db.Float, nullable=False)
+    last = db.Column(db.Float, nullable=False)
+    offset = db.Column(db.Integer, nullable=False)  # Client timezone offset in minutes
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    
+    # Foreign key to metric
+    metric_uuid = db.Column(db.String(36), db.ForeignKey('metrics.uuid'), nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_aggregate_snapshots_metric_window_id', 'metric_uuid', 'window_start', 'id'),
+    )
+    
+    @property
+    def window_start_ms(self):
+        """The window start as milliseconds since the Unix epoch (naive values are UTC)."""
+        return calendar.timegm(self.window_start.utctimetuple()) * 1000 + self.window_start.microsecond // 1000
+    
+    def serialize_window_start(self, epoch_ms=False):
+        return self.window_start_ms if epoch_ms else self.window_start.isoformat()
+    
+    def to_dict(self, epoch_ms=False):
+        return {
+            'id': self.id,
+            'metric_uuid': self.metric_uuid,
+            'window_start': self.serialize_window_start(epoch_ms),
+            'window_seconds': self.window_seconds,
+            'count': self.count,
+            'min': self.min,
+            'max': self.max,
+            'sum': self.sum,
+            'mean': self.sum / self.count,
+            'last': self.last,
+            'offset': self.offset
+        }
+    
+    # The aggregate as a point among its metric's snapshots: its last value at the window start,
+    # with the number of samples it stands for
+    def to_snapshot_dict(self, epoch_ms=False):
+        return {
+            'value': self.last,
+            'timestamp': self.serialize_window_start(epoch_ms),
+            'offset': self.offset,
+            'count': self.count
+        }
+    
+    def to_snapshot_dict_with_id(self, epoch_ms=False):
+        return {
+            'id': self.id,
+            'metric_uuid': self.metric_uuid,
+            'value': self.last,
+            'timestamp': self.serialize_window_start(epoch_ms),
+            'offset': self.offset,
+            'count': self.count
+        }
+    
+    def to_snapshot_dict_with_metric(self, epoch_ms=False):
+        return {
+            'metric_uuid': self.metric_uuid,
+            'value': self.last,
+            'timestamp': self.serialize_window_start(epoch_ms),
+            'offset': self.offset,
+            'count': self.count
+        }
+
+class IngestBatch(db.Model):
+    """The Idempotency-Key of an ingested batch, so that a batch sent again is not written twice."""
+    __tablename__ = 'ingest_batches'
+    
+    key = db.Column(db.String(64), primary_key=True)
+    accepted = db.Column(db.Integer, nullable=False)  # Rows written by the first request with the key
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.utcnow, index=True)
+
+class SnapshotImport(db.Model):
+    """Progress of an uploaded backfill, by the import id its client chose, so that a retried upload resumes."""
+    __tablename__ = 'snapshot_imports'
+    
+    id = db.Column(db.String(64), primary_key=True)
+    format = db.Column(db.String(16), nullable=False)
+    line = db.Column(db.Integer, nullable=False, default=0)  # Last line committed
+    imported = db.Column(db.Integer, nullable=False, default=0)
+    rejected = db.Column(db.Integer, nullable=False, default=0)
+    complete = db.Column(db.Boolean, nullable=False, default=False)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    
+    def to_dict(self):
+        return {
+            'import_id': self.id,
+            'format': self.format,
+            'line': self.line,
+            'imported': self.imported,
+            'rejected': self.rejected,
+            'complete': self.complete,
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class AggregatorCommand(db.Model):
+    __tablename__ = 'aggregator_commands'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    command = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime(timezone=True), nullable=True)  # Set once, when the command is claimed
+    
+    # Foreign key to aggregator
+    aggregator_uuid = db.Column(db.String(36), db.ForeignKey('aggregators.uuid', ondelete='CASCADE'), nullable=False)
+    
+    __table_args__ = (
+        db.Index('ix_aggregator_commands_pending', 'aggregator_uuid', 'delivered_at'),
+        db.Index('ix_aggregator_commands_created_at', 'created_at'),
+    )
+    
+    def __init__(self, aggregator_uuid, command, payload=None):
+        self.aggregator_uuid = aggregator_uuid
+        self.command = command
+        self.payload = payload
+        self.created_at = datetime.utcnow()
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'command': self.command,
+            'payload': self.payload,
+            'created_at': self.created_at.isoformat()
+        }
+
+class ReportingConfig(db.Model):
+    __tablename__ = 'reporting_configs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    interval_seconds = db.Column(db.Float, nullable=True)  # How often to report, None keeps the collector default
+    batch_size = db.Column(db.Integer, nullable=True)  # Snapshots per request, None keeps the collector default
+    updated_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    
+    # Foreign keys, a config without a metric applies to the whole aggregator
+    aggregator_uuid = db.Column(db.String(36), db.ForeignKey('aggregators.uuid', ondelete='CASCADE'), nullable=False)
+    metric_uuid = db.Column(db.String(36), db.ForeignKey('metrics.uuid', ondelete='CASCADE'), nullable=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('aggregator_uuid', 'metric_uuid', name='uq_reporting_config_aggregator_metric'),
+    )
+    
+    def __init__(self, aggregator_uuid, metric_uuid=None, interval_seconds=None, batch_size=None):
+        self.aggregator_uuid = aggregator_uuid
+        self.metric_uuid = metric_uuid
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.updated_at = datetime.utcnow()
+    
+    def to_dict(self):
+        return {
+            'metric_uuid': self.metric_uuid,
+            'interval_seconds': self.interval_seconds,
+            'batch_size': self.batch_size,
+            'updated_at': self.updated_at.isoformat()
+        }
+
+class LoadSheddingState(db.Model):
+    """The reporting interval factor shared by all workers, in a single row."""
+    __tablename__ = 'load_shedding_state'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    interval_factor = db.Column(db.Integer, nullable=False, default=1)
+    changed_at = db.Column(db.DateTime(timezone=True), nullable=False, default=datetime.utcnow)
+    overloaded_at = db.Column(db.DateTime(timezone=True), nullable=True)  # Last time any worker was overloaded
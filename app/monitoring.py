@@ -0,0 +1,289 @@
+import logging
+import re
+import time
+from threading import Lock, local
+
+from flask import current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import db
+from app.admission import get_ingest_admission
+from app.log import log_stats
+from app.reporting import get_load_shedder
+from app.telemetry import Histogram, LATENCY_BUCKETS_MS
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+# Endpoint label for SQL run outside of a request, e.g. by background threads
+BACKGROUND = 'background'
+
+# Endpoint label for requests that matched no route
+UNMATCHED = 'unmatched'
+
+# SQL counters of the request running on the current thread
+_current = local()
+
+# Ways of reporting a request over its query budget (QUERY_DEBUG)
+QUERY_DEBUG_MODES = ('off', 'warn', 'raise')
+
+# Placeholder lists of IN clauses, which differ in length between otherwise identical statements
+_PLACEHOLDER_LIST = re.compile(r'\((?:\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|:\w+)\s*\)')
+
+class QueryBudgetExceeded(RuntimeError):
+    """A request ran more SQL statements than its budget, or the same statement too often."""
+
+class RequestMetrics:
+    """Per-endpoint request latency, response status and SQL counters of this worker.
+
+    Endpoints are labelled by their URL rule (e.g. ``/snapshots/<metric_uuid>``) so
+    that the number of series stays bounded. Latencies are kept in milliseconds and
+    converted to seconds when rendered.
+    """
+
+    def __init__(self):
+        self.in_flight = 0
+        self.durations = {}
+        self.responses = {}
+        self.sql_statements = {}
+        self.sql_ms = {}
+        self._lock = Lock()
+
+    def reset(self):
+        """Forget the requests recorded so far, e.g. the ones a worker sent itself to warm up."""
+        with self._lock:
+            self.durations = {}
+            self.responses = {}
+            self.sql_statements = {}
+            self.sql_ms = {}
+
+    def start_request(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finish_request(self, method, endpoint, status, duration_ms, sql_statements, sql_ms):
+        key = (method, endpoint)
+        with self._lock:
+            self.in_flight -= 1
+            histogram = self.durations.get(key)
+            if histogram is None:
+                histogram = self.durations[key] = Histogram(LATENCY_BUCKETS_MS)
+            status_key = (method, endpoint, status)
+            self.responses[status_key] = self.responses.get(status_key, 0) + 1
+            self.sql_statements[endpoint] = self.sql_statements.get(endpoint, 0) + sql_statements
+            self.sql_ms[endpoint] = self.sql_ms.get(endpoint, 0.0) + sql_ms
+        histogram.observe(duration_ms)
+
+    def observe_background_sql(self, sql_ms):
+        with self._lock:
+            self.sql_statements[BACKGROUND] = self.sql_statements.get(BACKGROUND, 0) + 1
+            self.sql_ms[BACKGROUND] = self.sql_ms.get(BACKGROUND, 0.0) + sql_ms
+
+    def snapshot(self):
+        """Copy the counters so that they can be rendered without holding the lock."""
+        with self._lock:
+            durations = {key: (list(histogram.counts), histogram.count, histogram.sum, histogram.buckets)
+                         for key, histogram in self.durations.items()}
+            return self.in_flight, durations, dict(self.responses), dict(self.sql_statements), dict(self.sql_ms)
+
+request_metrics = RequestMetrics()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    sql_ms = (time.perf_counter() - starts.pop()) * 1000
+
+    counters = getattr(_current, 'sql', None)
+    if counters is not None:
+        counters[0] += 1
+        counters[1] += sql_ms
+        shapes = counters[2]
+        if shapes is not None:
+            shapes[statement] = shapes.get(statement, 0) + 1
+    else:
+        request_metrics.observe_background_sql(sql_ms)
+
+def statement_shape(statement):
+    """A statement with whitespace collapsed and IN lists of any length written the same way."""
+    return _PLACEHOLDER_LIST.sub('(...)', ' '.join(statement.split()))
+
+def repeated_statements(shapes, threshold):
+    """Statement shapes run at least threshold times, most repeated first."""
+    counts = {}
+    for statement, count in shapes.items():
+        shape = statement_shape(statement)
+        counts[shape] = counts.get(shape, 0) + count
+    return sorted(((count, shape) for shape, count in counts.items() if count >= threshold), reverse=True)
+
+def query_budget(statements=None, repeats=None):
+    """Override QUERY_BUDGET and QUERY_REPEAT_THRESHOLD for one view, None lifting the limit.
+
+    Meant for views that legitimately run many or repeated statements, such as long polls.
+    """
+    def decorator(view):
+        view.query_budget = (statements, repeats)
+        return view
+    return decorator
+
+def check_query_budget(response, mode, budget, repeat_threshold):
+    """Report the request's statements in headers, and warn or raise if it ran too many."""
+    counters = getattr(_current, 'sql', None)
+    if counters is None:
+        return response
+
+    statements, sql_ms, shapes = counters
+    response.headers['X-Query-Count'] = str(statements)
+
+    view = current_app.view_functions.get(request.endpoint)
+    budget, repeat_threshold = getattr(view, 'query_budget', (budget, repeat_threshold))
+
+    problems = []
+    if budget is not None and statements > budget:
+        problems.append(f'{statements} statements (budget {budget})')
+    if repeat_threshold is not None:
+        for count, shape in repeated_statements(shapes, repeat_threshold):
+            problems.append(f'{count} x {shape[:200]}')
+    if not problems:
+        return response
+
+    message = f"{request.method} {request.path} ran {'; '.join(problems)}"
+    if mode == 'raise':
+        raise QueryBudgetExceeded(message)
+    logger.warning('Query budget exceeded: %s', message, extra={'query_count': statements, 'db_ms': round(sql_ms, 2)})
+    return response
+
+def init_request_metrics(app):
+    """Record latency, status, in-flight and SQL metrics of every request to the app.
+
+    The hooks only take a timestamp, a few dict updates and one lock per request (and
+    two timestamps per SQL statement), so they are cheap enough for the ingest path.
+
+    Every response carries the request's SQL time in an X-DB-Time (ms) header, which
+    the dashboard adds up per callback. With QUERY_DEBUG set to ``warn`` or ``raise``
+    (for development and tests), responses also carry an X-Query-Count header, and a request
+    that runs more than QUERY_BUDGET statements, or one statement shape at least
+    QUERY_REPEAT_THRESHOLD times (an N+1 pattern), is logged as a warning or
+    raises QueryBudgetExceeded.
+    """
+    query_debug = app.config.get('QUERY_DEBUG', 'off')
+    if query_debug not in QUERY_DEBUG_MODES:
+        raise ValueError(f'QUERY_DEBUG must be one of {", ".join(QUERY_DEBUG_MODES)}')
+
+    # Engine listeners are global, registered once however many apps are created (as in tests)
+    if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+    @app.before_request
+    def start_request_timer():
+        request_metrics.start_request()
+        _current.sql = [0, 0.0, {} if query_debug != 'off' else None]
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_response_status(response):
+        g.response_status = response.status_code
+        counters = getattr(_current, 'sql', None)
+        if counters is not None:
+            response.headers['X-DB-Time'] = f'{counters[1]:.2f}'
+        return response
+
+    if query_debug != 'off':
+        @app.after_request
+        def report_queries(response):
+            return check_query_budget(response, query_debug, app.config['QUERY_BUDGET'],
+                                      app.config['QUERY_REPEAT_THRESHOLD'])
+
+    @app.teardown_request
+    def record_request(exc):
+        started = g.pop('request_started', None)
+        if started is None:
+            return
+
+        duration_ms = (time.perf_counter() - started) * 1000
+        sql_statements, sql_ms, _ = _current.sql
+        _current.sql = None
+
+        endpoint = request.url_rule.rule if request.url_rule is not None else UNMATCHED
+        status = g.pop('response_status', 500)
+        request_metrics.finish_request(request.method, endpoint, status, duration_ms, sql_statements, sql_ms)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+def _pool_stats():
+    """Connection pool usage of the default engine, for pools that track it."""
+    pool = db.engine.pool
+    stats = {}
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        method = getattr(pool, name, None)
+        if method is not None:
+            stats[name] = method()
+    return stats
+
+def render_prometheus():
+    """Render this worker's request, SQL, connection pool, ingest and logging metrics in Prometheus text format."""
+    in_flight, durations, responses, sql_statements, sql_ms = request_metrics.snapshot()
+    lines = []
+
+    def metric(name, kind, help_text):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+
+    metric('coc_http_requests_in_flight', 'gauge', 'Requests currently being handled by this worker.')
+    lines.append(f'coc_http_requests_in_flight {in_flight}')
+
+    metric('coc_http_requests_total', 'counter', 'Requests handled, by method, endpoint and status code.')
+    for (method, endpoint, status), count in sorted(responses.items()):
+        lines.append(f'coc_http_requests_total{_labels(method=method, endpoint=endpoint, status=status)} {count}')
+
+    metric('coc_http_request_duration_seconds', 'histogram', 'Request latency, by method and endpoint.')
+    for (method, endpoint), (counts, count, total_ms, buckets) in sorted(durations.items()):
+        cumulative = 0
+        for bound, bucket_count in zip(buckets, counts):
+            cumulative += bucket_count
+            labels = _labels(method=method, endpoint=endpoint, le=f'{bound / 1000:g}')
+            lines.append(f'coc_http_request_duration_seconds_bucket{labels} {cumulative}')
+        lines.append(f'coc_http_request_duration_seconds_bucket{_labels(method=method, endpoint=endpoint, le="+Inf")} {count}')
+        lines.append(f'coc_http_request_duration_seconds_sum{_labels(method=method, endpoint=endpoint)} {total_ms / 1000:.6f}')
+        lines.append(f'coc_http_request_duration_seconds_count{_labels(method=method, endpoint=endpoint)} {count}')
+
+    metric('coc_db_statements_total', 'counter', 'SQL statements executed, by endpoint.')
+    for endpoint, count in sorted(sql_statements.items()):
+        lines.append(f'coc_db_statements_total{_labels(endpoint=endpoint)} {count}')
+
+    metric('coc_db_statement_seconds_total', 'counter', 'Time spent executing SQL statements, by endpoint.')
+    for endpoint, total_ms in sorted(sql_ms.items()):
+        lines.append(f'coc_db_statement_seconds_total{_labels(endpoint=endpoint)} {total_ms / 1000:.6f}')
+
+    for name, value in _pool_stats().items():
+        metric(f'coc_db_pool_{name}', 'gauge', f'Connection pool {name} of the default engine.')
+        lines.append(f'coc_db_pool_{name} {value}')
+
+    shedder = get_load_shedder()
+    metric('coc_ingest_queue_depth', 'gauge', 'Ingest requests currently writing to the database.')
+    lines.append(f'coc_ingest_queue_depth {shedder.queue_depth}')
+    metric('coc_ingest_write_latency_seconds', 'gauge', 'Smoothed latency of ingest commits.')
+    lines.append(f'coc_ingest_write_latency_seconds {shedder.write_latency_ms / 1000:.6f}')
+    metric('coc_ingest_interval_factor', 'gauge', 'Factor applied to collectors\' reporting intervals by load shedding.')
+    lines.append(f'coc_ingest_interval_factor {shedder.factor}')
+
+    metric('coc_ingest_rejected_total', 'counter', 'Ingest requests answered with 429, by the limit they were over.')
+    for reason, count in sorted(get_ingest_admission().to_dict()['rejected'].items()):
+        lines.append(f'coc_ingest_rejected_total{_labels(reason=reason)} {count}')
+
+    logs = log_stats(current_app)
+    metric('coc_log_records_dropped_total', 'counter', 'Log records dropped because the logging queue was full.')
+    lines.append(f'coc_log_records_dropped_total {logs["dropped"]}')
+    metric('coc_log_records_suppressed_total', 'counter', 'Log records suppressed by the per-message rate limit.')
+    lines.append(f'coc_log_records_suppressed_total {logs["suppressed"]}')
+
+    return '\n'.join(lines) + '\n'
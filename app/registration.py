@@ -0,0 +1,71 @@
+import uuid
+from datetime import datetime
+
+from sqlalchemy import select
+
+from app import db
+from app.models.models import Aggregator, Metric
+
+class RegistrationError(ValueError):
+    """Raised when a registration request is malformed."""
+
+def _insert(model):
+    """Return an INSERT for the model that supports ON CONFLICT on the current database."""
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
+def parse_metrics(metrics):
+    """Validate the metrics of a registration request and return them as {name: unit}."""
+    if not isinstance(metrics, list):
+        raise RegistrationError('Metrics must be a list')
+
+    units = {}
+    for metric in metrics:
+        if not isinstance(metric, dict) or 'name' not in metric or 'unit' not in metric:
+            raise RegistrationError('Every metric needs a name and a unit')
+        if units.get(metric['name'], metric['unit']) != metric['unit']:
+            raise RegistrationError(f'Metric "{metric["name"]}" is listed with different units')
+        units[metric['name']] = metric['unit']
+    return units
+
+def register(name, units):
+    """Upsert an aggregator and its metrics in one transaction.
+
+    Existing rows are reused on conflict, so registering the same name and metrics
+    again returns the same UUIDs. The aggregator's last_active is refreshed. A metric
+    that already exists keeps its original unit. This costs three statements however
+    many metrics there are: the aggregator upsert, one multi-row metric insert and
+    one select of the metric UUIDs.
+    """
+    now = datetime.utcnow()
+
+    aggregator_uuid = db.session.execute(
+        _insert(Aggregator)
+        .values(uuid=str(uuid.uuid4()), name=name, created_at=now, last_active=now)
+        .on_conflict_do_update(index_elements=['name'], set_={'last_active': now})
+        .returning(Aggregator.uuid)
+    ).scalar_one()
+
+    metrics = {}
+    if units:
+        db.session.execute(
+            _insert(Metric)
+            .values([
+                {'uuid': str(uuid.uuid4()), 'aggregator_uuid': aggregator_uuid, 'name': metric_name,
+                 'unit': unit, 'created_at': now}
+                for metric_name, unit in units.items()
+            ])
+            .on_conflict_do_nothing(index_elements=['aggregator_uuid', 'name'])
+        )
+
+        rows = db.session.execute(
+            select(Metric.name, Metric.uuid, Metric.unit)
+            .where(Metric.aggregator_uuid == aggregator_uuid, Metric.name.in_(list(units)))
+        )
+        metrics = {metric_name: {'uuid': metric_uuid, 'unit': unit} for metric_name, metric_uuid, unit in rows}
+
+    db.session.commit()
+    return {'uuid': aggregator_uuid, 'metrics': metrics}
@@ -0,0 +1,282 @@
+import logging
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from threading import Event, Lock, Thread
+
+from flask import current_app
+from sqlalchemy import or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.commands import get_command_store
+from app.models.models import Aggregator, LoadSheddingState, ReportingConfig
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+# Row of the load_shedding_state table holding the shared interval factor
+SHARED_STATE_ID = 1
+
+class LoadShedder:
+    """Raise collectors' reporting intervals while ingestion falls behind.
+
+    Tracks the ingest queue depth (concurrent ingest requests in this worker) and an
+    exponentially weighted average of DB write latency. Every ``evaluate_interval``
+    seconds a background thread compares them with their thresholds and updates
+    the interval factor, which all workers share in the load_shedding_state row:
+    an overloaded worker doubles it, and once no worker has been overloaded for
+    two intervals, a recovered worker halves it. The factor changes at most once
+    per interval, and the worker whose update changed it sends the new config to
+    recently active aggregators as ``configure`` commands. ``factor`` is this
+    worker's copy of the shared value, refreshed at every evaluation; configs are
+    built from the shared value itself (see ``shared_factor``).
+    """
+
+    def __init__(self, app=None, queue_depth_threshold=50, write_latency_threshold_ms=250, max_factor=8,
+                 evaluate_interval=10, recover_ratio=0.5, smoothing=0.2):
+        self.app = app
+        self.queue_depth_threshold = queue_depth_threshold
+        self.write_latency_threshold_ms = write_latency_threshold_ms
+        self.max_factor = max_factor
+        self.evaluate_interval = evaluate_interval
+        self.recover_ratio = recover_ratio
+        self.smoothing = smoothing
+
+        self.factor = 1
+        self.queue_depth = 0
+        self.peak_queue_depth = 0
+        self.write_latency_ms = 0.0
+        self._writes = 0
+        self._lock = Lock()
+        self._thread = None
+        self._stopped = Event()
+
+    @contextmanager
+    def track_ingest(self):
+        """Count a request as queued for ingestion while the block runs."""
+        with self._lock:
+            self.queue_depth += 1
+            self.peak_queue_depth = max(self.peak_queue_depth, self.queue_depth)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.queue_depth -= 1
+
+    def observe_write(self, latency_ms):
+        with self._lock:
+            self.write_latency_ms += self.smoothing * (latency_ms - self.write_latency_ms)
+            self._writes += 1
+
+    def start(self):
+        """Start the evaluating thread of this worker, once."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='load-shedder', daemon=True)
+                self._thread.start()
+
+    def ensure_started(self):
+        """Start the evaluating thread unless it was started already, without taking the lock once it was."""
+        if self._thread is None:
+            self.start()
+
+    def stop(self, timeout=5):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stopped.wait(self.evaluate_interval):
+            try:
+                with self.app.app_context():
+                    self.evaluate()
+            except Exception as e:
+                logger.error('Error evaluating ingest load: %s', e)
+                db.session.remove()
+
+    def pressure(self):
+        """'overloaded' or 'recovered' from the load seen since the previous call, else None."""
+        with self._lock:
+            # The write latency average is only current if this worker wrote since the previous call
+            slow_writes = self._writes and self.write_latency_ms >= self.write_latency_threshold_ms
+            fast_writes = (not self._writes
+                           or self.write_latency_ms < self.write_latency_threshold_ms * self.recover_ratio)
+            overloaded = self.peak_queue_depth >= self.queue_depth_threshold or slow_writes
+            recovered = self.peak_queue_depth < self.queue_depth_threshold * self.recover_ratio and fast_writes
+            self.peak_queue_depth = self.queue_depth
+            self._writes = 0
+
+        if overloaded:
+            return 'overloaded'
+        return 'recovered' if recovered else None
+
+    def evaluate(self):
+        """Apply this worker's load to the shared factor, returning the new factor if this worker changed it.
+
+        The worker that changed the factor sends the new config to the aggregators.
+        """
+        factor, changed = update_shared_factor(self.pressure(), self.max_factor, self.evaluate_interval)
+        self.factor = factor
+        if not changed:
+            return None
+
+        count = broadcast_config(factor)
+        logger.warning('Ingest load changed, reporting interval factor is now %s (sent to %d aggregators).',
+                       factor, count, extra={'interval_factor': factor})
+        return factor
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'interval_factor': self.factor,
+                'queue_depth': self.queue_depth,
+                'peak_queue_depth': self.peak_queue_depth,
+                'write_latency_ms': round(self.write_latency_ms, 3),
+                'queue_depth_threshold': self.queue_depth_threshold,
+                'write_latency_threshold_ms': self.write_latency_threshold_ms,
+            }
+
+def init_load_shedder(app):
+    # Ingest admission caps the queue depth, so having every ingest slot taken counts as overloaded
+    queue_depth_threshold = app.config['SHED_QUEUE_DEPTH']
+    if app.config.get('INGEST_MAX_CONCURRENCY'):
+        queue_depth_threshold = min(queue_depth_threshold, app.config['INGEST_MAX_CONCURRENCY'])
+
+    shedder = LoadShedder(
+        app,
+        queue_depth_threshold=queue_depth_threshold,
+        write_latency_threshold_ms=app.config['SHED_WRITE_LATENCY_MS'],
+        max_factor=app.config['SHED_MAX_FACTOR'],
+        evaluate_interval=app.config['SHED_EVALUATE_INTERVAL'],
+    )
+    app.extensions['load_shedder'] = shedder
+    return shedder
+
+def get_load_shedder():
+    return current_app.extensions['load_shedder']
+
+def update_shared_factor(pressure, max_factor, interval):
+    """Apply one worker's load to the shared interval factor, returning (factor, whether this call changed it).
+
+    Each change is an UPDATE conditional on the factor that was read and on the
+    last change being at least ``interval`` seconds old, so two workers never
+    both change it, and a recovered worker never halves it while another one
+    reported overload within the last two intervals.
+    """
+    factor = db.session.execute(
+        select(LoadSheddingState.interval_factor).where(LoadSheddingState.id == SHARED_STATE_ID)
+    ).scalar_one_or_none()
+    if factor is None:
+        try:
+            # Created as if last changed long ago, so that the first evaluation can change it
+            db.session.add(LoadSheddingState(id=SHARED_STATE_ID, interval_factor=1, changed_at=datetime(2000, 1, 1)))
+            db.session.commit()
+        except IntegrityError:
+            # Another worker created it first
+            db.session.rollback()
+        factor = 1
+
+    now = datetime.utcnow()
+    settled = now - timedelta(seconds=interval)
+    conditions = [LoadSheddingState.id == SHARED_STATE_ID, LoadSheddingState.interval_factor == factor,
+                  LoadSheddingState.changed_at <= settled]
+    values = None
+    if pressure == 'overloaded' and factor < max_factor:
+        values = {'interval_factor': min(factor * 2, max_factor), 'changed_at': now, 'overloaded_at': now}
+    elif pressure == 'recovered' and factor > 1:
+        values = {'interval_factor': max(factor // 2, 1), 'changed_at': now}
+        # Two intervals, so that every worker has evaluated its load at least once since
+        quiet = now - timedelta(seconds=2 * interval)
+        conditions.append(or_(LoadSheddingState.overloaded_at.is_(None), LoadSheddingState.overloaded_at <= quiet))
+
+    try:
+        changed = values is not None and db.session.execute(
+            update(LoadSheddingState).where(*conditions).values(**values)
+        ).rowcount == 1
+        if pressure == 'overloaded' and not changed:
+            db.session.execute(
+                update(LoadSheddingState).where(LoadSheddingState.id == SHARED_STATE_ID).values(overloaded_at=now)
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    if changed:
+        return values['interval_factor'], True
+    return db.session.execute(
+        select(LoadSheddingState.interval_factor).where(LoadSheddingState.id == SHARED_STATE_ID)
+    ).scalar_one(), False
+
+def shared_factor():
+    """The interval factor currently shared by all workers, 1 until load shedding first evaluated it."""
+    factor = db.session.execute(
+        select(LoadSheddingState.interval_factor).where(LoadSheddingState.id == SHARED_STATE_ID)
+    ).scalar_one_or_none()
+    return factor or 1
+
+def effective_config(aggregator_uuid, configs=None, factor=None):
+    """The reporting config to send to an aggregator, with the load shedding factor applied.
+
+    ``interval_factor`` is included so that collectors without an operator-set
+    interval can scale their own default. The factor is read from the shared
+    state unless given, so every worker answers with the same one.
+    """
+    if configs is None:
+        configs = ReportingConfig.query.filter_by(aggregator_uuid=aggregator_uuid).all()
+    if factor is None:
+        factor = shared_factor()
+
+    def scaled(config):
+        return {
+            'interval_seconds': config.interval_seconds * factor if config.interval_seconds else None,
+            'batch_size': config.batch_size,
+        }
+
+    base = next((c for c in configs if c.metric_uuid is None), None)
+    return {
+        'interval_factor': factor,
+        **(scaled(base) if base else {'interval_seconds': None, 'batch_size': None}),
+        'metrics': {c.metric_uuid: scaled(c) for c in configs if c.metric_uuid is not None},
+    }
+
+def set_config(aggregator_uuid, metric_uuid=None, interval_seconds=None, batch_size=None):
+    """Store an operator's reporting config and send the result to the aggregator."""
+    config = ReportingConfig.query.filter_by(aggregator_uuid=aggregator_uuid, metric_uuid=metric_uuid).first()
+    if config is None:
+        config = ReportingConfig(aggregator_uuid=aggregator_uuid, metric_uuid=metric_uuid)
+        db.session.add(config)
+
+    config.interval_seconds = interval_seconds
+    config.batch_size = batch_size
+    config.updated_at = datetime.utcnow()
+    db.session.commit()
+
+    payload = effective_config(aggregator_uuid)
+    get_command_store().enqueue(aggregator_uuid, 'configure', payload)
+    return payload
+
+def broadcast_config(factor=None):
+    """Send the effective config to every aggregator that reported recently, with the shared factor unless given."""
+    if factor is None:
+        factor = shared_factor()
+    window = timedelta(seconds=current_app.config['SHED_ACTIVE_WINDOW'])
+    aggregator_uuids = [uuid for uuid, in db.session.query(Aggregator.uuid)
+                        .filter(Aggregator.last_active >= datetime.utcnow() - window)]
+
+    configs = {}
+    for config in ReportingConfig.query.filter(ReportingConfig.aggregator_uuid.in_(aggregator_uuids)):
+        configs.setdefault(config.aggregator_uuid, []).append(config)
+
+    get_command_store().enqueue_many([
+        (uuid, 'configure', effective_config(uuid, configs.get(uuid, []), factor))
+        for uuid in aggregator_uuids
+    ])
+    return len(aggregator_uuids)
+
+def after_ingest_write(latency_ms):
+    """Record a DB write on the ingest path. The load is evaluated by the shedder's thread, off the request path."""
+    shedder = get_load_shedder()
+    shedder.observe_write(latency_ms)
+    shedder.ensure_started()
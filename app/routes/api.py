@@ -1,22 +1,166 @@
-from flask import Blueprint, request, jsonify
-from datetime import datetime
-from sqlalchemy.exc import IntegrityError
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import and_, or_, func, cast, false, true, Integer, Float
+from sqlalchemy.exc import (DisconnectionError, IntegrityError, InterfaceError, OperationalError, SQLAlchemyError,
+                            TimeoutError as PoolTimeoutError)
+from sqlalchemy.orm import aliased, joinedload
+import base64
+import heapq
+import json
+from itertools import islice
 import logging
+import math
 from app import db
-from app.models.models import Aggregator, Metric, Snapshot
+from app.admission import IngestRejected, get_ingest_admission, import_route, ingest_route, rejected_response
+from app.backfill import IMPORT_FORMATS, import_stream
+from app.commands import AggregatorNotFound, get_command_store
+from app.export import (EXPORT_CHUNK_ROWS, EXPORT_FORMATS, ExportUnavailable, acquire_export_slot, export_chunks,
+                        limit_idle_transaction, snapshot_batches)
+from app.ingest import (MAX_IDEMPOTENCY_KEY_LENGTH, BodyTooLarge, IngestError, TooManyRecords, UnknownMetrics,
+                        UnsupportedFormat, decode_batch_stream, decode_snapshot, decompressed_chunks, write_snapshots)
+from app.models.models import AggregateSnapshot, Aggregator, Metric, Snapshot, SnapshotImport
+from app.monitoring import query_budget
+from app.registration import RegistrationError, parse_metrics, register
+from app.reporting import effective_config, set_config
 
 # Get logger for this module
 logger = logging.getLogger(__name__)
 
 api_bp = Blueprint('api', __name__)
 
-# Dictionary to store shutdown status for aggregators
-shutdown_status = {}
+# Columns that /snapshots/page can sort and filter on
+PAGE_COLUMNS = {
+    'timestamp': Snapshot.timestamp,
+    'value': Snapshot.value,
+}
+
+# The same columns of aggregate snapshots, which are paged as their last value at the window start
+AGGREGATE_PAGE_COLUMNS = {
+    'timestamp': AggregateSnapshot.window_start,
+    'value': AggregateSnapshot.last,
+}
+
+# Kinds of rows of a /snapshots/page page, in the order rows with the same sort value are paged
+SNAPSHOT_ROW, AGGREGATE_ROW = 0, 1
+
+PAGE_OPERATORS = {
+    '=': lambda column, operand: column == operand,
+    '!=': lambda column, operand: column != operand,
+    '<': lambda column, operand: column < operand,
+    '<=': lambda column, operand: column <= operand,
+    '>': lambda column, operand: column > operand,
+    '>=': lambda column, operand: column >= operand,
+}
+
+MAX_PAGE_SIZE = 1000
+
+# Deepest offset /snapshots/page skips, as both tables are read up to offset + limit rows to merge them;
+# deeper pages are reached with the cursor
+MAX_PAGE_OFFSET = 10000
+
+# Columns that /aggregators can sort on
+AGGREGATOR_SORT_COLUMNS = {
+    'name': Aggregator.name,
+    'last_active': Aggregator.last_active,
+    'created_at': Aggregator.created_at,
+}
+
+AGGREGATOR_STATUSES = ('active', 'stale', 'offline')
+
+# Longest a /commands long poll may be held open, in seconds
+MAX_COMMAND_WAIT = 60
+
+# Maximum number of buckets /snapshots/series downsamples a range into
+MAX_SERIES_POINTS = 5000
+
+# Largest number of snapshots accepted by /snapshots/batch
+MAX_BATCH_SIZE = 10000
+
+# Database failures that may succeed on retry: a locked or unreachable database, or an exhausted pool
+TRANSIENT_DB_ERRORS = (OperationalError, InterfaceError, DisconnectionError, PoolTimeoutError)
+
+# Seconds an ingest client is asked to wait after a transient database failure
+DB_RETRY_AFTER = 1
+
+def wants_epoch_ms():
+    """Whether the client asked for timestamps as epoch milliseconds instead of ISO8601."""
+    return request.args.get('time_format') == 'epoch_ms'
+
+def ingest_failure(error):
+    """The response to an unexpected error while writing ingested rows.
+    
+    Transient database failures answer 503 with Retry-After, so that clients
+    keep the batch and send it again. The error itself is only logged: its text
+    can contain the SQL statement and the submitted values.
+    """
+    if isinstance(error, TRANSIENT_DB_ERRORS):
+        logger.warning('Ingest write failed, database unavailable: %s', getattr(error, 'orig', None) or error)
+        response = jsonify({'error': 'Database unavailable, retry later', 'retry_after': DB_RETRY_AFTER})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(DB_RETRY_AFTER)
+        return response
+    
+    logger.exception('Ingest write failed')
+    if isinstance(error, SQLAlchemyError):
+        # Constraint and data errors fail again on retry
+        return jsonify({'error': 'Rejected by the database'}), 400
+    return jsonify({'error': 'Internal server error'}), 500
+
+def parse_page_operand(column_name, operand):
+    """Convert a filter or cursor operand to the type of the given column."""
+    if column_name == 'timestamp':
+        return datetime.fromisoformat(operand.replace('Z', '+00:00'))
+    return float(operand)
+
+def epoch_seconds(column):
+    """SQL expression for a timestamp column as (fractional) seconds since the Unix epoch."""
+    if db.engine.dialect.name == 'sqlite':
+        return (func.julianday(column) - 2440587.5) * 86400.0
+    return cast(func.extract('epoch', column), Float)
+
+def bucket_index(column, start_seconds, bucket_seconds):
+    """SQL expression for the index of the fixed-width bucket a timestamp falls into."""
+    position = (epoch_seconds(column) - start_seconds) / bucket_seconds
+    if db.engine.dialect.name == 'sqlite':
+        # Timestamps are never before the start of the range, so truncation is a floor
+        return cast(position, Integer)
+    return cast(func.floor(position), Integer)
+
+def encode_cursor(sort_value, snapshot_id, kind=SNAPSHOT_ROW):
+    """Encode the sort key of the last row of a page as an opaque cursor."""
+    key = [sort_value, snapshot_id] if kind == SNAPSHOT_ROW else [sort_value, snapshot_id, kind]
+    raw = json.dumps(key).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor):
+    """Decode a cursor created by encode_cursor into (sort_value, id, kind)."""
+    sort_value, snapshot_id, *kind = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    kind = int(kind[0]) if kind else SNAPSHOT_ROW
+    if kind not in (SNAPSHOT_ROW, AGGREGATE_ROW):
+        raise ValueError(f'Unknown row kind {kind}')
+    return sort_value, int(snapshot_id), kind
+
+def page_sort_value(record, kind, sort):
+    """The value a /snapshots/page row is sorted on, for a snapshot or an aggregate snapshot."""
+    if kind == SNAPSHOT_ROW:
+        return record.timestamp if sort == 'timestamp' else record.value
+    return record.window_start if sort == 'timestamp' else record.last
+
+def after_cursor(sort_column, id_column, kind, cursor, ascending=True):
+    """Filter for the rows of one kind that come after a cursor in (sort value, kind, id) order."""
+    sort_value, last_id, cursor_kind = cursor
+    if kind == cursor_kind:
+        ties = id_column > last_id if ascending else id_column < last_id
+    else:
+        # Rows of another kind with the cursor's sort value are all on one side of it
+        ties = true() if (kind > cursor_kind) == ascending else false()
+    beyond = sort_column > sort_value if ascending else sort_column < sort_value
+    return or_(beyond, and_(sort_column == sort_value, ties))
 
 @api_bp.route('/register_aggregator', methods=['POST'])
 def register_aggregator():
     data = request.get_json()
-    logger.debug(f"/register_aggregator request body: {data}")
+    logger.debug('/register_aggregator request body: %s', data)
     
     if not data or 'name' not in data:
         return jsonify({'error': 'Name is required'}), 400
@@ -38,7 +182,7 @@ def register_aggregator():
 @api_bp.route('/register_metric', methods=['POST'])
 def register_metric():
     data = request.get_json()
-    logger.debug(f"/register_metric request body: {data}")
+    logger.debug('/register_metric request body: %s', data)
     
     if not data or 'aggregator_uuid' not in data or 'name' not in data or 'unit' not in data:
         return jsonify({'error': 'Aggregator UUID, metric name, and unit are required'}), 400
@@ -56,7 +200,7 @@ def register_metric():
         metric = Metric(aggregator_uuid=aggregator_uuid, name=name, unit=unit)
         db.session.add(metric)
         db.session.commit()
-        logger.debug(f"Metric registered with UUID: {metric.uuid}")
+        logger.debug('Metric registered with UUID: %s', metric.uuid)
         return jsonify({'uuid': metric.uuid}), 201
     except IntegrityError:
         db.session.rollback()
@@ -65,45 +209,184 @@ def register_metric():
         db.session.rollback()
         return jsonify({'error': str(e)}), 400
 
-@api_bp.route('/snapshot', methods=['POST'])
-def submit_snapshot():
+@api_bp.route('/register', methods=['POST'])
+def register_aggregator_and_metrics():
+    """Register an aggregator and all of its metrics, reusing existing ones.
+    
+    Safe to call on every collector start: the same name and metrics always map to
+    the same UUIDs.
+    """
     data = request.get_json()
+    logger.debug('/register request body: %s', data)
     
-    if not data or 'metric_uuid' not in data or 'value' not in data or 'timestamp' not in data or 'offset' not in data:
-        return jsonify({'error': 'Metric UUID, value, timestamp, and offset are required'}), 400
+    if not data or 'name' not in data:
+        return jsonify({'error': 'Name is required'}), 400
     
-    metric_uuid = data['metric_uuid']
-    value = data['value']
-    timestamp_str = data['timestamp']
-    offset = data['offset']
+    try:
+        units = parse_metrics(data.get('metrics', []))
+        return jsonify(register(data['name'], units))
+    except RegistrationError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
+
+@api_bp.route('/snapshot', methods=['POST'])
+@ingest_route
+def submit_snapshot():
+    """Submit one snapshot.
     
-    # Check if metric exists
-    metric = Metric.query.get(metric_uuid)
-    if not metric:
-        return jsonify({'error': f'Metric with UUID "{metric_uuid}" not found'}), 404
+    The body is {"metric_uuid", "value", "timestamp", "offset"}, validated and
+    converted in one pass before any database work. The timestamp is an ISO8601
+    string or milliseconds since the Unix epoch.
+    """
+    try:
+        snapshot = decode_snapshot(request.get_data())
+    except IngestError as e:
+        return jsonify({'error': str(e)}), 400
     
+    metric_uuid = snapshot['metric_uuid']
     try:
-        # Parse timestamp
-        timestamp = datetime.fromisoformat(timestamp_str.replace('Z', '+00:00'))
-        
-        # Create snapshot
-        snapshot = Snapshot(metric_uuid=metric_uuid, value=value, timestamp=timestamp, offset=offset)
-        db.session.add(snapshot)
-        
-        # Update aggregator's last_active timestamp
-        metric.aggregator.last_active = datetime.utcnow()
-        
-        db.session.commit()
+        get_ingest_admission().check_rate([metric_uuid])
+        write_snapshots([snapshot])
         return '', 201
-    except ValueError:
-        return jsonify({'error': 'Invalid timestamp format. Use ISO8601 UTC format.'}), 400
+    except IngestRejected as e:
+        return rejected_response(e)
+    except UnknownMetrics:
+        # Rate limited by the logging pipeline, a misconfigured collector can send many of these
+        logger.warning('Snapshot for unknown metric %s', metric_uuid, extra={'metric_uuid': metric_uuid})
+        return jsonify({'error': f'Metric with UUID "{metric_uuid}" not found'}), 404
+    except IngestError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        db.session.rollback()
+        return ingest_failure(e)
+
+@api_bp.route('/snapshots/batch', methods=['POST'])
+@ingest_route
+def submit_snapshots():
+    """Submit many snapshots and aggregates, of any metrics, in one request and one transaction.
+    
+    The JSON body is {"snapshots": [...], "aggregates": [...]}, either list
+    optional. Snapshots have the same fields as /snapshot; aggregates summarize a
+    metric's samples over a client-side window with window_start, window_seconds,
+    count, min, max, sum, last and offset. Snapshots can also be sent as
+    ``text/plain`` lines of ``metric_uuid value epoch_ms offset``, or as an
+    ``application/msgpack`` array of [metric_uuid, value, timestamp, offset]
+    arrays. The body may be compressed with Content-Encoding gzip, deflate or
+    zstd. A record of the wrong type rejects the whole batch, naming its path or
+    line, before any database work.
+    
+    Only line protocol is decoded as it streams in. JSON and MessagePack bodies
+    are read whole, up to MAX_BUFFERED_BODY_BYTES once decompressed, and then
+    decoded; larger bodies, like batches over MAX_BATCH_SIZE records, get a 413.
+    
+    Clients that retry should send an Idempotency-Key header, unique to the
+    batch: a batch sent again with the key of one already written is answered
+    with the earlier count and not written twice.
+    """
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH:
+        return jsonify({'error': f'Idempotency-Key must be 1 to {MAX_IDEMPOTENCY_KEY_LENGTH} characters'}), 400
+    
+    try:
+        rows, aggregate_rows = decode_batch_stream(request.stream, request.mimetype,
+                                                   request.headers.get('Content-Encoding'), MAX_BATCH_SIZE)
+    except UnsupportedFormat as e:
+        return jsonify({'error': str(e)}), 415
+    except (TooManyRecords, BodyTooLarge) as e:
+        return jsonify({'error': str(e)}), 413
+    except IngestError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        get_ingest_admission().check_rate({row['metric_uuid'] for row in rows + aggregate_rows})
+        count = write_snapshots(rows, aggregate_rows, idempotency_key)
+        return jsonify({'accepted': count}), 201
+    except IngestRejected as e:
+        return rejected_response(e)
+    except UnknownMetrics as e:
+        logger.warning('Snapshot batch for %d unknown metrics', len(e.metric_uuids))
+        return jsonify({'error': str(e), 'metric_uuids': sorted(e.metric_uuids)}), 404
+    except IngestError as e:
         return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return ingest_failure(e)
+
+# Longest import_id of a /snapshots/import upload
+MAX_IMPORT_ID_LENGTH = 64
+
+# Content-Types of /snapshots/import bodies, when no format is given
+IMPORT_CONTENT_TYPES = {
+    'application/x-ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+    'text/csv': 'csv',
+}
+
+@api_bp.route('/snapshots/import', methods=['POST'])
+@import_route
+@query_budget(statements=None, repeats=None)
+def import_snapshots():
+    """Backfill snapshots from an NDJSON or CSV upload, streamed and committed in batches.
+    
+    Rows name their metric by metric_uuid, or by metric and aggregator (or the
+    ``aggregator`` parameter), as for ``flask snapshots-import``. The format is
+    the ``format`` parameter or the Content-Type, and the body may be compressed
+    with Content-Encoding gzip, deflate or zstd. Bad rows are counted and
+    reported rather than failing the upload. The response's ``line`` is the last
+    line committed; if an upload breaks off, sending the file again with
+    ``start_line`` set to it skips the rows already imported.
+    
+    With an ``import_id`` chosen by the client, the server keeps that progress
+    itself: sending the file again with the same id, after a broken connection
+    or a 503 from a database failure, resumes after the last committed line.
+    
+    Uploads hold one of the worker's IMPORT_MAX_CONCURRENCY import slots, not an
+    ingest slot. Under the gevent worker they are written with executemany, not
+    COPY: psycopg2 refuses COPY once its wait callback is set.
+    """
+    format = request.args.get('format') or IMPORT_CONTENT_TYPES.get(request.mimetype)
+    if format not in IMPORT_FORMATS:
+        return jsonify({'error': f'Format must be one of {", ".join(IMPORT_FORMATS)}'}), 415
+    
+    try:
+        start_line = int(request.args.get('start_line', 0))
+    except ValueError:
+        return jsonify({'error': 'start_line must be an integer'}), 400
+    
+    import_id = request.args.get('import_id')
+    if import_id is not None and not 0 < len(import_id) <= MAX_IMPORT_ID_LENGTH:
+        return jsonify({'error': f'import_id must be 1 to {MAX_IMPORT_ID_LENGTH} characters'}), 400
+    
+    chunks = decompressed_chunks(request.stream, request.headers.get('Content-Encoding'), max_bytes=None)
+    try:
+        result = import_stream(chunks, format, request.args.get('aggregator'), start_line, import_id=import_id)
+    except IngestError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return ingest_failure(e)
+    
+    logger.info('Imported %d snapshots from a %s upload, %d rows rejected', result['imported'], format,
+                result['rejected'])
+    return jsonify(result), 201
+
+@api_bp.route('/snapshots/import/<import_id>', methods=['GET'])
+def get_snapshot_import(import_id):
+    """Progress of an upload sent with an import_id: the last line committed, the totals and whether it completed."""
+    progress = db.session.get(SnapshotImport, import_id)
+    if progress is None:
+        return jsonify({'error': f'Import "{import_id}" not found'}), 404
+    return jsonify(progress.to_dict())
 
 @api_bp.route('/metrics', methods=['GET'])
 def get_metrics():
-    metrics = Metric.query.all()
+    """Fetch all registered metrics, or only those of the aggregator given as ``aggregator_uuid``."""
+    aggregator_uuid = request.args.get('aggregator_uuid')
+    
+    # Load each metric's aggregator in the same query, to_dict() reads its name
+    query = Metric.query.options(joinedload(Metric.aggregator))
+    if aggregator_uuid:
+        query = query.filter_by(aggregator_uuid=aggregator_uuid)
+    metrics = query.all()
     return jsonify([metric.to_dict() for metric in metrics])
 
 @api_bp.route('/snapshots', methods=['GET'])
@@ -121,12 +404,14 @@ def get_snapshots():
         return jsonify({'error': f'Metric with UUID "{metric_uuid}" not found'}), 404
     
     query = Snapshot.query.filter_by(metric_uuid=metric_uuid)
+    aggregate_query = AggregateSnapshot.query.filter_by(metric_uuid=metric_uuid)
     
     # Apply time filters if provided
     if start_time:
         try:
             start_datetime = datetime.fromisoformat(start_time.replace('Z', '+00:00'))
             query = query.filter(Snapshot.timestamp >= start_datetime)
+            aggregate_query = aggregate_query.filter(AggregateSnapshot.window_start >= start_datetime)
         except ValueError:
             return jsonify({'error': 'Invalid start time format. Use ISO8601 UTC format.'}), 400
     
@@ -134,30 +419,568 @@ def get_snapshots():
         try:
             end_datetime = datetime.fromisoformat(end_time.replace('Z', '+00:00'))
             query = query.filter(Snapshot.timestamp <= end_datetime)
+            aggregate_query = aggregate_query.filter(AggregateSnapshot.window_start <= end_datetime)
         except ValueError:
             return jsonify({'error': 'Invalid end time format. Use ISO8601 UTC format.'}), 400
     
     # Order by timestamp
-    snapshots = query.order_by(Snapshot.timestamp).all()
+    snapshots = query.order_by(Snapshot.timestamp, Snapshot.id).all()
+    aggregates = aggregate_query.order_by(AggregateSnapshot.window_start, AggregateSnapshot.id).all()
+    
+    epoch_ms = wants_epoch_ms()
+    if not aggregates:
+        return jsonify([snapshot.to_dict(epoch_ms) for snapshot in snapshots])
+    
+    # Aggregate snapshots are points at their window start
+    points = heapq.merge(((snapshot.timestamp, snapshot.to_dict(epoch_ms)) for snapshot in snapshots),
+                         ((aggregate.window_start, aggregate.to_snapshot_dict(epoch_ms)) for aggregate in aggregates),
+                         key=lambda point: point[0])
+    return jsonify([point for _, point in points])
+
+@api_bp.route('/snapshots/page', methods=['GET'])
+def get_snapshots_page():
+    """Fetch one page of the snapshots of one or more metrics using keyset pagination.
+    
+    Pages are ordered by ``sort`` (``timestamp`` or ``value``) and then by id, so
+    the ``next_cursor`` of one page can be passed back as ``cursor`` to fetch the
+    next page with an index range scan instead of an OFFSET. ``offset`` is only
+    used as a fallback when jumping to a page whose cursor is unknown: it skips
+    rows after the ``cursor`` if one is given, and at most MAX_PAGE_OFFSET rows.
+    
+    Aggregate snapshots are paged among the snapshots as their last value at their
+    window start, with their sample ``count``. Each table is read with its own
+    keyset query of one page, and the two pages are merged.
+    """
+    metric_uuids = set(request.args.getlist('metric_uuid'))
+    start_time = request.args.get('start')
+    end_time = request.args.get('end')
+    sort = request.args.get('sort', 'timestamp')
+    order = request.args.get('order', 'asc')
+    cursor = request.args.get('cursor')
+    
+    if not metric_uuids:
+        return jsonify({'error': 'Metric UUID is required'}), 400
+    
+    if sort not in PAGE_COLUMNS:
+        return jsonify({'error': f'Cannot sort by "{sort}"'}), 400
+    
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': 'Order must be "asc" or "desc"'}), 400
+    
+    try:
+        limit = min(int(request.args.get('limit', 10)), MAX_PAGE_SIZE)
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'Limit and offset must be integers'}), 400
+    
+    if limit < 1 or offset < 0:
+        return jsonify({'error': 'Limit must be at least 1 and offset at least 0'}), 400
+    
+    if offset > MAX_PAGE_OFFSET:
+        return jsonify({'error': f'Offset must be at most {MAX_PAGE_OFFSET}, page further with the cursor'}), 400
+    
+    # Check if metrics exist
+    found_uuids = {uuid for uuid, in db.session.query(Metric.uuid).filter(Metric.uuid.in_(metric_uuids))}
+    missing_uuids = metric_uuids - found_uuids
+    if missing_uuids:
+        return jsonify({'error': f'Metric with UUID "{missing_uuids.pop()}" not found'}), 404
+    
+    # Time filters if provided, as (column name, operator, operand)
+    filters = []
+    try:
+        if start_time:
+            filters.append(('timestamp', '>=', parse_page_operand('timestamp', start_time)))
+        if end_time:
+            filters.append(('timestamp', '<=', parse_page_operand('timestamp', end_time)))
+    except ValueError:
+        return jsonify({'error': 'Invalid start or end time format. Use ISO8601 UTC format.'}), 400
+    
+    # Column filters of the form "<column> <operator> <operand>"
+    for filter_expression in request.args.getlist('filter'):
+        try:
+            column_name, operator, operand = filter_expression.split(' ', 2)
+            if column_name not in PAGE_COLUMNS or operator not in PAGE_OPERATORS:
+                raise ValueError(filter_expression)
+            filters.append((column_name, operator, parse_page_operand(column_name, operand)))
+        except ValueError:
+            return jsonify({'error': f'Invalid filter "{filter_expression}"'}), 400
+    
+    if cursor:
+        try:
+            sort_value, last_id, kind = decode_cursor(cursor)
+            cursor = (parse_page_operand(sort, str(sort_value)), last_id, kind)
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid cursor'}), 400
+    
+    query = Snapshot.query.filter(Snapshot.metric_uuid.in_(metric_uuids))
+    aggregate_query = AggregateSnapshot.query.filter(AggregateSnapshot.metric_uuid.in_(metric_uuids))
+    for column_name, operator, operand in filters:
+        query = query.filter(PAGE_OPERATORS[operator](PAGE_COLUMNS[column_name], operand))
+        aggregate_query = aggregate_query.filter(
+            PAGE_OPERATORS[operator](AGGREGATE_PAGE_COLUMNS[column_name], operand))
+    
+    # Only count the matching rows when asked, the client caches the total per query
+    total = query.count() + aggregate_query.count() if request.args.get('with_total') else None
+    
+    ascending = order == 'asc'
+    sort_column = PAGE_COLUMNS[sort]
+    aggregate_sort_column = AGGREGATE_PAGE_COLUMNS[sort]
+    if ascending:
+        query = query.order_by(sort_column.asc(), Snapshot.id.asc())
+        aggregate_query = aggregate_query.order_by(aggregate_sort_column.asc(), AggregateSnapshot.id.asc())
+    else:
+        query = query.order_by(sort_column.desc(), Snapshot.id.desc())
+        aggregate_query = aggregate_query.order_by(aggregate_sort_column.desc(), AggregateSnapshot.id.desc())
+    
+    if cursor:
+        query = query.filter(after_cursor(sort_column, Snapshot.id, SNAPSHOT_ROW, cursor, ascending))
+        aggregate_query = aggregate_query.filter(
+            after_cursor(aggregate_sort_column, AggregateSnapshot.id, AGGREGATE_ROW, cursor, ascending))
+    
+    # The rows before the offset of the merged order can come from either table
+    aggregates = aggregate_query.limit(offset + limit).all()
+    epoch_ms = wants_epoch_ms()
+    if not aggregates:
+        snapshots = query.offset(offset).limit(limit).all() if offset else query.limit(limit).all()
+        rows = [(snapshot, SNAPSHOT_ROW) for snapshot in snapshots]
+    else:
+        snapshots = query.limit(offset + limit).all()
+        merged = heapq.merge(((snapshot, SNAPSHOT_ROW) for snapshot in snapshots),
+                             ((aggregate, AGGREGATE_ROW) for aggregate in aggregates),
+                             key=lambda row: (page_sort_value(*row, sort), row[1], row[0].id), reverse=not ascending)
+        rows = list(islice(merged, offset, offset + limit))
+    
+    next_cursor = None
+    if len(rows) == limit:
+        record, kind = rows[-1]
+        last_sort_value = page_sort_value(record, kind, sort)
+        if sort == 'timestamp':
+            last_sort_value = last_sort_value.isoformat()
+        next_cursor = encode_cursor(last_sort_value, record.id, kind)
+    
+    return jsonify({
+        'snapshots': [record.to_dict_with_id(epoch_ms) if kind == SNAPSHOT_ROW
+                      else record.to_snapshot_dict_with_id(epoch_ms) for record, kind in rows],
+        'next_cursor': next_cursor,
+        'total': total
+    })
+
+def bucket_totals(metric_uuids, start_datetime, end_datetime, points):
+    """Sum the snapshots and aggregate snapshots of metrics over ``points`` equal buckets of a range.
+    
+    Returns the range start and bucket width in epoch seconds, and a dict of
+    [sum, count, max offset] by (metric_uuid, bucket index) for the buckets with data.
+    """
+    start_seconds = start_datetime.timestamp() if start_datetime.tzinfo else \
+        (start_datetime - datetime(1970, 1, 1)).total_seconds()
+    bucket_seconds = max((end_datetime - start_datetime).total_seconds() / points, 0.001)
+    bucket = bucket_index(Snapshot.timestamp, start_seconds, bucket_seconds).label('bucket')
+    aggregate_bucket = bucket_index(AggregateSnapshot.window_start, start_seconds, bucket_seconds).label('bucket')
+    
+    rows = db.session.query(
+        Snapshot.metric_uuid,
+        bucket,
+        func.sum(Snapshot.value),
+        func.count(Snapshot.value),
+        func.max(Snapshot.offset)
+    ).filter(
+        Snapshot.metric_uuid.in_(metric_uuids),
+        Snapshot.timestamp >= start_datetime,
+        Snapshot.timestamp <= end_datetime
+    ).group_by(Snapshot.metric_uuid, bucket).all()
+    
+    rows += db.session.query(
+        AggregateSnapshot.metric_uuid,
+        aggregate_bucket,
+        func.sum(AggregateSnapshot.sum),
+        func.sum(AggregateSnapshot.count),
+        func.max(AggregateSnapshot.offset)
+    ).filter(
+        AggregateSnapshot.metric_uuid.in_(metric_uuids),
+        AggregateSnapshot.window_start >= start_datetime,
+        AggregateSnapshot.window_start <= end_datetime
+    ).group_by(AggregateSnapshot.metric_uuid, aggregate_bucket).all()
+    
+    # Combine raw and aggregate sums per metric and bucket
+    totals = {}
+    for metric_uuid, bucket_number, total, count, offset in rows:
+        combined = totals.setdefault((metric_uuid, bucket_number), [0.0, 0, offset])
+        combined[0] += total
+        combined[1] += count
+        combined[2] = max(combined[2], offset)
+    
+    return start_seconds, bucket_seconds, totals
+
+@api_bp.route('/snapshots/series', methods=['GET'])
+def get_snapshot_series():
+    """Fetch aligned, downsampled series for several metrics in one query.
+    
+    The range is split into at most ``points`` equal buckets and every metric is
+    averaged per bucket, so all series share the same ``timestamps`` (the bucket
+    start in epoch milliseconds) with ``null`` where a metric has no data. Aggregate
+    snapshots count towards the bucket their window starts in, weighted by their
+    sample count.
+    """
+    metric_uuids = list(dict.fromkeys(request.args.getlist('metric_uuid')))
+    start_time = request.args.get('start')
+    end_time = request.args.get('end')
+    
+    if not metric_uuids:
+        return jsonify({'error': 'Metric UUID is required'}), 400
+    
+    if not start_time or not end_time:
+        return jsonify({'error': 'Start and end times are required'}), 400
+    
+    try:
+        start_datetime = parse_page_operand('timestamp', start_time)
+        end_datetime = parse_page_operand('timestamp', end_time)
+    except ValueError:
+        return jsonify({'error': 'Invalid start or end time format. Use ISO8601 UTC format.'}), 400
+    
+    try:
+        points = min(int(request.args.get('points', 1000)), MAX_SERIES_POINTS)
+    except ValueError:
+        return jsonify({'error': 'Points must be an integer'}), 400
+    
+    if points < 1 or end_datetime <= start_datetime:
+        return jsonify({'error': 'Points must be positive and end must be after start'}), 400
+    
+    start_seconds, bucket_seconds, totals = bucket_totals(metric_uuids, start_datetime, end_datetime, points)
+    
+    # Align every metric on the buckets that have data for any of them
+    buckets = sorted({bucket_number for _, bucket_number in totals})
+    positions = {b: i for i, b in enumerate(buckets)}
+    series = {
+        uuid: {'metric_uuid': uuid, 'values': [None] * len(buckets), 'offsets': [None] * len(buckets)}
+        for uuid in metric_uuids
+    }
+    for (metric_uuid, bucket_number), (total, count, offset) in totals.items():
+        series[metric_uuid]['values'][positions[bucket_number]] = total / count
+        series[metric_uuid]['offsets'][positions[bucket_number]] = offset
+    
+    start_ms = int(start_seconds * 1000)
+    bucket_ms = bucket_seconds * 1000
+    return jsonify({
+        'bucket_ms': bucket_ms,
+        'timestamps': [start_ms + int(b * bucket_ms) for b in buckets],
+        'series': list(series.values())
+    })
+
+def downsampled_batches(metric_uuids, start_datetime, end_datetime, points):
+    """Yield the bucket averages of each metric as export rows, timestamped with the bucket start."""
+    start_seconds, bucket_seconds, totals = bucket_totals(metric_uuids, start_datetime, end_datetime, points)
+    start = datetime(1970, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=start_seconds)
+    
+    order = {uuid: i for i, uuid in enumerate(metric_uuids)}
+    rows = [
+        (metric_uuid, start + timedelta(seconds=bucket_number * bucket_seconds), total / count, offset, count)
+        for (metric_uuid, bucket_number), (total, count, offset) in sorted(
+            totals.items(), key=lambda item: (order[item[0][0]], item[0][1]))
+    ]
+    for chunk in range(0, len(rows), EXPORT_CHUNK_ROWS):
+        yield rows[chunk:chunk + EXPORT_CHUNK_ROWS]
+
+@api_bp.route('/snapshots/export', methods=['GET'])
+def export_snapshots():
+    """Download the snapshots of one or more metrics as a CSV or Parquet file.
+    
+    Rows of metric name, metric_uuid, timestamp (UTC), value, offset and count
+    are streamed metric by metric in chunks read from server-side cursors, so an
+    export of any size is neither held in memory nor bound by the worker timeout.
+    Aggregate snapshots are rows at their window start with their mean and sample
+    count, and snapshots have a count of 1, so that both resolutions agree.
+    With ``points``, each metric is instead downsampled to bucket averages as in
+    /snapshots/series, which needs ``start`` and ``end``. CSV timestamps are
+    ISO8601 unless ``time_format=epoch_ms``.
+    
+    Each worker streams at most EXPORT_MAX_CONCURRENCY exports at once and
+    answers 503 beyond that, since each holds a connection until it is sent. On
+    PostgreSQL its transaction is ended once idle for EXPORT_IDLE_TIMEOUT_MS. An
+    export that fails once streaming has begun is cut off without the final
+    chunk, so a download that ends without it is a failed one.
+    """
+    metric_uuids = list(dict.fromkeys(request.args.getlist('metric_uuid')))
+    format = request.args.get('format', 'csv')
+    
+    if not metric_uuids:
+        return jsonify({'error': 'Metric UUID is required'}), 400
+    
+    if format not in EXPORT_FORMATS:
+        return jsonify({'error': f'Format must be one of {", ".join(EXPORT_FORMATS)}'}), 400
+    
+    start_time = request.args.get('start')
+    end_time = request.args.get('end')
+    points = request.args.get('points')
+    try:
+        start_datetime = parse_page_operand('timestamp', start_time) if start_time else None
+        end_datetime = parse_page_operand('timestamp', end_time) if end_time else None
+        points = min(int(points), MAX_SERIES_POINTS) if points else None
+    except ValueError:
+        return jsonify({'error': 'Invalid start, end or points. Use ISO8601 UTC times.'}), 400
+    
+    names = dict(db.session.query(Metric.uuid, Metric.name).filter(Metric.uuid.in_(metric_uuids)))
+    missing_uuids = set(metric_uuids) - set(names)
+    if missing_uuids:
+        return jsonify({'error': f'Metric with UUID "{missing_uuids.pop()}" not found'}), 404
+    
+    if points is not None and (start_datetime is None or end_datetime is None or points < 1
+                               or end_datetime <= start_datetime):
+        return jsonify({'error': 'Downsampling needs start and end, with end after start'}), 400
+    
+    release = acquire_export_slot()
+    if release is None:
+        response = jsonify({'error': 'Too many exports in progress, retry later'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '10'
+        return response
+    
+    try:
+        limit_idle_transaction(current_app.config['EXPORT_IDLE_TIMEOUT_MS'])
+        if points is not None:
+            batches = downsampled_batches(metric_uuids, start_datetime, end_datetime, points)
+        else:
+            batches = snapshot_batches(metric_uuids, start_datetime, end_datetime)
+        chunks = export_chunks(format, batches, names, wants_epoch_ms())
+    except ExportUnavailable as e:
+        release()
+        return jsonify({'error': str(e)}), 501
+    except Exception:
+        release()
+        raise
     
-    return jsonify([snapshot.to_dict() for snapshot in snapshots])
+    filename = f"snapshots-{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')}.{format}"
+    response = Response(stream_with_context(chunks), mimetype=EXPORT_FORMATS[format],
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+    # The slot is held until the server closes the response, after its last chunk or on a failure
+    response.call_on_close(release)
+    return response
+
+@api_bp.route('/snapshots/aggregates', methods=['GET'])
+def get_aggregate_snapshots():
+    """Fetch one page of a metric's aggregate snapshots whose window starts in a time range, oldest first.
+    
+    Pages are ordered by window start and id; pass the ``next_cursor`` of a page
+    back as ``cursor`` to fetch the next one.
+    """
+    metric_uuid = request.args.get('metric_uuid')
+    start_time = request.args.get('start')
+    end_time = request.args.get('end')
+    cursor = request.args.get('cursor')
+    
+    if not metric_uuid:
+        return jsonify({'error': 'Metric UUID is required'}), 400
+    
+    # Check if metric exists
+    metric = Metric.query.get(metric_uuid)
+    if not metric:
+        return jsonify({'error': f'Metric with UUID "{metric_uuid}" not found'}), 404
+    
+    query = AggregateSnapshot.query.filter_by(metric_uuid=metric_uuid)
+    
+    try:
+        if start_time:
+            query = query.filter(AggregateSnapshot.window_start >= parse_page_operand('timestamp', start_time))
+        if end_time:
+            query = query.filter(AggregateSnapshot.window_start <= parse_page_operand('timestamp', end_time))
+        limit = min(int(request.args.get('limit', MAX_PAGE_SIZE)), MAX_PAGE_SIZE)
+    except ValueError:
+        return jsonify({'error': 'Invalid start, end or limit. Use ISO8601 UTC times.'}), 400
+    
+    if limit < 1:
+        return jsonify({'error': 'Limit must be at least 1'}), 400
+    
+    if cursor:
+        try:
+            window_start, last_id, _ = decode_cursor(cursor)
+            window_start = parse_page_operand('timestamp', str(window_start))
+        except (ValueError, TypeError):
+            return jsonify({'error': 'Invalid cursor'}), 400
+        query = query.filter(or_(AggregateSnapshot.window_start > window_start,
+                                 and_(AggregateSnapshot.window_start == window_start, AggregateSnapshot.id > last_id)))
+    
+    aggregates = query.order_by(AggregateSnapshot.window_start, AggregateSnapshot.id).limit(limit).all()
+    
+    next_cursor = None
+    if len(aggregates) == limit:
+        last = aggregates[-1]
+        next_cursor = encode_cursor(last.window_start.isoformat(), last.id)
+    
+    epoch_ms = wants_epoch_ms()
+    return jsonify({
+        'aggregates': [aggregate.to_dict(epoch_ms) for aggregate in aggregates],
+        'next_cursor': next_cursor
+    })
 
 @api_bp.route('/latest_snapshots', methods=['GET'])
 def get_latest_snapshots():
-    # Subquery to get the latest snapshot for each metric
-    latest_snapshots = []
+    """Fetch the latest snapshot of every metric in two queries.
+    
+    Each metric is joined to its newest snapshot and its newest aggregate snapshot
+    through correlated subqueries, which are one lookup in the (metric_uuid,
+    timestamp, id) index of each table per metric. An aggregate that is newer than
+    the snapshot is returned as its last value at its window start.
+    """
+    epoch_ms = wants_epoch_ms()
+    
+    newer = aliased(Snapshot)
+    latest_id = db.session.query(newer.id) \
+        .filter(newer.metric_uuid == Metric.uuid) \
+        .order_by(newer.timestamp.desc(), newer.id.desc()) \
+        .limit(1) \
+        .correlate(Metric) \
+        .scalar_subquery()
+    snapshots = db.session.query(Snapshot).select_from(Metric).join(Snapshot, Snapshot.id == latest_id).all()
+    
+    newer_aggregate = aliased(AggregateSnapshot)
+    latest_aggregate_id = db.session.query(newer_aggregate.id) \
+        .filter(newer_aggregate.metric_uuid == Metric.uuid) \
+        .order_by(newer_aggregate.window_start.desc(), newer_aggregate.id.desc()) \
+        .limit(1) \
+        .correlate(Metric) \
+        .scalar_subquery()
+    aggregates = db.session.query(AggregateSnapshot).select_from(Metric) \
+        .join(AggregateSnapshot, AggregateSnapshot.id == latest_aggregate_id).all()
     
-    for metric in Metric.query.all():
-        snapshot = Snapshot.query.filter_by(metric_uuid=metric.uuid).order_by(Snapshot.timestamp.desc()).first()
-        if snapshot:
-            latest_snapshots.append(snapshot.to_dict_with_metric())
+    latest = {snapshot.metric_uuid: (snapshot.timestamp, snapshot.to_dict_with_metric(epoch_ms))
+              for snapshot in snapshots}
+    for aggregate in aggregates:
+        if aggregate.metric_uuid not in latest or aggregate.window_start > latest[aggregate.metric_uuid][0]:
+            latest[aggregate.metric_uuid] = (aggregate.window_start, aggregate.to_snapshot_dict_with_metric(epoch_ms))
+    
+    return jsonify([point for _, point in latest.values()])
+
+def escape_like(text):
+    """Escape LIKE wildcards in user input, so that it matches literally with ``escape='\\'``."""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def aggregator_status(last_active, now):
+    """Health of an aggregator from how long ago it was last active."""
+    if last_active.tzinfo is not None:
+        last_active = last_active.astimezone(timezone.utc).replace(tzinfo=None)
     
-    return jsonify(latest_snapshots)
+    age = (now - last_active).total_seconds()
+    if age < current_app.config['AGGREGATOR_STALE_SECONDS']:
+        return 'active'
+    if age < current_app.config['AGGREGATOR_OFFLINE_SECONDS']:
+        return 'stale'
+    return 'offline'
 
 @api_bp.route('/aggregators', methods=['GET'])
 def get_aggregators():
-    aggregators = Aggregator.query.all()
-    return jsonify([aggregator.to_dict() for aggregator in aggregators])
+    """Fetch aggregators with their health status, sorted, filtered and paginated in SQL.
+    
+    ``name`` filters by a case-insensitive substring and ``status`` (repeatable) by
+    health: ``active`` within AGGREGATOR_STALE_SECONDS, ``offline`` after
+    AGGREGATOR_OFFLINE_SECONDS and ``stale`` in between. Without ``limit`` every
+    match is returned. The number of matches is sent in the X-Total-Count header.
+    """
+    name = request.args.get('name')
+    statuses = set(request.args.getlist('status'))
+    sort = request.args.get('sort', 'last_active')
+    order = request.args.get('order', 'desc')
+    
+    if sort not in AGGREGATOR_SORT_COLUMNS:
+        return jsonify({'error': f'Cannot sort by "{sort}"'}), 400
+    
+    if order not in ('asc', 'desc'):
+        return jsonify({'error': 'Order must be "asc" or "desc"'}), 400
+    
+    if statuses - set(AGGREGATOR_STATUSES):
+        return jsonify({'error': f'Status must be one of {", ".join(AGGREGATOR_STATUSES)}'}), 400
+    
+    try:
+        limit = request.args.get('limit')
+        limit = min(int(limit), MAX_PAGE_SIZE) if limit is not None else None
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({'error': 'Limit and offset must be integers'}), 400
+    
+    if (limit is not None and limit < 1) or offset < 0:
+        return jsonify({'error': 'Limit must be at least 1 and offset at least 0'}), 400
+    
+    now = datetime.utcnow()
+    query = Aggregator.query
+    
+    if name:
+        query = query.filter(Aggregator.name.ilike(f'%{escape_like(name)}%', escape='\\'))
+    
+    # Each status is a range of last_active, which the index on last_active serves
+    if statuses and len(statuses) < len(AGGREGATOR_STATUSES):
+        stale_since = now - timedelta(seconds=current_app.config['AGGREGATOR_STALE_SECONDS'])
+        offline_since = now - timedelta(seconds=current_app.config['AGGREGATOR_OFFLINE_SECONDS'])
+        ranges = {
+            'active': Aggregator.last_active > stale_since,
+            'stale': and_(Aggregator.last_active <= stale_since, Aggregator.last_active > offline_since),
+            'offline': Aggregator.last_active <= offline_since,
+        }
+        query = query.filter(or_(*(ranges[status] for status in statuses)))
+    
+    total = query.count() if limit is not None else None
+    
+    sort_column = AGGREGATOR_SORT_COLUMNS[sort]
+    if order == 'asc':
+        query = query.order_by(sort_column.asc(), Aggregator.uuid.asc())
+    else:
+        query = query.order_by(sort_column.desc(), Aggregator.uuid.desc())
+    
+    if limit is not None:
+        query = query.offset(offset).limit(limit)
+    
+    aggregators = query.all()
+    response = jsonify([
+        {**aggregator.to_dict(), 'status': aggregator_status(aggregator.last_active, now)}
+        for aggregator in aggregators
+    ])
+    response.headers['X-Total-Count'] = str(total if total is not None else len(aggregators))
+    return response
+
+@api_bp.route('/aggregators/<aggregator_uuid>/config', methods=['GET'])
+def get_reporting_config(aggregator_uuid):
+    """Fetch the reporting config an aggregator should currently use."""
+    aggregator = Aggregator.query.get(aggregator_uuid)
+    if not aggregator:
+        return jsonify({'error': f'Aggregator with UUID "{aggregator_uuid}" not found'}), 404
+    
+    return jsonify(effective_config(aggregator_uuid))
+
+@api_bp.route('/aggregators/<aggregator_uuid>/config', methods=['PUT'])
+def update_reporting_config(aggregator_uuid):
+    """Set the reporting interval and batch size of an aggregator or one of its metrics.
+    
+    The new effective config is sent to the aggregator as a ``configure`` command.
+    """
+    data = request.get_json()
+    
+    if not data or ('interval_seconds' not in data and 'batch_size' not in data):
+        return jsonify({'error': 'Interval seconds or batch size is required'}), 400
+    
+    metric_uuid = data.get('metric_uuid')
+    interval_seconds = data.get('interval_seconds')
+    batch_size = data.get('batch_size')
+    
+    if interval_seconds is not None and (not isinstance(interval_seconds, (int, float)) or interval_seconds <= 0):
+        return jsonify({'error': 'Interval seconds must be a positive number'}), 400
+    
+    if batch_size is not None and (not isinstance(batch_size, int) or batch_size < 1):
+        return jsonify({'error': 'Batch size must be a positive integer'}), 400
+    
+    # Check if aggregator exists
+    aggregator = Aggregator.query.get(aggregator_uuid)
+    if not aggregator:
+        return jsonify({'error': f'Aggregator with UUID "{aggregator_uuid}" not found'}), 404
+    
+    # Check if metric exists and belongs to the aggregator
+    if metric_uuid:
+        metric = Metric.query.get(metric_uuid)
+        if not metric or metric.aggregator_uuid != aggregator_uuid:
+            return jsonify({'error': f'Metric with UUID "{metric_uuid}" not found for this aggregator'}), 404
+    
+    try:
+        config = set_config(aggregator_uuid, metric_uuid, interval_seconds, batch_size)
+        return jsonify(config)
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 400
 
 @api_bp.route('/shutdown_aggregator', methods=['POST'])
 def shutdown_aggregator():
@@ -168,30 +991,57 @@ def shutdown_aggregator():
     
     aggregator_uuid = data['aggregator_uuid']
     
-    # Check if aggregator exists
-    aggregator = Aggregator.query.get(aggregator_uuid)
-    if not aggregator:
+    # Queue the command in the shared store so that any worker can deliver it
+    try:
+        get_command_store().enqueue(aggregator_uuid, 'shutdown')
+    except AggregatorNotFound:
         return jsonify({'error': f'Aggregator with UUID "{aggregator_uuid}" not found'}), 404
     
-    # Store shutdown status instead of sending SSE event
-    shutdown_status[aggregator_uuid] = True
-    
     return '', 200
 
 @api_bp.route('/poll_shutdown_status/<aggregator_uuid>', methods=['GET'])
 def poll_shutdown_status(aggregator_uuid):
     """Endpoint for clients to poll for shutdown status."""
-    # Check if aggregator exists
-    aggregator = Aggregator.query.get(aggregator_uuid)
-    if not aggregator:
+    # Claiming the command marks it delivered, so it is returned by at most one poll
+    try:
+        commands = get_command_store().claim(aggregator_uuid, commands=('shutdown',))
+    except AggregatorNotFound:
         return jsonify({'error': f'Aggregator with UUID "{aggregator_uuid}" not found'}), 404
     
-    # Return the shutdown status
-    should_shutdown = shutdown_status.get(aggregator_uuid, False)
-    
-    # If client is shutting down, clear the status
+    should_shutdown = bool(commands)
     if should_shutdown:
-        logger.info(f"Shutting down aggregator {aggregator_uuid}.")
-        shutdown_status.pop(aggregator_uuid, None)
+        logger.info('Shutting down aggregator %s.', aggregator_uuid, extra={'aggregator_uuid': aggregator_uuid})
+    
+    return jsonify({'should_shutdown': should_shutdown})
+
+@api_bp.route('/commands/<aggregator_uuid>', methods=['GET'])
+@query_budget(statements=None, repeats=None)  # Parked polls check for new commands every COMMAND_POLL_INTERVAL
+def get_commands(aggregator_uuid):
+    """Long-poll for commands queued for an aggregator.
+    
+    Returns as soon as a command is claimed, or with an empty list after ``wait``
+    seconds. Claimed commands are not returned again by any later poll.
+    """
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        return jsonify({'error': 'Wait must be a number of seconds'}), 400
+    
+    # NaN would never reach the deadline, and inf would park the request forever
+    if not math.isfinite(wait) or wait < 0:
+        return jsonify({'error': 'Wait must be a finite number of seconds, at least 0'}), 400
+    
+    try:
+        commands = get_command_store().wait(
+            aggregator_uuid,
+            timeout=min(wait, MAX_COMMAND_WAIT),
+            poll_interval=current_app.config['COMMAND_POLL_INTERVAL']
+        )
+    except AggregatorNotFound:
+        return jsonify({'error': f'Aggregator with UUID "{aggregator_uuid}" not found'}), 404
+    
+    for command in commands:
+        logger.info('Delivering %s command to aggregator %s.', command['command'], aggregator_uuid,
+                    extra={'aggregator_uuid': aggregator_uuid})
     
-    return jsonify({'should_shutdown': should_shutdown}) 
\ No newline at end of file
+    return jsonify({'commands': commands})
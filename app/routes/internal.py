@@ -0,0 +1,28 @@
+from flask import Blueprint, Response, jsonify
+
+from app.admission import get_ingest_admission
+from app.dashboard.instrumentation import stats_to_dict
+from app.monitoring import render_prometheus
+from app.reporting import get_load_shedder
+
+internal_bp = Blueprint('internal', __name__, url_prefix='/internal')
+
+@internal_bp.route('/dashboard_stats', methods=['GET'])
+def get_dashboard_stats():
+    """Per-callback latency and payload histograms, plus the most recent slow callbacks."""
+    return jsonify(stats_to_dict())
+
+@internal_bp.route('/load_shedding', methods=['GET'])
+def get_load_shedding():
+    """Current ingest queue depth, DB write latency and reporting interval factor of this worker."""
+    return jsonify(get_load_shedder().to_dict())
+
+@internal_bp.route('/admission', methods=['GET'])
+def get_admission():
+    """Ingest concurrency and per-aggregator rate limits of this worker, and the requests they rejected."""
+    return jsonify(get_ingest_admission().to_dict())
+
+@internal_bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Request latency, status, SQL, connection pool and ingest metrics of this worker, for Prometheus."""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,267 @@
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import func, select, text
+
+from app import db
+from app.commands import get_command_store
+from app.ingest import UnknownMetrics, write_snapshots
+from app.models.models import Snapshot
+from app.monitoring import request_metrics
+from app.registration import register
+from app.reporting import get_load_shedder
+from app.telemetry import quantile_from_counts
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+# Metrics recorded about the server itself, with their units
+SELF_METRICS = {
+    'ingest_rate': 'snapshots/s',
+    'request_rate': 'requests/s',
+    'request_latency_p50': 'ms',
+    'request_latency_p95': 'ms',
+    'request_latency_p99': 'ms',
+    'ingest_queue_depth': 'requests',
+    'ingest_write_latency': 'ms',
+    'db_pool_checked_out': 'connections',
+    'db_pool_saturation': '%',
+    'process_rss': 'MB',
+    'snapshot_rows': 'rows',
+    'snapshot_table_size': 'MB',
+}
+
+# Long-polling endpoints, left out of request latency since they wait by design
+LONG_POLL_RULES = {'/commands/<aggregator_uuid>', '/poll_shutdown_status/<aggregator_uuid>'}
+
+def process_rss_bytes():
+    """Resident set size of this process, or its peak where the current value is not available."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if os.uname().sysname == 'Darwin' else rss * 1024
+
+def snapshot_table_stats():
+    """Approximate row count and on-disk size in bytes of the snapshots table.
+
+    PostgreSQL statistics are used so that this stays cheap on large tables. SQLite
+    has no per-table size, so the size of the whole database file is reported.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        rows, size = db.session.execute(text(
+            "SELECT reltuples::bigint, pg_total_relation_size(oid) FROM pg_class WHERE relname = 'snapshots'"
+        )).one()
+        return max(rows, 0), size
+
+    rows = db.session.execute(select(func.count()).select_from(Snapshot)).scalar_one()
+    if db.engine.dialect.name == 'sqlite':
+        page_count = db.session.execute(text('PRAGMA page_count')).scalar_one()
+        page_size = db.session.execute(text('PRAGMA page_size')).scalar_one()
+        return rows, page_count * page_size
+    return rows, None
+
+class SelfMonitor:
+    """Record the server's own health as snapshots of an internal aggregator.
+
+    Every ``interval`` seconds a background thread samples ingest and request rates,
+    request latency percentiles, ingest queue depth and write latency, connection
+    pool usage, process RSS and the size of the snapshots table, and writes them
+    through the bulk ingest path, outside of load shedding. The aggregator is registered under ``name`` like
+    any collector, so its metrics show up on the Live and History pages, and its
+    interval follows the reporting config set for it on the Control page.
+
+    With several gunicorn workers, only the worker holding the lock file samples;
+    rates and table sizes cover the whole server, latency, queue depth, pool and
+    RSS are those of the sampling worker.
+    """
+
+    def __init__(self, app, interval=60, name='coc-server', lock_path=None):
+        self.app = app
+        self.interval = interval
+        self.default_interval = interval
+        self.name = name
+        self.lock_path = lock_path or os.path.join(tempfile.gettempdir(), 'coc-server-selfmonitor.lock')
+
+        self.aggregator_uuid = None
+        self.metric_uuids = None
+        self._lock_file = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        # Values at the previous sample, to turn counters into rates
+        self._previous_time = None
+        self._previous_snapshot_id = None
+        self._previous_requests = None
+        self._previous_latency_counts = None
+
+    def start(self):
+        """Start the sampling thread of this worker, once."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='self-monitor', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop sampling, waiting up to timeout seconds for a sample being written."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _is_sampler(self):
+        """Whether this worker holds the lock file that makes it the one sampling."""
+        if self._lock_file is not None:
+            return True
+
+        try:
+            import fcntl
+        except ImportError:
+            # No cross-process lock on this platform, every worker samples
+            return True
+
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                if self._is_sampler():
+                    with self.app.app_context():
+                        self.record()
+            except Exception as e:
+                logger.error('Error recording server metrics: %s', e)
+                db.session.remove()
+
+    def _request_stats(self, now):
+        """Request rate and latency percentiles since the previous sample."""
+        _, durations, _, _, _ = request_metrics.snapshot()
+        requests = 0
+        latency_counts = None
+        buckets = None
+        for (method, endpoint), (counts, count, total_ms, endpoint_buckets) in durations.items():
+            if endpoint in LONG_POLL_RULES:
+                continue
+            requests += count
+            buckets = endpoint_buckets
+            latency_counts = counts if latency_counts is None else [a + b for a, b in zip(latency_counts, counts)]
+
+        stats = {}
+        if self._previous_requests is not None:
+            stats['request_rate'] = (requests - self._previous_requests) / (now - self._previous_time)
+        if latency_counts is not None:
+            previous = self._previous_latency_counts or [0] * len(latency_counts)
+            interval_counts = [current - before for current, before in zip(latency_counts, previous)]
+            for name, q in (('request_latency_p50', 0.5), ('request_latency_p95', 0.95), ('request_latency_p99', 0.99)):
+                value = quantile_from_counts(buckets, interval_counts, q)
+                if value is not None and value != float('inf'):
+                    stats[name] = value
+            self._previous_latency_counts = latency_counts
+
+        self._previous_requests = requests
+        return stats
+
+    def sample(self):
+        """Collect the current value of every self-monitoring metric that is available."""
+        now = time.monotonic()
+        values = self._request_stats(now)
+
+        shedder = get_load_shedder()
+        values['ingest_queue_depth'] = shedder.peak_queue_depth
+        values['ingest_write_latency'] = shedder.write_latency_ms
+
+        pool = db.engine.pool
+        if hasattr(pool, 'checkedout'):
+            values['db_pool_checked_out'] = pool.checkedout()
+            if hasattr(pool, 'size') and pool.size():
+                values['db_pool_saturation'] = pool.checkedout() / pool.size() * 100
+
+        rss = process_rss_bytes()
+        if rss is not None:
+            values['process_rss'] = rss / 1024 / 1024
+
+        # Snapshot IDs increase monotonically, so the newest one counts inserts cheaply
+        snapshot_id = db.session.execute(select(func.max(Snapshot.id))).scalar_one() or 0
+        if self._previous_snapshot_id is not None:
+            values['ingest_rate'] = (snapshot_id - self._previous_snapshot_id) / (now - self._previous_time)
+        self._previous_snapshot_id = snapshot_id
+
+        rows, size = snapshot_table_stats()
+        values['snapshot_rows'] = rows
+        if size is not None:
+            values['snapshot_table_size'] = size / 1024 / 1024
+
+        self._previous_time = now
+        return values
+
+    def record(self):
+        """Sample the server's metrics and write them as snapshots of the internal aggregator."""
+        values = self.sample()
+
+        if self.metric_uuids is None:
+            registered = register(self.name, SELF_METRICS)
+            self.aggregator_uuid = registered['uuid']
+            self.metric_uuids = {name: metric['uuid'] for name, metric in registered['metrics'].items()}
+
+        timestamp = datetime.now(timezone.utc)
+        rows = [
+            {'metric_uuid': self.metric_uuids[name], 'value': value, 'timestamp': timestamp, 'offset': 0}
+            for name, value in values.items()
+        ]
+        try:
+            # Left out of the load shedder, which would otherwise count the monitor's own writes as ingest load
+            write_snapshots(rows, track_load=False)
+        except UnknownMetrics:
+            # The aggregator was deleted from the dashboard, register it again next time
+            self.metric_uuids = None
+            raise
+
+        self.apply_commands()
+        return values
+
+    def apply_commands(self):
+        """Claim the configure commands sent to the internal aggregator and follow them like a collector.
+
+        Other commands, such as a shutdown sent from the Control page, are left pending.
+        """
+        for command in get_command_store().claim(self.aggregator_uuid, commands=('configure',)):
+            self.interval = (command['payload'] or {}).get('interval_seconds') or self.default_interval
+            logger.info('Self-monitoring interval set to %s seconds.', self.interval)
+
+def init_self_monitor(app):
+    """Record the server's own metrics every SELF_MONITOR_INTERVAL seconds (0 disables it).
+
+    The sampling thread is started by the first request a worker serves, so that CLI
+    commands such as ``flask db upgrade`` do not start it.
+    """
+    interval = app.config.get('SELF_MONITOR_INTERVAL', 0)
+    if interval <= 0:
+        return None
+
+    monitor = SelfMonitor(app, interval=interval, name=app.config.get('SELF_MONITOR_NAME', 'coc-server'),
+                          lock_path=app.config.get('SELF_MONITOR_LOCK'))
+    app.extensions['self_monitor'] = monitor
+
+    @app.before_request
+    def start_self_monitor():
+        if monitor._thread is None:
+            monitor.start()
+
+    return monitor
@@ -0,0 +1,125 @@
+import logging
+import os
+import sys
+import time
+
+from sqlalchemy import text
+
+from app import db
+from app.log import restart_logging_after_fork, stop_logging
+from app.monitoring import request_metrics
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+# Requests each worker serves before accepting traffic, to build Dash's layout and
+# dependency caches and compile the statements of the busiest queries
+WARMUP_PATHS = (
+    '/dashboard/',
+    '/dashboard/_dash-layout',
+    '/dashboard/_dash-dependencies',
+    '/aggregators?limit=1',
+    '/internal/load_shedding',
+)
+
+# Project root, where gunicorn.conf.py and run.py live
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def engine_options(config):
+    """SQLAlchemy engine options for the connection pool of one worker.
+
+    Connections are checked with a ping before use and replaced after
+    DB_POOL_RECYCLE seconds. On PostgreSQL each worker keeps up to DB_POOL_SIZE
+    connections, opens up to DB_MAX_OVERFLOW more under load, waits at most
+    DB_POOL_TIMEOUT seconds for one, and statements are cancelled after
+    DB_STATEMENT_TIMEOUT_MS.
+    """
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    if (config['SQLALCHEMY_DATABASE_URI'] or '').startswith('sqlite'):
+        return options
+
+    options.update({
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+    })
+    if config['DB_STATEMENT_TIMEOUT_MS']:
+        options['connect_args'] = {'options': f"-c statement_timeout={config['DB_STATEMENT_TIMEOUT_MS']}"}
+    return options
+
+def after_fork(app):
+    """Reset what a worker must not share with the master that preloaded the app.
+
+    Pooled connections are dropped without being closed, since the master still
+    owns the sockets, and the logging thread, which does not survive a fork, is
+    started again.
+    """
+    with app.app_context():
+        db.engine.dispose(close=False)
+    restart_logging_after_fork(app)
+
+def make_psycopg_cooperative():
+    """Let other greenlets of a gevent worker run while psycopg2 waits on PostgreSQL.
+
+    Without a wait callback every query blocks the whole worker, parked long
+    polls included.
+    """
+    try:
+        import psycopg2
+        from psycopg2 import extensions
+    except ImportError:
+        return
+    from gevent.socket import wait_read, wait_write
+
+    def wait(connection, timeout=None):
+        while True:
+            state = connection.poll()
+            if state == extensions.POLL_OK:
+                return
+            if state == extensions.POLL_READ:
+                wait_read(connection.fileno(), timeout=timeout)
+            elif state == extensions.POLL_WRITE:
+                wait_write(connection.fileno(), timeout=timeout)
+            else:
+                raise psycopg2.OperationalError(f'Unexpected poll state {state}')
+
+    extensions.set_wait_callback(wait)
+
+def warmup(app):
+    """Open a database connection and serve WARMUP_PATHS once before taking traffic."""
+    started = time.perf_counter()
+    with app.app_context():
+        db.session.execute(text('SELECT 1'))
+        db.session.remove()
+
+    client = app.test_client()
+    for path in WARMUP_PATHS:
+        response = client.get(path)
+        if response.status_code >= 400:
+            logger.warning('Warmup request to %s returned %d', path, response.status_code)
+
+    # Warmup requests are not traffic
+    request_metrics.reset()
+    logger.info('Worker %d warmed up in %.0f ms', os.getpid(), (time.perf_counter() - started) * 1000)
+
+def shutdown(app):
+    """Stop background work, close pooled connections and write out queued log records."""
+    monitor = app.extensions.get('self_monitor')
+    if monitor is not None:
+        monitor.stop()
+    app.extensions['load_shedder'].stop()
+
+    with app.app_context():
+        db.engine.dispose()
+
+    logger.info('Worker %d stopped', os.getpid())
+    stop_logging()
+
+def exec_gunicorn(argv=()):
+    """Replace this process with gunicorn, configured by gunicorn.conf.py."""
+    args = [sys.executable, '-m', 'gunicorn', '--chdir', ROOT, '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+            *argv, 'run:app']
+    os.execv(sys.executable, args)
@@ -0,0 +1,68 @@
+from bisect import bisect_left
+from threading import Lock
+
+# Default bucket upper bounds for latencies, in milliseconds
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# Default bucket upper bounds for payload sizes, in bytes
+SIZE_BUCKETS_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+def quantile_from_counts(buckets, counts, q):
+    """Estimate a quantile from per-bucket counts as the upper bound of the bucket that contains it."""
+    count = sum(counts)
+    if not count:
+        return None
+
+    rank = q * count
+    seen = 0
+    for index, bucket_count in enumerate(counts):
+        seen += bucket_count
+        if seen >= rank:
+            return buckets[index] if index < len(buckets) else float('inf')
+    return float('inf')
+
+class Histogram:
+    """A thread-safe histogram over fixed bucket upper bounds.
+
+    Observations are counted in the first bucket whose upper bound is greater than or
+    equal to the value, values above the last bound go to an overflow bucket.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """Estimate a quantile as the upper bound of the bucket that contains it."""
+        with self._lock:
+            counts = list(self.counts)
+        return quantile_from_counts(self.buckets, counts, q)
+
+    def to_dict(self):
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+            total = self.sum
+
+        return {
+            'count': count,
+            'sum': total,
+            'mean': total / count if count else None,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': {
+                **{str(bound): bucket_count for bound, bucket_count in zip(self.buckets, counts)},
+                '+Inf': counts[-1],
+            },
+        }
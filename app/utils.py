@@ -1,9 +1,13 @@
 import os
+import requests
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# Shared keep-alive session for the dashboard's requests to the API
+http_session = requests.Session()
+
 def get_server_url():
     """
     Constructs the server URL based on environment variables.
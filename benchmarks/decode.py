@@ -0,0 +1,147 @@
+"""Benchmark the cost of decoding ingest request bodies, per record.
+
+Bodies of /snapshot (one snapshot) and /snapshots/batch (100 to 10000 snapshots)
+are decoded with the server's msgspec schemas, and for reference with json.loads
+followed by the per-field checks and fromisoformat() parsing the server used
+before. Timestamps are sent both as ISO8601 strings and as epoch milliseconds.
+Batches are then decoded as JSON, line protocol and MessagePack, plain and
+gzip-compressed, to compare their size and cost. No app or database is needed.
+
+Examples:
+
+    python -m benchmarks.decode
+    python -m benchmarks.decode --json decode.json
+"""
+import argparse
+import gzip
+import io
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import msgspec
+
+from app.ingest import decode_batch, decode_batch_stream, decode_snapshot
+
+BATCH_SIZES = (1, 100, 1000, 10_000)
+
+# Snapshots per body when comparing batch formats
+FORMAT_BATCH_SIZE = 10_000
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+def make_snapshot(metric_uuid, i, epoch_ms):
+    timestamp = START + timedelta(milliseconds=i)
+    return {
+        'metric_uuid': metric_uuid,
+        'value': i * 0.5,
+        'timestamp': int(timestamp.timestamp() * 1000) if epoch_ms else timestamp.isoformat(),
+        'offset': 60,
+    }
+
+def make_body(size, epoch_ms):
+    metric_uuid = str(uuid.uuid4())
+    snapshots = [make_snapshot(metric_uuid, i, epoch_ms) for i in range(size)]
+    body = snapshots[0] if size == 1 else {'snapshots': snapshots}
+    return json.dumps(body).encode()
+
+def stdlib_snapshot(data):
+    """json.loads() output checked by hand, as the server did before its msgspec schemas."""
+    if not isinstance(data, dict) or any(key not in data for key in ('metric_uuid', 'value', 'timestamp', 'offset')):
+        raise ValueError('Metric UUID, value, timestamp, and offset are required')
+    timestamp = data['timestamp']
+    if isinstance(timestamp, int):
+        timestamp = datetime.fromtimestamp(timestamp / 1000, timezone.utc)
+    else:
+        timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+    return {'metric_uuid': data['metric_uuid'], 'value': data['value'], 'timestamp': timestamp, 'offset': data['offset']}
+
+def stdlib_decode(body, size):
+    data = json.loads(body)
+    if size == 1:
+        return [stdlib_snapshot(data)]
+    return [stdlib_snapshot(item) for item in data['snapshots']]
+
+def msgspec_decode(body, size):
+    if size == 1:
+        return [decode_snapshot(body)]
+    rows, _ = decode_batch(body)
+    return rows
+
+DECODERS = {
+    'stdlib': stdlib_decode,
+    'msgspec': msgspec_decode,
+}
+
+def format_bodies(size):
+    """The same snapshots as a body of each batch format, with its Content-Type."""
+    metric_uuid = uuid.uuid4()
+    snapshots = [make_snapshot(str(metric_uuid), i, True) for i in range(size)]
+    return {
+        'json': ('application/json', json.dumps({'snapshots': snapshots}).encode()),
+        'line': ('text/plain', ''.join(
+            f"{s['metric_uuid']} {s['value']} {s['timestamp']} {s['offset']}\n" for s in snapshots).encode()),
+        'msgpack': ('application/msgpack', msgspec.msgpack.encode(
+            [[metric_uuid.bytes, s['value'], s['timestamp'], s['offset']] for s in snapshots])),
+    }
+
+def stream_decoder(content_type, encoding):
+    def decode(body, size):
+        rows, _ = decode_batch_stream(io.BytesIO(body), content_type, encoding, size)
+        return rows
+    return decode
+
+def measure(decode, body, size, seconds):
+    """Decode body repeatedly for about ``seconds`` and return microseconds per record."""
+    decode(body, size)
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        decode(body, size)
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= seconds and calls >= 3:
+            return elapsed / calls / size * 1e6
+
+def run(seconds):
+    results = {}
+    print(f"  {'body':<32}{'bytes':>10}" + ''.join(f'{name + " us":>14}' for name in DECODERS) + f"{'speedup':>10}")
+    for epoch_ms in (False, True):
+        for size in BATCH_SIZES:
+            body = make_body(size, epoch_ms)
+            name = f"{'snapshot' if size == 1 else f'batch_{size}'}_{'epoch_ms' if epoch_ms else 'iso'}"
+            per_record = {decoder: measure(decode, body, size, seconds) for decoder, decode in DECODERS.items()}
+            results[name] = {'records': size, 'bytes': len(body),
+                             **{f'{decoder}_us_per_record': round(us, 3) for decoder, us in per_record.items()}}
+            speedup = per_record['stdlib'] / per_record['msgspec']
+            print(f'  {name:<32}{len(body):>10}' + ''.join(f'{us:>14.2f}' for us in per_record.values())
+                  + f'{speedup:>9.1f}x', flush=True)
+
+    print(f"\n  {'format':<32}{'bytes':>10}{'B/record':>10}{'us':>14}")
+    for format_name, (content_type, body) in format_bodies(FORMAT_BATCH_SIZE).items():
+        for encoding in (None, 'gzip'):
+            encoded = gzip.compress(body) if encoding else body
+            name = f"format_{format_name}{'_gzip' if encoding else ''}"
+            us = measure(stream_decoder(content_type, encoding), encoded, FORMAT_BATCH_SIZE, seconds)
+            results[name] = {'records': FORMAT_BATCH_SIZE, 'bytes': len(encoded), 'us_per_record': round(us, 3)}
+            print(f'  {name:<32}{len(encoded):>10}{len(encoded) / FORMAT_BATCH_SIZE:>10.1f}{us:>14.2f}', flush=True)
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=1, help='Time spent decoding each body with each decoder')
+    parser.add_argument('--json', metavar='PATH', help='Write the results as JSON')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run(args.seconds)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'results': results}, f, indent=2)
+        print(f'\nWrote {args.json}')
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+"""Benchmark the API's hot endpoints in process and report their latency as JSON.
+
+Requests go through the Flask test client, so the numbers cover routing, queries
+and serialization without network or worker overhead. Each database backend runs
+in its own process against a fresh schema:
+
+- ``/snapshot`` and ``/snapshots/batch`` (100 and 1000 snapshots per request)
+- ``/snapshots`` over a metric with 10k, 100k and 1M rows
+- ``/latest_snapshots``, ``/metrics`` and ``/poll_shutdown_status`` with 10, 1k and 10k metrics
+
+Examples:
+
+    # SQLite in a temporary file
+    python -m benchmarks.endpoints --json before.json
+
+    # Also a local PostgreSQL database, which is emptied (or set COC_BENCH_POSTGRES_URL)
+    python -m benchmarks.endpoints --postgres postgresql://localhost/coc_bench --json after.json
+
+    # Smaller datasets, and the change in p50 against an earlier run
+    python -m benchmarks.endpoints --quick --compare before.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from multiprocessing import get_context
+
+from benchmarks.loadgen import summarize
+
+# Rows of the metric read back by /snapshots, and the number of metrics for the fleet-wide reads
+SNAPSHOT_RANGE_SIZES = (10_000, 100_000, 1_000_000)
+METRIC_COUNTS = (10, 1_000, 10_000)
+QUICK_SNAPSHOT_RANGE_SIZES = (10_000,)
+QUICK_METRIC_COUNTS = (10, 1_000)
+
+# Snapshots per request of the batched ingest cases
+BATCH_SIZES = (100, 1000)
+
+# Snapshots of each metric in the fleet-wide datasets
+SNAPSHOTS_PER_METRIC = 5
+
+# Rows inserted per statement while seeding
+SEED_CHUNK = 10_000
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+def size_label(n):
+    if n >= 1_000_000:
+        return f'{n // 1_000_000}m'
+    if n >= 1_000:
+        return f'{n // 1_000}k'
+    return str(n)
+
+class Bench:
+    """Runs the cases of one database backend and collects their latencies."""
+
+    def __init__(self, app, iterations, case_seconds):
+        self.app = app
+        self.client = app.test_client()
+        self.iterations = iterations
+        self.case_seconds = case_seconds
+        self.results = {}
+
+    def measure(self, name, request, items=1):
+        """Time request() until the iteration count or time budget is reached, after one warmup call.
+
+        ``items`` is the number of snapshots a call handles, to report a per-item rate.
+        """
+        response = request()
+        if response.status_code >= 400:
+            raise RuntimeError(f'{name}: HTTP {response.status_code} {response.get_data(as_text=True)[:200]}')
+
+        latencies = []
+        started = time.perf_counter()
+        while len(latencies) < self.iterations:
+            call_started = time.perf_counter()
+            request()
+            latencies.append((time.perf_counter() - call_started) * 1000)
+            if len(latencies) >= 3 and time.perf_counter() - started > self.case_seconds:
+                break
+
+        result = summarize(latencies)
+        result['response_bytes'] = len(response.data)
+        if items > 1:
+            result['items_per_s'] = round(items * len(latencies) / (sum(latencies) / 1000), 1)
+        self.results[name] = result
+        print(f"  {name:<32}{result['count']:>6}{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+              f"{result['p99_ms']:>10.2f}", flush=True)
+        return result
+
+def reset_schema():
+    from app import db
+    db.drop_all()
+    db.create_all()
+
+def seed_metrics(count, snapshots_per_metric):
+    """Register one aggregator with count metrics, each with a few snapshots."""
+    from sqlalchemy import insert
+
+    from app import db
+    from app.models.models import Snapshot
+    from app.registration import register
+
+    # Registered in chunks to stay under SQLite's limit on statement parameters
+    name = f'bench-{uuid.uuid4().hex[:8]}'
+    metric_uuids = []
+    for chunk in range(0, max(count, 1), 1000):
+        registered = register(name, {f'metric-{i}': 'ms' for i in range(chunk, min(chunk + 1000, count))})
+        metric_uuids += [metric['uuid'] for metric in registered['metrics'].values()]
+
+    rows = [
+        {'metric_uuid': metric_uuid, 'value': float(i), 'timestamp': START + timedelta(seconds=i), 'offset': 0}
+        for metric_uuid in metric_uuids for i in range(snapshots_per_metric)
+    ]
+    for chunk in range(0, len(rows), SEED_CHUNK):
+        db.session.execute(insert(Snapshot), rows[chunk:chunk + SEED_CHUNK])
+    db.session.commit()
+    return registered['uuid'], metric_uuids
+
+def seed_range(metric_uuid, rows):
+    """Insert rows snapshots of a metric, one second apart."""
+    from sqlalchemy import insert
+
+    from app import db
+    from app.models.models import Snapshot
+
+    for chunk in range(0, rows, SEED_CHUNK):
+        db.session.execute(insert(Snapshot), [
+            {'metric_uuid': metric_uuid, 'value': float(i), 'timestamp': START + timedelta(seconds=i), 'offset': 0}
+            for i in range(chunk, min(chunk + SEED_CHUNK, rows))
+        ])
+        db.session.commit()
+
+def snapshot_payload(metric_uuid, i):
+    timestamp = (START + timedelta(milliseconds=i)).isoformat()
+    return {'metric_uuid': metric_uuid, 'value': float(i), 'timestamp': timestamp, 'offset': 0}
+
+def run_fleet_cases(bench, metric_counts):
+    """/latest_snapshots, /metrics and /poll_shutdown_status over fleets of increasing size."""
+    client = bench.client
+    for count in metric_counts:
+        with bench.app.app_context():
+            reset_schema()
+            aggregator_uuid, _ = seed_metrics(count, SNAPSHOTS_PER_METRIC)
+
+        label = size_label(count)
+        bench.measure(f'latest_snapshots_{label}_metrics', lambda: client.get('/latest_snapshots'))
+        bench.measure(f'metrics_{label}_metrics', lambda: client.get('/metrics'))
+        bench.measure(f'poll_shutdown_status_{label}_metrics',
+                      lambda: client.get(f'/poll_shutdown_status/{aggregator_uuid}'))
+
+def run_ingest_cases(bench):
+    """/snapshot and /snapshots/batch into a registered metric."""
+    client = bench.client
+    with bench.app.app_context():
+        reset_schema()
+        _, (metric_uuid,) = seed_metrics(1, 0)
+
+    counter = iter(range(10 ** 9))
+    bench.measure('snapshot_single', lambda: client.post('/snapshot', json=snapshot_payload(metric_uuid, next(counter))))
+
+    for batch_size in BATCH_SIZES:
+        def send_batch():
+            snapshots = [snapshot_payload(metric_uuid, next(counter)) for _ in range(batch_size)]
+            return client.post('/snapshots/batch', json={'snapshots': snapshots})
+        bench.measure(f'snapshots_batch_{batch_size}', send_batch, items=batch_size)
+
+def run_range_cases(bench, sizes):
+    """/snapshots returning every row of metrics of increasing size."""
+    client = bench.client
+    with bench.app.app_context():
+        reset_schema()
+        _, metric_uuids = seed_metrics(len(sizes), 0)
+
+    for size, metric_uuid in zip(sizes, metric_uuids):
+        with bench.app.app_context():
+            seed_range(metric_uuid, size)
+
+        start = START.isoformat()
+        end = (START + timedelta(seconds=size)).isoformat()
+        bench.measure(f'snapshots_range_{size_label(size)}',
+                      lambda: client.get('/snapshots', query_string={'metric_uuid': metric_uuid, 'start': start,
+                                                                      'end': end, 'time_format': 'epoch_ms'}),
+                      items=size)
+
+def run_backend(database_url, options):
+    """Run every case against one database and return the results (in a fresh process)."""
+    # One aggregator sends every ingest request, faster than its rate limit allows
+    os.environ.update(DATABASE_URL=database_url, SELF_MONITOR_INTERVAL='0', LOG_LEVEL='WARNING', INGEST_RATE_LIMIT='0')
+    from app import create_app
+
+    app = create_app()
+    bench = Bench(app, options['iterations'], options['case_seconds'])
+    print(f"\n{app.config['SQLALCHEMY_DATABASE_URI'].split('://')[0]}")
+    print(f"  {'case':<32}{'count':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}", flush=True)
+
+    run_ingest_cases(bench)
+    run_fleet_cases(bench, options['metric_counts'])
+    run_range_cases(bench, options['sizes'])
+
+    with app.app_context():
+        from app import db
+        db.drop_all()
+    return bench.results
+
+def postgres_available(url):
+    from sqlalchemy import create_engine, text
+    try:
+        engine = create_engine(url)
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+        engine.dispose()
+        return True
+    except Exception as e:
+        print(f'PostgreSQL at {url} is not available, skipping it: {e}')
+        return False
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'time': datetime.now(timezone.utc).isoformat(),
+        'git_commit': commit or None,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+def compare(results, baseline_path):
+    """Print the change of each case's p50 against an earlier run."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+
+    print(f"\nAgainst {baseline_path}")
+    print(f"  {'case':<44}{'before':>10}{'after':>10}{'change':>9}")
+    for backend, cases in results.items():
+        for name, result in cases.items():
+            before = baseline.get(backend, {}).get(name)
+            if before and before['p50_ms']:
+                change = result['p50_ms'] / before['p50_ms'] - 1
+                print(f"  {backend + ' ' + name:<44}{before['p50_ms']:>10.2f}{result['p50_ms']:>10.2f}{change:>+9.0%}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--postgres', default=os.getenv('COC_BENCH_POSTGRES_URL'),
+                        help='PostgreSQL database to benchmark as well; its tables are dropped')
+    parser.add_argument('--no-sqlite', dest='sqlite', action='store_false', help='Skip the SQLite run')
+    parser.add_argument('--quick', action='store_true', help='Only the smaller datasets')
+    parser.add_argument('--iterations', type=int, default=200, help='Most timed calls per case')
+    parser.add_argument('--case-seconds', type=float, default=10, help='Time budget per case (at least 3 calls)')
+    parser.add_argument('--json', metavar='PATH', help='Write the results as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='Print the p50 change against an earlier --json file')
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    options = {
+        'iterations': args.iterations,
+        'case_seconds': args.case_seconds,
+        'sizes': QUICK_SNAPSHOT_RANGE_SIZES if args.quick else SNAPSHOT_RANGE_SIZES,
+        'metric_counts': QUICK_METRIC_COUNTS if args.quick else METRIC_COUNTS,
+    }
+
+    backends = {}
+    if args.sqlite:
+        backends['sqlite'] = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='coc-bench-'), 'bench.sqlite')}"
+    if args.postgres and postgres_available(args.postgres):
+        backends['postgresql'] = args.postgres
+
+    # Each backend gets a fresh process, since the app and its engine are created once per process
+    results = {}
+    for name, url in backends.items():
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            results[name] = executor.submit(run_backend, url, options).result()
+
+    report = {'environment': environment(), 'options': options, 'results': results}
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nWrote {args.json}")
+    if args.compare:
+        compare(results, args.compare)
+    return report
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,305 @@
+"""Simulate a fleet of aggregators against a COC server and report ingest performance.
+
+Each simulated aggregator registers M metrics, takes one reading per metric every
+``--interval`` seconds and sends them in batches of ``--batch-size`` (batches of one
+use POST /snapshot, larger ones POST /snapshots/batch). Dashboard endpoints are
+probed at the same time to measure read latency under load.
+
+Examples:
+
+    # Against a running server
+    python -m benchmarks.loadgen --url http://localhost:5000 -a 100 -m 10 --interval 1 --duration 60
+
+    # Start a local server on SQLite (or a postgresql:// URL) for the run
+    python -m benchmarks.loadgen --serve sqlite:////tmp/loadgen.sqlite -a 50 -m 20 --batch-size 100
+
+    # Spread the fleet over 4 processes
+    python -m benchmarks.loadgen --url http://localhost:5000 -a 1000 -m 5 --mode process --workers 4
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
+
+from coc_client.transport import ClientError, Transport
+
+# Dashboard endpoints probed while the fleet is running; {metric} is a simulated metric
+# and {start} and {end} span the last hour
+DASHBOARD_ENDPOINTS = {
+    'metrics': '/metrics',
+    'latest_snapshots': '/latest_snapshots',
+    'snapshots_page': '/snapshots/page?metric_uuid={metric}&limit=100',
+    'snapshots_series': '/snapshots/series?metric_uuid={metric}&start={start}&end={end}&points=1000',
+}
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def summarize(latencies_ms):
+    values = sorted(latencies_ms)
+    return {
+        'count': len(values),
+        'mean_ms': round(sum(values) / len(values), 2) if values else None,
+        'p50_ms': percentile(values, 0.50),
+        'p95_ms': percentile(values, 0.95),
+        'p99_ms': percentile(values, 0.99),
+        'max_ms': values[-1] if values else None,
+    }
+
+class Recorder:
+    """Latencies and outcomes of the requests made by one worker."""
+
+    def __init__(self):
+        self.ingest_ms = []
+        self.snapshots_sent = 0
+        self.errors = {}
+        self.dashboard_ms = {name: [] for name in DASHBOARD_ENDPOINTS}
+        self.dashboard_errors = 0
+
+    def error(self, error):
+        key = str(error.status_code) if isinstance(error, ClientError) and error.status_code else 'connection'
+        self.errors[key] = self.errors.get(key, 0) + 1
+
+    def to_dict(self):
+        return {
+            'ingest_ms': self.ingest_ms,
+            'snapshots_sent': self.snapshots_sent,
+            'errors': self.errors,
+            'dashboard_ms': self.dashboard_ms,
+            'dashboard_errors': self.dashboard_errors,
+        }
+
+async def timed(loop, executor, call):
+    """Run a blocking call in the executor and return (elapsed ms, error or None)."""
+    started = time.perf_counter()
+    try:
+        await loop.run_in_executor(executor, call)
+        return (time.perf_counter() - started) * 1000, None
+    except ClientError as e:
+        return (time.perf_counter() - started) * 1000, e
+
+async def run_aggregator(transport, executor, recorder, metric_uuids, args, deadline):
+    """Report every metric once per interval until the deadline, sending full batches."""
+    loop = asyncio.get_running_loop()
+    offset = random.choice([-480, 0, 60, 330])
+    pending = []
+
+    # Spread the fleet over the first interval instead of starting in lockstep
+    await asyncio.sleep(random.uniform(0, args.interval))
+
+    while time.monotonic() < deadline:
+        tick = time.monotonic()
+        now = datetime.now(timezone.utc).isoformat()
+        pending.extend({'metric_uuid': metric_uuid, 'value': random.uniform(0, 100), 'timestamp': now,
+                        'offset': offset} for metric_uuid in metric_uuids)
+
+        while len(pending) >= args.batch_size:
+            batch, pending = pending[:args.batch_size], pending[args.batch_size:]
+            if args.batch_size == 1:
+                call = lambda: transport.request('POST', '/snapshot', batch[0], retry=False)
+            else:
+                call = lambda: transport.request('POST', '/snapshots/batch', {'snapshots': batch}, retry=False,
+                                                 compress=args.gzip)
+            elapsed, error = await timed(loop, executor, call)
+            if error is None:
+                recorder.ingest_ms.append(round(elapsed, 3))
+                recorder.snapshots_sent += len(batch)
+            else:
+                recorder.error(error)
+
+        await asyncio.sleep(max(0, args.interval - (time.monotonic() - tick)))
+
+async def probe_dashboard(transport, executor, recorder, metric_uuids, args, deadline):
+    """Request each dashboard endpoint every probe interval until the deadline."""
+    loop = asyncio.get_running_loop()
+    while time.monotonic() < deadline:
+        tick = time.monotonic()
+        end = datetime.now(timezone.utc)
+        values = {
+            'metric': random.choice(metric_uuids),
+            'start': (end - timedelta(hours=1)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'end': end.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }
+        for name, path in DASHBOARD_ENDPOINTS.items():
+            elapsed, error = await timed(loop, executor,
+                                         lambda: transport.request('GET', path.format(**values), retry=False))
+            if error is None:
+                recorder.dashboard_ms[name].append(round(elapsed, 3))
+            else:
+                recorder.dashboard_errors += 1
+        await asyncio.sleep(max(0, args.probe_interval - (time.monotonic() - tick)))
+
+async def run_fleet(args, aggregator_indexes, probe):
+    """Register and run the given aggregators on one event loop."""
+    recorder = Recorder()
+    executor = ThreadPoolExecutor(args.concurrency)
+    transport = Transport(args.url, timeout=args.timeout, retries=0, pool_size=args.concurrency)
+    loop = asyncio.get_running_loop()
+
+    metrics = [{'name': f'metric-{index}', 'unit': 'units'} for index in range(args.metrics)]
+    fleet = []
+    for index in aggregator_indexes:
+        registration = await loop.run_in_executor(
+            executor, lambda: transport.request('POST', '/register', {'name': f'{args.prefix}-{index}', 'metrics': metrics})
+        )
+        fleet.append([metric['uuid'] for metric in registration['metrics'].values()])
+
+    deadline = time.monotonic() + args.duration
+    tasks = [run_aggregator(transport, executor, recorder, metric_uuids, args, deadline) for metric_uuids in fleet]
+    if probe and fleet:
+        tasks.append(probe_dashboard(transport, executor, recorder, fleet[0], args, deadline))
+    await asyncio.gather(*tasks)
+
+    executor.shutdown()
+    transport.close()
+    return recorder.to_dict()
+
+def run_worker(args, aggregator_indexes, probe):
+    return asyncio.run(run_fleet(args, aggregator_indexes, probe))
+
+def merge(results):
+    merged = Recorder().to_dict()
+    for result in results:
+        merged['ingest_ms'] += result['ingest_ms']
+        merged['snapshots_sent'] += result['snapshots_sent']
+        merged['dashboard_errors'] += result['dashboard_errors']
+        for key, count in result['errors'].items():
+            merged['errors'][key] = merged['errors'].get(key, 0) + count
+        for name, values in result['dashboard_ms'].items():
+            merged['dashboard_ms'][name] += values
+    return merged
+
+def report(args, merged, elapsed):
+    requests_ok = len(merged['ingest_ms'])
+    requests_failed = sum(merged['errors'].values())
+    total = requests_ok + requests_failed
+    return {
+        'config': {
+            'aggregators': args.aggregators,
+            'metrics': args.metrics,
+            'interval': args.interval,
+            'batch_size': args.batch_size,
+            'mode': args.mode,
+            'workers': args.workers,
+            'concurrency': args.concurrency,
+            'gzip': args.gzip,
+            'duration': args.duration,
+            'offered_snapshots_per_sec': args.aggregators * args.metrics / args.interval,
+        },
+        'elapsed_s': round(elapsed, 2),
+        'throughput': {
+            'snapshots_per_sec': round(merged['snapshots_sent'] / elapsed, 1),
+            'requests_per_sec': round(requests_ok / elapsed, 1),
+        },
+        'ingest_latency': summarize(merged['ingest_ms']),
+        'errors': {
+            'count': requests_failed,
+            'rate': round(requests_failed / total, 4) if total else 0,
+            'by_status': merged['errors'],
+        },
+        'dashboard_latency': {name: summarize(values) for name, values in merged['dashboard_ms'].items()},
+        'dashboard_errors': merged['dashboard_errors'],
+    }
+
+def print_report(result):
+    config = result['config']
+    print(f"\n{config['aggregators']} aggregators x {config['metrics']} metrics every {config['interval']}s, "
+          f"batch size {config['batch_size']}, {config['mode']} mode "
+          f"(offered {config['offered_snapshots_per_sec']:.0f} snapshots/s)")
+    print(f"Throughput: {result['throughput']['snapshots_per_sec']} snapshots/s, "
+          f"{result['throughput']['requests_per_sec']} requests/s over {result['elapsed_s']}s")
+    print(f"Errors: {result['errors']['count']} ({result['errors']['rate']:.2%}) {result['errors']['by_status']}")
+
+    print(f"\n{'endpoint':<24}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = [('ingest', result['ingest_latency'])] + list(result['dashboard_latency'].items())
+    for name, stats in rows:
+        cells = [stats[key] for key in ('p50_ms', 'p95_ms', 'p99_ms', 'max_ms')]
+        print(f"{name:<24}{stats['count']:>8}" + ''.join(f"{'-' if cell is None else f'{cell:.1f}':>10}" for cell in cells))
+
+def start_server(database_url, port, workers):
+    """Start gunicorn with gunicorn.conf.py on a database URL after applying migrations, and wait until it answers."""
+    env = dict(os.environ, DATABASE_URL=database_url, FLASK_APP='run.py', WEB_CONCURRENCY=str(workers))
+    subprocess.run([sys.executable, '-m', 'flask', 'db', 'upgrade'], env=env, check=True)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '-b', f'127.0.0.1:{port}', 'run:app'],
+        env=env
+    )
+
+    url = f'http://127.0.0.1:{port}'
+    for _ in range(60):
+        try:
+            requests.get(f'{url}/metrics', timeout=1)
+            return server, url
+        except requests.RequestException:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError('Server did not start')
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default=os.getenv('COC_SERVER_URL', 'http://localhost:5000'), help='Server to load')
+    parser.add_argument('--serve', metavar='DATABASE_URL', help='Start a local gunicorn server on this database first')
+    parser.add_argument('--serve-port', type=int, default=5055)
+    parser.add_argument('--serve-workers', type=int, default=4)
+    parser.add_argument('-a', '--aggregators', type=int, default=10)
+    parser.add_argument('-m', '--metrics', type=int, default=10, help='Metrics per aggregator')
+    parser.add_argument('--interval', type=float, default=1.0, help='Seconds between readings of each metric')
+    parser.add_argument('--batch-size', type=int, default=1, help='Readings per request (1 uses POST /snapshot)')
+    parser.add_argument('--no-gzip', dest='gzip', action='store_false', help='Send batches uncompressed')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+    parser.add_argument('--mode', choices=['async', 'process'], default='async')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Processes in process mode')
+    parser.add_argument('--concurrency', type=int, default=64, help='Requests in flight per process')
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--probe-interval', type=float, default=2.0, help='Seconds between dashboard probes')
+    parser.add_argument('--prefix', default=f'loadgen-{uuid.uuid4().hex[:8]}', help='Aggregator name prefix')
+    parser.add_argument('--json', metavar='PATH', help='Also write the report as JSON')
+    args = parser.parse_args(argv)
+    if args.mode == 'async':
+        args.workers = 1
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    server = None
+    if args.serve:
+        server, args.url = start_server(args.serve, args.serve_port, args.serve_workers)
+
+    try:
+        started = time.monotonic()
+        if args.mode == 'process':
+            shares = [list(range(args.aggregators))[worker::args.workers] for worker in range(args.workers)]
+            with multiprocessing.Pool(args.workers) as pool:
+                results = pool.starmap(run_worker, [(args, share, worker == 0) for worker, share in enumerate(shares)])
+        else:
+            results = [run_worker(args, range(args.aggregators), True)]
+        # Each worker runs for --duration after registering; registration is not measured
+        elapsed = min(time.monotonic() - started, args.duration)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    result = report(args, merge(results), elapsed)
+    print_report(result)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(result, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,7 @@
+"""Python client for publishing metrics to a COC server."""
+from coc_client.aggregate import WindowAggregator
+from coc_client.aio import AsyncClient
+from coc_client.client import Client
+from coc_client.transport import ClientError, Transport
+
+__all__ = ['AsyncClient', 'Client', 'ClientError', 'Transport', 'WindowAggregator']
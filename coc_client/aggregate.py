@@ -0,0 +1,65 @@
+import threading
+import time
+from datetime import datetime, timezone
+
+from coc_client.payloads import local_offset_minutes
+
+class WindowAggregator:
+    """Summarize each metric's samples over fixed windows of ``window_seconds``.
+
+    Windows are aligned to multiples of ``window_seconds`` since the Unix epoch, so
+    collectors (and restarts of one collector) produce comparable windows. A window
+    is closed when a sample for a later window arrives or when drain() is called
+    after it ended, and is returned as an aggregate payload for /snapshots/batch.
+    """
+
+    def __init__(self, window_seconds=60):
+        self.window_seconds = window_seconds
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _payload(self, metric_uuid, window):
+        window_start, count, minimum, maximum, total, last, offset = window
+        return {
+            'metric_uuid': metric_uuid,
+            'window_start': datetime.fromtimestamp(window_start, timezone.utc).isoformat(),
+            'window_seconds': self.window_seconds,
+            'count': count,
+            'min': minimum,
+            'max': maximum,
+            'sum': total,
+            'last': last,
+            'offset': offset,
+        }
+
+    def add(self, metric_uuid, value, timestamp=None, offset=None):
+        """Add a sample and return the payload of the window it closed, if any."""
+        seconds = timestamp.timestamp() if timestamp is not None else time.time()
+        window_start = seconds - seconds % self.window_seconds
+        offset = local_offset_minutes() if offset is None else offset
+
+        with self._lock:
+            window = self._windows.get(metric_uuid)
+            closed = None
+            if window is not None and window[0] != window_start:
+                closed = self._payload(metric_uuid, window)
+                window = None
+
+            if window is None:
+                self._windows[metric_uuid] = [window_start, 1, value, value, value, value, offset]
+            else:
+                window[1] += 1
+                window[2] = min(window[2], value)
+                window[3] = max(window[3], value)
+                window[4] += value
+                window[5] = value
+                window[6] = offset
+            return closed
+
+    def drain(self, force=False):
+        """Close and return the payloads of every window that has ended, or of all windows if force."""
+        now = time.time()
+        with self._lock:
+            ended = [metric_uuid for metric_uuid, window in self._windows.items()
+                     if force or window[0] + self.window_seconds <= now]
+            return [self._payload(metric_uuid, self._windows.pop(metric_uuid)) for metric_uuid in ended]
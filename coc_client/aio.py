@@ -0,0 +1,123 @@
+import asyncio
+import logging
+
+from coc_client.base import BaseClient
+from coc_client.transport import ClientError
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+class AsyncClient(BaseClient):
+    """asyncio counterpart of Client with the same buffering, aggregation, spooling and flushing rules.
+
+    Requests go through the same pooled Transport as Client, run in the default
+    executor so that the event loop never blocks on the network. Use it as an async
+    context manager, or call start() and await close() yourself.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._flush_lock = None
+        self._wakeup = None
+        self._closed = None
+        self._flusher = None
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def _ensure_loop_state(self):
+        # Created lazily so that they belong to the running event loop
+        if self._wakeup is None:
+            self._flush_lock = asyncio.Lock()
+            self._wakeup = asyncio.Event()
+            self._closed = asyncio.Event()
+
+    async def _request(self, *args, **kwargs):
+        return await asyncio.to_thread(self.transport.request, *args, **kwargs)
+
+    async def register(self, name, metrics):
+        """Register an aggregator and its metrics, see Client.register."""
+        return await self._request('POST', '/register', {'name': name, 'metrics': metrics})
+
+    async def get_config(self, aggregator_uuid):
+        """Fetch the reporting config the server wants the aggregator to use."""
+        return await self._request('GET', f'/aggregators/{aggregator_uuid}/config')
+
+    def _wake(self):
+        # publish() and record() are called on the loop, so the event can be set directly
+        self._ensure_loop_state()
+        self._wakeup.set()
+
+    async def send_batch(self, batch, key=None):
+        """Send a list of snapshot and aggregate payloads in one request and return how many were accepted.
+
+        Pass the same ``key`` when sending a batch again, so that it is not written twice.
+        """
+        return await asyncio.to_thread(self._post_batch, batch, key)
+
+    async def flush(self):
+        """Send every buffered snapshot now, see Client.flush.
+
+        The sends, spooling and replay run together in the default executor.
+        """
+        self._ensure_loop_state()
+        self._enqueue(self.aggregator.drain(force=self._closed.is_set()))
+        async with self._flush_lock:
+            return await asyncio.to_thread(self._flush_buffer)
+
+    async def replay(self, deadline=None):
+        """Send spooled snapshots to the server at the replay rate and return how many were sent."""
+        self._ensure_loop_state()
+        async with self._flush_lock:
+            return await asyncio.to_thread(self._replay_spool, deadline)
+
+    async def _flush_loop(self):
+        while not self._closed.is_set():
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the task that flushes the buffer. Must be called from a running event loop."""
+        self._ensure_loop_state()
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def poll_commands(self, aggregator_uuid, wait=30):
+        """Long-poll for commands queued for the aggregator, waiting up to ``wait`` seconds."""
+        response = await self._request('GET', f'/commands/{aggregator_uuid}', params={'wait': wait},
+                                       timeout=wait + self.transport.timeout)
+        return response['commands']
+
+    async def listen(self, aggregator_uuid, handler, wait=30):
+        """Await handler(command) for every command sent to the aggregator until a shutdown command or close()."""
+        self._ensure_loop_state()
+        while not self._closed.is_set():
+            try:
+                commands = await self.poll_commands(aggregator_uuid, wait)
+            except ClientError as e:
+                logger.error(f'Error polling for commands: {e}')
+                await asyncio.sleep(self.transport.backoff_delay(0, 5))
+                continue
+
+            for command in commands:
+                await handler(command)
+                if command['command'] == 'shutdown':
+                    return
+
+    async def close(self):
+        """Stop the flush task, send whatever is still buffered and close the session."""
+        self._ensure_loop_state()
+        self._closed.set()
+        self._wakeup.set()
+        if self._flusher is not None:
+            await self._flusher
+        await self.flush()
+        self.transport.close()
@@ -0,0 +1,173 @@
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+from coc_client.aggregate import WindowAggregator
+from coc_client.payloads import batch_body, snapshot_payload
+from coc_client.spool import Spool
+from coc_client.transport import ClientError, Transport
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+# Largest batch the server accepts on /snapshots/batch
+MAX_BATCH_SIZE = 10000
+
+class BaseClient:
+    """Buffering, offline and spooling rules shared by Client and AsyncClient.
+
+    Subclasses decide when _flush_buffer() and _replay_spool() run (a thread or
+    an asyncio task) and expose the requests with their own calling convention;
+    the methods here are synchronous and only called with the flush lock held.
+    """
+
+    def __init__(self, base_url=None, batch_size=500, flush_interval=1.0, max_buffer=100000, spool_dir=None,
+                 spool_max_bytes=512 * 1024 * 1024, replay_batch_size=MAX_BATCH_SIZE, replay_rate=5000,
+                 aggregate_window=60, **transport_options):
+        base_url = base_url or os.getenv('COC_SERVER_URL')
+        if not base_url:
+            raise ValueError('A server URL is required, pass base_url or set COC_SERVER_URL')
+
+        self.transport = Transport(base_url, **transport_options)
+        self.aggregator = WindowAggregator(aggregate_window)
+        self.batch_size = min(batch_size, MAX_BATCH_SIZE)
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.dropped = 0
+
+        self.spool = Spool(spool_dir, max_bytes=spool_max_bytes) if spool_dir else None
+        self.replay_batch_size = min(replay_batch_size, MAX_BATCH_SIZE)
+        self.replay_rate = replay_rate
+        self._failures = 0
+        self._offline_until = 0
+
+        self._buffer = deque()
+        self._buffer_lock = threading.Lock()
+        # A batch whose send failed with the server unreachable, kept whole to be sent again with its key
+        self._unsent = None
+
+    def _wake(self):
+        """Wake the flusher because a full batch is waiting."""
+
+    def _enqueue(self, payloads):
+        with self._buffer_lock:
+            for payload in payloads:
+                if len(self._buffer) >= self.max_buffer:
+                    self._buffer.popleft()
+                    self.dropped += 1
+                self._buffer.append(payload)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake()
+
+    def publish(self, metric_uuid, value, timestamp=None, offset=None):
+        """Buffer a snapshot for the next batch. Never blocks on the network."""
+        self._enqueue([snapshot_payload(metric_uuid, value, timestamp, offset)])
+
+    def record(self, metric_uuid, value, timestamp=None, offset=None):
+        """Add a sample to the metric's current aggregate window. Never blocks on the network."""
+        closed = self.aggregator.add(metric_uuid, value, timestamp, offset)
+        if closed is not None:
+            self._enqueue([closed])
+
+    def _take_batch(self):
+        """The next batch to send and its idempotency key, None if it was never sent."""
+        with self._buffer_lock:
+            if self._unsent is not None:
+                batch, key = self._unsent
+                self._unsent = None
+                return batch, key
+            count = min(len(self._buffer), self.batch_size)
+            return [self._buffer.popleft() for _ in range(count)], None
+
+    def _requeue(self, batch, key=None):
+        """Put a batch that could not be sent back at the front of the buffer.
+
+        A batch that was sent is kept whole with its key, as the server may have written it.
+        """
+        with self._buffer_lock:
+            if key is not None:
+                self._unsent = (batch, key)
+                return
+            room = self.max_buffer - len(self._buffer)
+            if room < len(batch):
+                self.dropped += len(batch) - max(room, 0)
+                batch = batch[len(batch) - max(room, 0):]
+            self._buffer.extendleft(reversed(batch))
+
+    def _post_batch(self, batch, key=None):
+        """Send a batch with its idempotency key, so that sending it again never writes it twice."""
+        response = self.transport.request('POST', '/snapshots/batch', batch_body(batch), compress=True,
+                                          headers={'Idempotency-Key': key or uuid.uuid4().hex})
+        return response['accepted']
+
+    def _is_rejected(self, error):
+        """Whether the server refused a request outright, so retrying it would fail again."""
+        return error.status_code is not None and 400 <= error.status_code < 500 and error.status_code != 429
+
+    def _went_offline(self, error):
+        self._failures += 1
+        delay = self.transport.backoff_delay(min(self._failures, 10))
+        self._offline_until = time.monotonic() + delay
+        logger.error(f'Server unavailable, not sending for {delay:.1f}s: {error}')
+
+    def _is_offline(self):
+        return time.monotonic() < self._offline_until
+
+    def _flush_buffer(self):
+        """Send every buffered snapshot and return how many were accepted, following the rules of Client.flush."""
+        sent = 0
+        while True:
+            batch, key = self._take_batch()
+            if not batch:
+                break
+
+            if self._is_offline():
+                if self.spool is None:
+                    self._requeue(batch, key)
+                    break
+                self.spool.append(batch, key)
+                continue
+
+            key = key or uuid.uuid4().hex
+            try:
+                sent += self._post_batch(batch, key)
+                self._failures = 0
+            except ClientError as e:
+                if self._is_rejected(e):
+                    logger.error(f'Dropping {len(batch)} snapshots rejected by the server: {e}')
+                    self.dropped += len(batch)
+                    continue
+                self._went_offline(e)
+                if self.spool is None:
+                    self._requeue(batch, key)
+                    break
+                self.spool.append(batch, key)
+
+        if self.spool is not None and not self._is_offline() and self.spool.pending():
+            sent += self._replay_spool(deadline=time.monotonic() + self.flush_interval)
+        return sent
+
+    def _send_spooled(self, batch, key):
+        try:
+            return self._post_batch(batch, key)
+        except ClientError as e:
+            if not self._is_rejected(e):
+                raise
+            # Skip it, or it would block the rest of the spool forever
+            logger.error(f'Dropping {len(batch)} spooled snapshots rejected by the server: {e}')
+            self.dropped += len(batch)
+            return 0
+
+    def _replay_spool(self, deadline=None):
+        """Send spooled snapshots to the server at the replay rate and return how many were sent."""
+        try:
+            sent = self.spool.replay(self._send_spooled, self.replay_batch_size, self.replay_rate, deadline)
+            self._failures = 0
+            return sent
+        except ClientError as e:
+            self._went_offline(e)
+            return 0
@@ -0,0 +1,138 @@
+import logging
+import threading
+
+from coc_client.base import MAX_BATCH_SIZE, BaseClient
+from coc_client.transport import ClientError
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+class Client(BaseClient):
+    """Publish snapshots to a COC server and receive commands for an aggregator.
+
+    Published snapshots are buffered locally and sent to /snapshots/batch by a
+    background thread whenever ``batch_size`` of them are waiting or every
+    ``flush_interval`` seconds. All requests, including long polls for commands,
+    share one pooled keep-alive session. When the buffer holds ``max_buffer``
+    snapshots the oldest ones are dropped and counted in ``dropped``.
+
+    After a batch fails, the client stays offline for a jittered, exponentially
+    growing delay instead of retrying every flush. With ``spool_dir`` set, batches
+    that cannot be sent go to an on-disk Spool (capped at ``spool_max_bytes``) and
+    are replayed in batches of up to ``replay_batch_size`` at no more than
+    ``replay_rate`` snapshots per second once the server accepts requests again.
+    Without a spool they wait in the in-memory buffer.
+
+    record() pre-aggregates high-frequency samples instead: each metric's samples
+    are summarized (count, min, max, sum, last) over windows of
+    ``aggregate_window`` seconds and one aggregate per window is buffered and sent
+    like a snapshot.
+
+    The server URL defaults to the COC_SERVER_URL environment variable. Extra
+    keyword arguments are passed to Transport (timeout, retries, backoff, ...).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = threading.Event()
+        self._flusher = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def register(self, name, metrics):
+        """Register an aggregator and its metrics, given as [{"name": ..., "unit": ...}].
+
+        Registration is idempotent, so collectors should call this on every start.
+        Returns {"uuid": ..., "metrics": {name: {"uuid": ..., "unit": ...}}}.
+        """
+        return self.transport.request('POST', '/register', {'name': name, 'metrics': metrics})
+
+    def get_config(self, aggregator_uuid):
+        """Fetch the reporting config the server wants the aggregator to use."""
+        return self.transport.request('GET', f'/aggregators/{aggregator_uuid}/config')
+
+    def _wake(self):
+        self._wakeup.set()
+
+    def send_batch(self, batch, key=None):
+        """Send a list of snapshot and aggregate payloads in one request and return how many were accepted.
+
+        Pass the same ``key`` when sending a batch again, so that it is not written twice.
+        """
+        return self._post_batch(batch, key)
+
+    def flush(self):
+        """Send every buffered snapshot now and return how many were accepted.
+
+        A batch the server rejects outright (4xx other than 429) would fail again, so
+        it is logged and dropped. Any other failure takes the client offline for a
+        while; the batch and the rest of the buffer are spooled, or kept in memory
+        without a spool. While online, spooled batches are replayed for up to one
+        flush interval.
+        """
+        self._enqueue(self.aggregator.drain(force=self._closed.is_set()))
+        with self._flush_lock:
+            return self._flush_buffer()
+
+    def replay(self, deadline=None):
+        """Send spooled snapshots to the server at the replay rate and return how many were sent."""
+        with self._flush_lock:
+            return self._replay_spool(deadline)
+
+    def _flush_loop(self):
+        while not self._closed.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def start(self):
+        """Start the background thread that flushes the buffer."""
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
+
+    def poll_commands(self, aggregator_uuid, wait=30):
+        """Long-poll for commands queued for the aggregator, waiting up to ``wait`` seconds."""
+        response = self.transport.request('GET', f'/commands/{aggregator_uuid}', params={'wait': wait},
+                                          timeout=wait + self.transport.timeout)
+        return response['commands']
+
+    def listen(self, aggregator_uuid, handler, wait=30):
+        """Call handler(command) for every command sent to the aggregator, from a background thread.
+
+        The thread stops after delivering a shutdown command or once the client is
+        closed and its current poll returns.
+        """
+        def run():
+            while not self._closed.is_set():
+                try:
+                    commands = self.poll_commands(aggregator_uuid, wait)
+                except ClientError as e:
+                    logger.error(f'Error polling for commands: {e}')
+                    self._closed.wait(self.transport.backoff_delay(0, 5))
+                    continue
+
+                for command in commands:
+                    handler(command)
+                    if command['command'] == 'shutdown':
+                        return
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        """Stop the flush thread, send (or spool) whatever is still buffered and close the session."""
+        self._closed.set()
+        self._wakeup.set()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+        self.flush()
+        self.transport.close()
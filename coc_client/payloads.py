@@ -0,0 +1,22 @@
+from datetime import datetime, timezone
+
+def local_offset_minutes():
+    """The local timezone's current UTC offset in minutes."""
+    return int(datetime.now().astimezone().utcoffset().total_seconds() // 60)
+
+def snapshot_payload(metric_uuid, value, timestamp=None, offset=None):
+    """Build the JSON for one snapshot, defaulting to now in the local timezone."""
+    timestamp = timestamp or datetime.now(timezone.utc)
+    return {
+        'metric_uuid': metric_uuid,
+        'value': value,
+        'timestamp': timestamp.isoformat() if isinstance(timestamp, datetime) else timestamp,
+        'offset': local_offset_minutes() if offset is None else offset,
+    }
+
+def batch_body(batch):
+    """Split buffered snapshot and aggregate payloads into a /snapshots/batch body."""
+    body = {}
+    for payload in batch:
+        body.setdefault('aggregates' if 'window_start' in payload else 'snapshots', []).append(payload)
+    return body
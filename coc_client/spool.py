@@ -0,0 +1,200 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+SEGMENT_SUFFIX = '.spool'
+CURSOR_FILE = 'cursor'
+
+class Spool:
+    """An append-only on-disk queue of snapshot batches that could not be sent.
+
+    Batches are appended as JSON lines to numbered segment files of up to
+    ``segment_bytes`` each. When the spool grows past ``max_bytes`` the oldest
+    segments are deleted first. Replay reads the oldest segment, merges its lines
+    into batches of up to ``batch_size`` snapshots and records how far it got in a
+    cursor file after every batch the server accepted, so a restart resumes where
+    replay stopped.
+
+    Every batch is sent with an idempotency key, so the server writes it once
+    however often it is sent. A batch that was already sent before it was spooled
+    keeps its key and is replayed alone; merged batches get a new key, which is
+    written to the cursor with the batch's end before sending, so a retry after a
+    failure or a crash sends the same lines with the same key.
+    """
+
+    def __init__(self, directory, segment_bytes=8 * 1024 * 1024, max_bytes=512 * 1024 * 1024):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.evicted_bytes = 0
+        self._lock = threading.Lock()
+
+        os.makedirs(directory, exist_ok=True)
+
+    def _segments(self):
+        """Segment file names, oldest first."""
+        return sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _size(self):
+        return sum(os.path.getsize(self._path(name)) for name in self._segments())
+
+    def __len__(self):
+        """Number of spooled batches not yet replayed, counted from the segment files."""
+        with self._lock:
+            segment, offset, _ = self._read_cursor()
+            count = 0
+            for name in self._segments():
+                with open(self._path(name), 'rb') as f:
+                    if name == segment:
+                        f.seek(offset)
+                    count += sum(1 for _ in f)
+            return count
+
+    def pending(self):
+        """Whether any spooled batches are waiting to be replayed."""
+        with self._lock:
+            segments = self._segments()
+            if not segments:
+                return False
+            segment, offset, _ = self._read_cursor()
+            return len(segments) > 1 or segment != segments[0] or \
+                os.path.getsize(self._path(segments[0])) > offset
+
+    def append(self, batch, key=None):
+        """Append a batch of snapshot payloads to the newest segment, with the key it was already sent with."""
+        line = json.dumps({'key': key, 'records': batch}, separators=(',', ':')).encode() + b'\n'
+        with self._lock:
+            segments = self._segments()
+            if not segments or os.path.getsize(self._path(segments[-1])) + len(line) > self.segment_bytes:
+                number = int(segments[-1][:-len(SEGMENT_SUFFIX)]) + 1 if segments else 1
+                segments.append(f'{number:012d}{SEGMENT_SUFFIX}')
+
+            with open(self._path(segments[-1]), 'ab') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+            self._evict(segments)
+
+    def _evict(self, segments):
+        """Delete the oldest segments until the spool fits in max_bytes again."""
+        size = self._size()
+        while size > self.max_bytes and len(segments) > 1:
+            name = segments.pop(0)
+            segment_size = os.path.getsize(self._path(name))
+            os.remove(self._path(name))
+            size -= segment_size
+            self.evicted_bytes += segment_size
+            logger.warning(f'Spool is over {self.max_bytes} bytes, evicted segment {name} ({segment_size} bytes)')
+
+    def _read_cursor(self):
+        """The segment and offset replayed up to, and the (end, key) of a batch being sent from there, if any."""
+        try:
+            with open(self._path(CURSOR_FILE)) as f:
+                fields = f.read().split()
+            segment, offset = fields[0], int(fields[1])
+            in_flight = (int(fields[2]), fields[3]) if len(fields) == 4 else None
+            return segment, offset, in_flight
+        except (FileNotFoundError, ValueError, IndexError):
+            return None, 0, None
+
+    def _write_cursor(self, segment, offset, in_flight=None):
+        temporary = self._path(CURSOR_FILE + '.tmp')
+        with open(temporary, 'w') as f:
+            f.write(f'{segment} {offset}' + (' {} {}'.format(*in_flight) if in_flight else ''))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self._path(CURSOR_FILE))
+
+    @staticmethod
+    def _parse_line(line):
+        """The records of a spooled line and the key they were sent with (lines of older versions are lists)."""
+        entry = json.loads(line)
+        if isinstance(entry, list):
+            return entry, None
+        return entry['records'], entry['key']
+
+    def _next_batch(self, name, offset, in_flight, batch_size):
+        """Read the batch to replay from ``offset`` of a segment, returning (batch, end, key)."""
+        batch = []
+        end = offset
+        key = None
+        with open(self._path(name), 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    # Partially written line, the writer is still appending it
+                    break
+                records, line_key = self._parse_line(line)
+                if in_flight is not None:
+                    # Send the same lines again, with the same key
+                    if end >= in_flight[0]:
+                        break
+                elif line_key is not None:
+                    # Already sent, and maybe written, under its own key: never merge it
+                    if batch:
+                        break
+                    batch.extend(records)
+                    end += len(line)
+                    key = line_key
+                    break
+                elif batch and len(batch) + len(records) > batch_size:
+                    break
+                batch.extend(records)
+                end += len(line)
+
+        if in_flight is not None:
+            key = in_flight[1]
+        return batch, end, key or uuid.uuid4().hex
+
+    def replay(self, send, batch_size=10000, rate=None, deadline=None):
+        """Send spooled batches with send(batch, key), oldest first, and return how many snapshots were sent.
+
+        At most ``rate`` snapshots are sent per second, so a recovering server is not
+        flooded with the backlog. Replay stops early at ``deadline`` (a time.monotonic()
+        value) or when send raises, in which case the exception propagates and the
+        failed batch stays spooled, to be sent again with the same key.
+        """
+        sent = 0
+        while deadline is None or time.monotonic() < deadline:
+            with self._lock:
+                segments = self._segments()
+                if not segments:
+                    break
+                name = segments[0]
+                cursor_segment, offset, in_flight = self._read_cursor()
+                if cursor_segment != name:
+                    offset, in_flight = 0, None
+
+                batch, end, key = self._next_batch(name, offset, in_flight, batch_size)
+                if not batch:
+                    # Fully replayed; delete it unless it is still being appended to
+                    if len(segments) > 1:
+                        os.remove(self._path(name))
+                        continue
+                    break
+
+                if in_flight is None:
+                    self._write_cursor(name, offset, (end, key))
+
+            started = time.monotonic()
+            send(batch, key)
+            sent += len(batch)
+
+            with self._lock:
+                if os.path.exists(self._path(name)):
+                    self._write_cursor(name, end)
+
+            if rate:
+                time.sleep(max(0, len(batch) / rate - (time.monotonic() - started)))
+
+        return sent
@@ -0,0 +1,97 @@
+import gzip
+import json
+import logging
+import random
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Get logger for this module
+logger = logging.getLogger(__name__)
+
+# Status codes worth retrying: the server is overloaded or briefly unavailable
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class ClientError(Exception):
+    """Raised when the server rejects a request or it keeps failing after all retries."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class Transport:
+    """A pooled keep-alive HTTP session with retries and compressed request bodies.
+
+    Failed requests (connection errors and the statuses in RETRY_STATUSES) are
+    retried up to ``retries`` times with full-jitter exponential backoff, honouring
+    a Retry-After header when the server sends one. Requests made with
+    ``compress=True`` send JSON bodies larger than ``compress_min_bytes``
+    gzip-compressed; only the ingest endpoints accept compressed bodies.
+    A retried request is sent with the same headers, so an Idempotency-Key
+    stops the server from writing a batch twice when only its response was lost.
+    """
+
+    def __init__(self, base_url, timeout=10, retries=5, backoff=0.5, max_backoff=30,
+                 compress_min_bytes=1024, pool_size=10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.compress_min_bytes = compress_min_bytes
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def backoff_delay(self, attempt, retry_after=None):
+        """Seconds to wait before retry number ``attempt`` (starting at 0)."""
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method, path, payload=None, params=None, timeout=None, retry=True, compress=False,
+                headers=None):
+        """Send a request and return the decoded JSON response (None for an empty body)."""
+        headers = dict(headers or {})
+        body = None
+        if payload is not None:
+            body = json.dumps(payload).encode()
+            headers['Content-Type'] = 'application/json'
+            if compress and len(body) >= self.compress_min_bytes:
+                body = gzip.compress(body)
+                headers['Content-Encoding'] = 'gzip'
+
+        attempts = self.retries + 1 if retry else 1
+        for attempt in range(attempts):
+            retry_after = None
+            try:
+                response = self.session.request(method, f'{self.base_url}{path}', data=body, params=params,
+                                                headers=headers, timeout=timeout or self.timeout)
+            except requests.RequestException as e:
+                error = ClientError(f'{method} {path} failed: {e}')
+            else:
+                if response.status_code < 400:
+                    return response.json() if response.content else None
+
+                error = ClientError(f'{method} {path} returned {response.status_code}: {response.text}',
+                                    response.status_code)
+                if response.status_code not in RETRY_STATUSES:
+                    raise error
+                if 'Retry-After' in response.headers:
+                    try:
+                        retry_after = float(response.headers['Retry-After'])
+                    except ValueError:
+                        pass
+
+            if attempt + 1 < attempts:
+                delay = self.backoff_delay(attempt, retry_after)
+                logger.warning(f'{error}, retrying in {delay:.2f}s')
+                time.sleep(delay)
+
+        raise error
+
+    def close(self):
+        self.session.close()
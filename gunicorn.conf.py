@@ -0,0 +1,59 @@
+"""Gunicorn settings for running the COC server in production.
+
+    gunicorn -c gunicorn.conf.py run:app    # or: flask serve
+
+Every setting can be overridden with the environment variables below or on the
+command line. Size the database pool so that workers x (DB_POOL_SIZE +
+DB_MAX_OVERFLOW) stays below the database's connection limit.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', f"0.0.0.0:{os.getenv('PORT', 5000)}")
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+
+def default_worker_class():
+    """'gevent' when it is installed, else 'gthread'.
+
+    A parked /commands long poll pins a gthread thread for up to 60 s, so a few
+    collectors can take all GUNICORN_THREADS threads of a worker; under gevent
+    it is a greenlet, and thousands of them cost little.
+    """
+    try:
+        import gevent  # noqa: F401
+    except ImportError:
+        return 'gthread'
+    return 'gevent'
+
+# 'gevent' serves each request on a greenlet; 'gthread' on one of GUNICORN_THREADS threads
+worker_class = os.getenv('GUNICORN_WORKER_CLASS') or default_worker_class()
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', 2000))
+
+# Load the app once in the master so that workers fork with it imported. gevent
+# must patch the standard library before the app is imported, so it loads per worker.
+preload_app = worker_class != 'gevent'
+
+# Longer than the longest /commands long poll (60 s)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 90))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers now and then to bound memory growth
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from app.serve import after_fork
+        after_fork(worker.app.wsgi())
+
+def post_worker_init(worker):
+    from app.serve import make_psycopg_cooperative, warmup
+    if worker_class == 'gevent':
+        make_psycopg_cooperative()
+    warmup(worker.app.wsgi())
+
+def worker_exit(server, worker):
+    from app.serve import shutdown
+    shutdown(worker.app.wsgi())
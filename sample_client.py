@@ -1,101 +1,57 @@
-import requests
-import json
 import time
 import random
-from datetime import datetime, timezone, timedelta
-import threading
 import signal
+import socket
 import sys
 import os
 from dotenv import load_dotenv
-from app.utils import get_server_url
+
+from coc_client import Client, ClientError
 
 # Load environment variables
 load_dotenv()
 
 # Base URL for the API
-BASE_URL = "https://coc-server-w29k.onrender.com"
+BASE_URL = os.getenv("COC_SERVER_URL", "https://coc-server-w29k.onrender.com")
 
 # Global flag for shutdown
 shutdown_requested = False
 
-def register_aggregator(name):
-    """Register a new aggregator."""
-    response = requests.post(
-        f"{BASE_URL}/register_aggregator",
-        headers={"Content-Type": "application/json"},
-        data=json.dumps({"name": name})
-    )
-    
-    if response.status_code == 201:
-        return response.json()["uuid"]
-    else:
-        print(f"Error registering aggregator: {response.text}")
-        return None
+# Reporting config sent by the server with configure commands
+reporting_config = {"interval_factor": 1, "interval_seconds": None, "batch_size": None, "metrics": {}}
 
-def register_metric(aggregator_uuid, name, unit):
-    """Register a new metric."""
-    response = requests.post(
-        f"{BASE_URL}/register_metric",
-        headers={"Content-Type": "application/json"},
-        data=json.dumps({
-            "aggregator_uuid": aggregator_uuid,
-            "name": name,
-            "unit": unit
-        })
-    )
-    
-    if response.status_code == 201:
-        return response.json()["uuid"]
-    else:
-        print(f"Error registering metric: {response.text}")
-        return None
+def apply_config(client, config):
+    """Replace the reporting config with one sent by the server."""
+    global reporting_config
+    reporting_config = config
+    
+    # The client batches snapshots of all metrics together
+    if config.get("batch_size"):
+        client.batch_size = config["batch_size"]
+    print(f"Reporting config updated: {config}")
 
-def submit_snapshot(metric_uuid, value, offset_minutes):
-    """Submit a metric snapshot."""
-    # Get current time in UTC
-    now = datetime.now(timezone.utc)
-    
-    response = requests.post(
-        f"{BASE_URL}/snapshot",
-        headers={"Content-Type": "application/json"},
-        data=json.dumps({
-            "metric_uuid": metric_uuid,
-            "value": value,
-            "timestamp": now.isoformat(),
-            "offset": offset_minutes
-        })
-    )
-    
-    return response.status_code == 201
+def metric_interval(metric_uuid, default_interval):
+    """Return the reporting interval to use for a metric."""
+    override = reporting_config.get("metrics", {}).get(metric_uuid, {})
+    
+    interval = override.get("interval_seconds") or reporting_config.get("interval_seconds")
+    if not interval:
+        # No interval set by an operator, scale our own default while the server sheds load
+        interval = default_interval * reporting_config.get("interval_factor", 1)
+    return interval
 
-def listen_for_shutdown(aggregator_uuid):
-    """Poll for shutdown status."""
+def handle_command(client, command):
+    """Apply config changes and stop on shutdown."""
     global shutdown_requested
     
-    url = f"{BASE_URL}/poll_shutdown_status/{aggregator_uuid}"
-    
-    while not shutdown_requested:
-        try:
-            response = requests.get(url)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('should_shutdown', False):
-                    print("Received shutdown command. Shutting down...")
-                    shutdown_requested = True
-                    break
-            else:
-                print(f"Error polling shutdown status: {response.text}")
-        except Exception as e:
-            print(f"Error in polling connection: {e}")
-        
-        # Wait before polling again
-        time.sleep(5)  # Poll every 5 seconds
+    if command['command'] == 'configure':
+        apply_config(client, command['payload'])
+    elif command['command'] == 'shutdown':
+        print("Received shutdown command. Shutting down...")
+        shutdown_requested = True
 
-def generate_metrics(aggregator_uuid, metric_uuids, interval=5):
-    """Generate random metrics at regular intervals."""
-    global shutdown_requested
-    
+def generate_metrics(client, metric_uuids, interval=5):
+    """Generate random metrics, each at its own reporting interval."""
     # Define different timezone offsets for each metric (in minutes)
     offsets = {
         metric_uuids[0]: -480,  # UTC-8 (e.g., Pacific Time)
@@ -103,23 +59,27 @@ def generate_metrics(aggregator_uuid, metric_uuids, interval=5):
         metric_uuids[2]: 330,   # UTC+5:30 (e.g., India)
     }
     
+    next_due = {metric_uuid: time.monotonic() for metric_uuid in metric_uuids}
+    
     while not shutdown_requested:
+        now = time.monotonic()
         for metric_uuid in metric_uuids:
+            if next_due[metric_uuid] > now:
+                continue
+            next_due[metric_uuid] = now + metric_interval(metric_uuid, interval)
+    
             # Generate a random value
             value = random.uniform(0, 100)
-            
+    
             # Get the offset for this metric
             offset = offsets.get(metric_uuid, 0)
-            
-            # Submit the snapshot with the offset
-            success = submit_snapshot(metric_uuid, value, offset)
-            if success:
-                print(f"Submitted snapshot for metric {metric_uuid}: {value} (UTC{'+' if offset >= 0 else ''}{offset//60:02d}:{abs(offset%60):02d})")
-            else:
-                print(f"Failed to submit snapshot for metric {metric_uuid}")
-        
-        # Wait for the next interval
-        time.sleep(interval)
+    
+            # Buffer the snapshot, the client sends it with the next batch
+            client.publish(metric_uuid, value, offset=offset)
+            print(f"Published snapshot for metric {metric_uuid}: {value} (UTC{'+' if offset >= 0 else ''}{offset//60:02d}:{abs(offset%60):02d})")
+    
+        # Sleep until the next metric is due
+        time.sleep(max(0.1, min(next_due.values()) - time.monotonic()))
 
 def signal_handler(sig, frame):
     """Handle Ctrl+C to gracefully shut down."""
@@ -133,16 +93,8 @@ def main():
     # Register signal handler for Ctrl+C
     signal.signal(signal.SIGINT, signal_handler)
     
-    # Register an aggregator
-    aggregator_name = f"sample-aggregator-{int(time.time())}"
-    print(f"Registering aggregator: {aggregator_name}")
-    aggregator_uuid = register_aggregator(aggregator_name)
-    
-    if not aggregator_uuid:
-        print("Failed to register aggregator. Exiting.")
-        return
-    
-    print(f"Aggregator registered with UUID: {aggregator_uuid}")
+    # Use the same name across restarts so the aggregator and its metrics are reused
+    aggregator_name = os.getenv("AGGREGATOR_NAME", f"sample-aggregator-{socket.gethostname()}")
     
     # Register metrics with location context
     metrics = [
@@ -151,28 +103,31 @@ def main():
         {"name": "temperature_mumbai", "unit": "°C"}, # Mumbai
     ]
     
-    metric_uuids = []
-    for metric in metrics:
-        print(f"Registering metric: {metric['name']}")
-        metric_uuid = register_metric(aggregator_uuid, metric["name"], metric["unit"])
-        if metric_uuid:
-            print(f"Metric registered with UUID: {metric_uuid}")
-            metric_uuids.append(metric_uuid)
-        else:
-            print(f"Failed to register metric: {metric['name']}")
-    
-    if not metric_uuids:
-        print("No metrics registered. Exiting.")
-        return
-    
-    # Start a thread to listen for shutdown events
-    shutdown_thread = threading.Thread(target=listen_for_shutdown, args=(aggregator_uuid,))
-    shutdown_thread.daemon = True
-    shutdown_thread.start()
-    
-    # Generate metrics
-    print("Starting to generate metrics...")
-    generate_metrics(aggregator_uuid, metric_uuids)
+    # Snapshots that cannot be sent during an outage are spooled to disk and replayed later
+    spool_dir = os.getenv("COC_SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+    
+    with Client(BASE_URL, flush_interval=5, spool_dir=spool_dir) as client:
+        print(f"Registering aggregator: {aggregator_name}")
+        try:
+            registration = client.register(aggregator_name, metrics)
+        except ClientError as e:
+            print(f"Failed to register aggregator: {e}. Exiting.")
+            return
+    
+        aggregator_uuid = registration["uuid"]
+        print(f"Aggregator registered with UUID: {aggregator_uuid}")
+    
+        metric_uuids = [registration["metrics"][metric["name"]]["uuid"] for metric in metrics]
+        for metric, metric_uuid in zip(metrics, metric_uuids):
+            print(f"Metric {metric['name']} registered with UUID: {metric_uuid}")
+    
+        # Listen for configure and shutdown commands on the same connection pool
+        apply_config(client, client.get_config(aggregator_uuid))
+        client.listen(aggregator_uuid, lambda command: handle_command(client, command))
+    
+        # Generate metrics
+        print("Starting to generate metrics...")
+        generate_metrics(client, metric_uuids)
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
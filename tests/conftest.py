@@ -0,0 +1,37 @@
+import pytest
+
+from app import create_app, db
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """An app on a fresh SQLite database, raising QueryBudgetExceeded on N+1 patterns and over-budget requests."""
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{tmp_path / "coc.sqlite"}')
+    monkeypatch.setenv('QUERY_DEBUG', 'raise')
+    monkeypatch.setenv('SELF_MONITOR_INTERVAL', '0')
+    monkeypatch.setenv('LOG_LEVEL', 'WARNING')
+    monkeypatch.setenv('LOG_FORMAT', 'text')
+
+    app = create_app()
+    app.config['TESTING'] = True
+    with app.app_context():
+        db.create_all()
+
+    yield app
+
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+@pytest.fixture
+def register(client):
+    """Register an aggregator with metrics by name, returning its UUID and {metric name: metric UUID}."""
+    def register(name, metrics=('cpu',)):
+        response = client.post('/register', json={'name': name, 'metrics': [{'name': m, 'unit': '%'} for m in metrics]})
+        assert response.status_code in (200, 201), response.get_json()
+        registered = response.get_json()
+        return registered['uuid'], {name: metric['uuid'] for name, metric in registered['metrics'].items()}
+    return register
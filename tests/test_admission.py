@@ -0,0 +1,74 @@
+import uuid
+
+import pytest
+
+from app import admission
+from app.admission import IngestAdmission, IngestRejected, TokenBuckets
+
+@pytest.fixture
+def clock(monkeypatch):
+    """A time.monotonic() for the admission module that only moves when advanced."""
+    now = [1000.0]
+    monkeypatch.setattr(admission.time, 'monotonic', lambda: now[0])
+
+    def advance(seconds):
+        now[0] += seconds
+    return advance
+
+def test_bucket_allows_burst_then_refills_at_rate(clock):
+    buckets = TokenBuckets(rate=2, burst=3)
+
+    assert [buckets.take({'a'}) for _ in range(3)] == [0, 0, 0]
+    assert buckets.take({'a'}) == pytest.approx(0.5)
+
+    clock(0.5)
+    assert buckets.take({'a'}) == 0
+    assert buckets.take({'a'}) > 0
+
+def test_take_is_all_or_nothing(clock):
+    buckets = TokenBuckets(rate=1, burst=1)
+    buckets.take({'b'})
+
+    assert buckets.take({'a', 'b'}) > 0
+    # The rejected request did not use a's token
+    assert buckets.take({'a'}) == 0
+
+def test_least_recently_used_bucket_is_evicted(clock, monkeypatch):
+    monkeypatch.setattr(admission, 'MAX_BUCKETS', 3)
+    buckets = TokenBuckets(rate=0.001, burst=1)
+    for key in ('a', 'b', 'c'):
+        buckets.take({key})
+
+    buckets.take({'a'})  # Rejected, but a is now the most recently used
+    buckets.take({'d'})
+
+    # b was dropped, the empty buckets of a and c were kept
+    assert buckets.take({'a'}) > 0
+    assert buckets.take({'c'}) > 0
+    assert buckets.take({'b'}) == 0
+
+def test_rate_limit_is_per_aggregator(app, register, clock):
+    first, first_metrics = register('first', ['cpu', 'mem'])
+    _, second_metrics = register('second', ['cpu'])
+    limits = IngestAdmission(max_concurrency=0, rate=1, burst=2)
+
+    with app.app_context():
+        limits.check_rate([first_metrics['cpu']])
+        limits.check_rate([first_metrics['mem']])
+        with pytest.raises(IngestRejected) as rejected:
+            limits.check_rate([first_metrics['cpu'], first_metrics['mem']])
+        limits.check_rate([second_metrics['cpu']])
+
+    assert rejected.value.reason == 'rate_limit'
+    assert rejected.value.retry_after == 1
+
+def test_unknown_metrics_create_no_buckets(app, register, clock):
+    _, metrics = register('known', ['cpu'])
+    limits = IngestAdmission(max_concurrency=0, rate=1, burst=1)
+
+    with app.app_context():
+        for _ in range(50):
+            limits.check_rate([str(uuid.uuid4())])
+        limits.check_rate([metrics['cpu'], str(uuid.uuid4())])
+
+    assert len(limits.buckets._buckets) == 1
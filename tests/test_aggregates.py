@@ -0,0 +1,63 @@
+import pytest
+
+def submit(client, snapshots=(), aggregates=()):
+    response = client.post('/snapshots/batch', json={'snapshots': list(snapshots), 'aggregates': list(aggregates)})
+    assert response.status_code == 201, response.get_json()
+
+def snapshot(metric_uuid, value, minute):
+    return {'metric_uuid': metric_uuid, 'value': value, 'timestamp': f'2024-01-01T00:{minute:02d}:00Z', 'offset': 0}
+
+def aggregate(metric_uuid, last, minute, count=3):
+    return {'metric_uuid': metric_uuid, 'window_start': f'2024-01-01T00:{minute:02d}:00Z', 'window_seconds': 60,
+            'count': count, 'min': last, 'max': last, 'sum': last * count, 'last': last, 'offset': 0}
+
+def test_latest_snapshots_shows_newer_aggregates(client, register):
+    _, metrics = register('recorder', ['raw', 'recorded', 'both'])
+    submit(client,
+           [snapshot(metrics['raw'], 1.0, 5), snapshot(metrics['both'], 2.0, 5)],
+           [aggregate(metrics['recorded'], 3.0, 1), aggregate(metrics['both'], 4.0, 1)])
+
+    latest = {point['metric_uuid']: point['value'] for point in client.get('/latest_snapshots').get_json()}
+
+    assert latest == {metrics['raw']: 1.0, metrics['recorded']: 3.0, metrics['both']: 2.0}
+
+
+def test_snapshots_page_merges_aggregates_across_cursors(client, register):
+    _, metrics = register('paged', ['cpu'])
+    cpu = metrics['cpu']
+    submit(client, [snapshot(cpu, float(minute), minute) for minute in range(0, 10, 2)],
+           [aggregate(cpu, 100.0 + minute, minute) for minute in range(1, 10, 2)] + [aggregate(cpu, 50.0, 0)])
+
+    values = []
+    cursor = None
+    while True:
+        params = {'metric_uuid': cpu, 'limit': 4, **({'cursor': cursor} if cursor else {})}
+        page = client.get('/snapshots/page', query_string=params).get_json()
+        values += [row['value'] for row in page['snapshots']]
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    # Snapshots come before aggregates with the same timestamp
+    assert values == [0.0, 50.0, 101.0, 2.0, 103.0, 4.0, 105.0, 6.0, 107.0, 8.0, 109.0]
+
+
+def test_aggregates_are_paged_and_unknown_metrics_not_found(client, register):
+    _, metrics = register('windows', ['cpu'])
+    submit(client, aggregates=[aggregate(metrics['cpu'], float(minute), minute) for minute in range(5)])
+
+    first = client.get('/snapshots/aggregates', query_string={'metric_uuid': metrics['cpu'], 'limit': 3}).get_json()
+    rest = client.get('/snapshots/aggregates', query_string={'metric_uuid': metrics['cpu'], 'limit': 3,
+                                                             'cursor': first['next_cursor']}).get_json()
+
+    assert [a['last'] for a in first['aggregates'] + rest['aggregates']] == [0.0, 1.0, 2.0, 3.0, 4.0]
+    assert rest['next_cursor'] is None
+    assert client.get('/snapshots/aggregates', query_string={'metric_uuid': 'unknown'}).status_code == 404
+
+@pytest.mark.parametrize('limit', [0, -1])
+def test_aggregate_limit_must_be_positive(client, register, limit):
+    _, metrics = register('windows', ['cpu'])
+
+    response = client.get('/snapshots/aggregates', query_string={'metric_uuid': metrics['cpu'], 'limit': limit})
+
+    assert response.status_code == 400
@@ -0,0 +1,38 @@
+import pytest
+
+def names(response):
+    assert response.status_code == 200, response.get_json()
+    return sorted(aggregator['name'] for aggregator in response.get_json())
+
+def test_metrics_filters_by_aggregator(client, register):
+    aggregator_uuid, metrics = register('one', ['cpu', 'mem'])
+    register('other', ['disk'])
+
+    response = client.get('/metrics', query_string={'aggregator_uuid': aggregator_uuid})
+
+    assert sorted(metric['uuid'] for metric in response.get_json()) == sorted(metrics.values())
+
+@pytest.mark.parametrize('name, expected', [
+    ('_', ['db_1']),
+    ('%', ['100%']),
+    ('\\', ['back\\slash']),
+    ('DB', ['db_1', 'dbx1']),
+])
+def test_name_filter_matches_wildcards_literally(client, register, name, expected):
+    for aggregator in ('db_1', 'dbx1', '100%', 'back\\slash'):
+        register(aggregator)
+
+    assert names(client.get('/aggregators', query_string={'name': name})) == expected
+
+def test_aggregators_are_paged(client, register):
+    for n in range(5):
+        register(f'agg{n}')
+
+    response = client.get('/aggregators', query_string={'sort': 'name', 'order': 'asc', 'limit': 2, 'offset': 2})
+
+    assert [aggregator['name'] for aggregator in response.get_json()] == ['agg2', 'agg3']
+    assert response.headers['X-Total-Count'] == '5'
+
+@pytest.mark.parametrize('params', [{'limit': 0}, {'limit': -1}, {'offset': -1}])
+def test_aggregator_limit_and_offset_are_bounded_below(client, params):
+    assert client.get('/aggregators', query_string=params).status_code == 400
@@ -0,0 +1,100 @@
+import json
+from contextlib import ExitStack
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+from app import db
+from app.backfill import import_file, import_stream
+from app.models.models import Snapshot
+
+def ndjson_lines(metric_uuid, count):
+    return [json.dumps({'metric_uuid': metric_uuid, 'value': n, 'timestamp': 1700000000000 + n * 1000}).encode()
+            for n in range(count)]
+
+def stored_values(app):
+    with app.app_context():
+        return sorted(value for value, in db.session.query(Snapshot.value))
+
+class Interrupted(Exception):
+    pass
+
+def test_import_file_resumes_from_its_checkpoint(app, register, tmp_path):
+    _, metrics = register('history', ['cpu'])
+    path = tmp_path / 'cpu.ndjson'
+    path.write_bytes(b'\n'.join(ndjson_lines(metrics['cpu'], 35)) + b'\n')
+
+    def stop_after_two_batches(importer):
+        if importer.line >= 20:
+            raise Interrupted
+
+    with app.app_context():
+        with pytest.raises(Interrupted):
+            import_file(str(path), batch_size=10, progress=stop_after_two_batches)
+        checkpoint = json.loads((tmp_path / 'cpu.ndjson.checkpoint').read_text())
+
+        resumed = import_file(str(path), batch_size=10)
+        again = import_file(str(path), batch_size=10)
+
+    assert (checkpoint['line'], checkpoint['imported'], checkpoint['complete']) == (20, 20, False)
+    assert (resumed['imported'], resumed['complete']) == (35, True)
+    assert again['imported'] == 35
+    assert stored_values(app) == list(range(35))
+
+def test_import_stream_resumes_under_its_import_id(app, register):
+    _, metrics = register('history', ['cpu'])
+    lines = ndjson_lines(metrics['cpu'], 35)
+
+    def broken_upload():
+        for line in lines[:25]:
+            yield line + b'\n'
+        raise OperationalError('INSERT', {}, Exception('database is locked'))
+
+    with app.app_context():
+        with pytest.raises(OperationalError):
+            import_stream(broken_upload(), 'ndjson', batch_size=10, import_id='upload-1')
+        db.session.rollback()
+
+        result = import_stream(iter([b'\n'.join(lines)]), 'ndjson', batch_size=10, import_id='upload-1')
+
+    assert (result['line'], result['imported'], result['complete']) == (35, 35, True)
+    assert stored_values(app) == list(range(35))
+
+def test_upload_with_import_id_is_not_imported_twice(client, register):
+    _, metrics = register('history', ['cpu'])
+    body = b'\n'.join(ndjson_lines(metrics['cpu'], 5))
+    url = '/snapshots/import?format=ndjson&import_id=upload-2'
+
+    first = client.post(url, data=body)
+    second = client.post(url, data=body)
+    progress = client.get('/snapshots/import/upload-2').get_json()
+
+    assert first.status_code == second.status_code == 201
+    assert second.get_json()['imported'] == 5
+    assert (progress['line'], progress['imported'], progress['complete']) == (5, 5, True)
+    assert len(client.get('/snapshots', query_string={'metric_uuid': metrics['cpu']}).get_json()) == 5
+
+def hold(admit, count):
+    stack = ExitStack()
+    for _ in range(count):
+        stack.enter_context(admit())
+    return stack
+
+def test_uploads_run_while_every_ingest_slot_is_taken(app, client, register):
+    _, metrics = register('history', ['cpu'])
+    admission = app.extensions['ingest_admission']
+
+    with hold(admission.admit, admission.max_concurrency):
+        response = client.post('/snapshots/import?format=ndjson', data=b'\n'.join(ndjson_lines(metrics['cpu'], 3)))
+
+    assert response.status_code == 201
+
+def test_uploads_over_the_import_limit_are_rejected(app, client, register):
+    _, metrics = register('history', ['cpu'])
+    admission = app.extensions['ingest_admission']
+
+    with hold(admission.admit_import, admission.max_imports):
+        response = client.post('/snapshots/import?format=ndjson', data=b'\n'.join(ndjson_lines(metrics['cpu'], 3)))
+
+    assert response.status_code == 429
+    assert response.get_json()['reason'] == 'import_concurrency'
@@ -0,0 +1,84 @@
+import threading
+
+from app import db
+from app.commands import SQLCommandStore
+
+def test_command_is_claimed_by_one_worker_only(app, register):
+    aggregator_uuid, _ = register('collector')
+    # Two workers, each with its own store and idle cache
+    first, second = SQLCommandStore(cache_ttl=0), SQLCommandStore(cache_ttl=0)
+
+    with app.app_context():
+        first.enqueue(aggregator_uuid, 'shutdown')
+        claimed = first.claim(aggregator_uuid) + second.claim(aggregator_uuid) + first.claim(aggregator_uuid)
+
+    assert [command['command'] for command in claimed] == ['shutdown']
+
+def test_concurrent_claims_deliver_each_command_once(app, register):
+    aggregator_uuid, _ = register('collector')
+    with app.app_context():
+        SQLCommandStore().enqueue_many([(aggregator_uuid, 'shutdown', {'n': n}) for n in range(20)])
+
+    barrier = threading.Barrier(4)
+    claimed = []
+
+    def worker():
+        store = SQLCommandStore(cache_ttl=0)
+        with app.app_context():
+            barrier.wait()
+            for _ in range(5):
+                claimed.extend(command['payload']['n'] for command in store.claim(aggregator_uuid))
+            db.session.remove()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(claimed) == list(range(20))
+
+def test_configure_supersedes_undelivered_configure(app, register):
+    aggregator_uuid, _ = register('collector')
+    store = SQLCommandStore(cache_ttl=0)
+
+    with app.app_context():
+        store.enqueue(aggregator_uuid, 'configure', {'interval_seconds': 10})
+        store.enqueue(aggregator_uuid, 'shutdown')
+        store.enqueue(aggregator_uuid, 'configure', {'interval_seconds': 20})
+        claimed = store.claim(aggregator_uuid)
+
+    assert [(command['command'], command['payload']) for command in claimed] == [
+        ('shutdown', None), ('configure', {'interval_seconds': 20})]
+
+def test_expired_configure_is_not_delivered(app, register):
+    aggregator_uuid, _ = register('collector')
+    store = SQLCommandStore(cache_ttl=0, expiry=0)
+
+    with app.app_context():
+        store.enqueue(aggregator_uuid, 'configure', {'interval_seconds': 10})
+        store.enqueue(aggregator_uuid, 'shutdown')
+
+        assert [command['command'] for command in store.claim(aggregator_uuid)] == ['shutdown']
+
+def test_filtered_claim_leaves_other_commands_pending(app, register):
+    aggregator_uuid, _ = register('collector')
+    store = SQLCommandStore(cache_ttl=60)
+
+    with app.app_context():
+        store.enqueue(aggregator_uuid, 'configure', {'interval_seconds': 10})
+
+        assert store.claim(aggregator_uuid, commands=('shutdown',)) == []
+        # The idle cache of a filtered claim does not hide the configure command
+        assert [command['command'] for command in store.claim(aggregator_uuid)] == ['configure']
+        assert store.claim(aggregator_uuid) == []
+
+def test_poll_shutdown_status_claims_shutdown_once(client, register):
+    aggregator_uuid, _ = register('collector')
+    client.post('/shutdown_aggregator', json={'aggregator_uuid': aggregator_uuid})
+
+    first = client.get(f'/poll_shutdown_status/{aggregator_uuid}').get_json()
+    second = client.get(f'/poll_shutdown_status/{aggregator_uuid}').get_json()
+
+    assert first['should_shutdown'] is True
+    assert second['should_shutdown'] is False
@@ -0,0 +1,43 @@
+import csv
+import io
+
+def submit(client, metric_uuid):
+    snapshots = [{'metric_uuid': metric_uuid, 'value': 1.0, 'timestamp': '2024-01-01T00:00:00Z', 'offset': 0}]
+    aggregates = [{'metric_uuid': metric_uuid, 'window_start': '2024-01-01T00:01:00Z', 'window_seconds': 60,
+                   'count': 4, 'min': 1.0, 'max': 3.0, 'sum': 8.0, 'last': 2.0, 'offset': 0}]
+    assert client.post('/snapshots/batch', json={'snapshots': snapshots, 'aggregates': aggregates}).status_code == 201
+
+def export(client, metric_uuid):
+    return client.get('/snapshots/export', query_string={'metric_uuid': metric_uuid, 'time_format': 'epoch_ms'})
+
+def test_csv_export_counts_the_samples_of_aggregates(client, register):
+    _, metrics = register('exporter', ['cpu'])
+    submit(client, metrics['cpu'])
+
+    rows = list(csv.DictReader(io.StringIO(export(client, metrics['cpu']).get_data(as_text=True))))
+
+    assert [(row['value'], row['count']) for row in rows] == [('1.0', '1'), ('2.0', '4')]
+
+def test_exports_over_the_limit_are_rejected(app, client, register):
+    _, metrics = register('exporter', ['cpu'])
+    slots = app.extensions['export_slots']
+    for _ in range(app.config['EXPORT_MAX_CONCURRENCY']):
+        slots.acquire()
+
+    response = export(client, metrics['cpu'])
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+
+def test_export_slot_is_freed_once_the_download_is_sent(app, client, register):
+    _, metrics = register('exporter', ['cpu'])
+    submit(client, metrics['cpu'])
+
+    statuses = []
+    for _ in range(app.config['EXPORT_MAX_CONCURRENCY'] + 2):
+        # As a WSGI server does, close each response once its body is sent
+        with export(client, metrics['cpu']) as response:
+            response.get_data()
+        statuses.append(response.status_code)
+
+    assert statuses == [200] * len(statuses)
@@ -0,0 +1,81 @@
+import io
+import uuid
+
+import msgspec
+import pytest
+
+from app import ingest
+from app.backfill import SnapshotImporter
+from app.ingest import IngestError, TooManyRecords, UnsupportedFormat, decode_batch_stream, decode_lines, decode_packed
+
+METRIC_UUID = str(uuid.uuid4())
+
+def packed(value, timestamp=1700000000000, offset=0):
+    return msgspec.msgpack.encode([[uuid.UUID(METRIC_UUID).bytes, value, timestamp, offset]])
+
+@pytest.mark.parametrize('value', [float('nan'), float('inf'), float('-inf')])
+def test_packed_batches_reject_non_finite_values(value):
+    with pytest.raises(IngestError, match=r'finite number - at `\$\[0\]\[1\]`'):
+        decode_packed(packed(value))
+
+def test_packed_batches_reject_short_uuids():
+    with pytest.raises(IngestError, match=r'`\$\[0\]\[0\]`'):
+        decode_packed(msgspec.msgpack.encode([[b'short', 1.0, 0, 0]]))
+
+@pytest.mark.parametrize('line', [
+    f'{METRIC_UUID} nan 1700000000000 0',
+    f'{METRIC_UUID} inf 1700000000000 0',
+    f'{METRIC_UUID} 1.0 1700000000000',
+    f'{METRIC_UUID} 1.0 -5 0',
+    f'{METRIC_UUID} 1.0 1700000000000 2000',
+])
+def test_line_protocol_rejects_bad_lines_with_their_number(line):
+    with pytest.raises(IngestError, match='Line 2'):
+        decode_lines([f'{METRIC_UUID} 1.0 1700000000000 0\n{line}\n'.encode()], 10)
+
+def test_line_protocol_stops_reading_past_max_records():
+    def chunks():
+        yield f'{METRIC_UUID} 1.0 1700000000000 0\n'.encode() * 3
+        raise AssertionError('read past the record limit')
+
+    with pytest.raises(TooManyRecords):
+        decode_lines(chunks(), 2)
+
+def test_unsupported_content_type_is_rejected():
+    with pytest.raises(UnsupportedFormat):
+        decode_batch_stream(None, 'application/xml', None, 10)
+
+@pytest.mark.parametrize('value', ['nan', 'inf', '-inf'])
+def test_csv_import_rejects_non_finite_values(value):
+    importer = SnapshotImporter('csv')
+    importer.read_header(b'metric_uuid,value,timestamp')
+
+    importer.feed(2, f'{METRIC_UUID},{value},1700000000000'.encode())
+
+    assert importer.rejected == 1
+    assert importer.errors == [{'line': 2, 'error': 'Value must be a finite number'}]
+
+def test_batch_route_rejects_non_finite_msgpack_values(client, register):
+    _, metrics = register('packer', ['cpu'])
+    body = msgspec.msgpack.encode([[uuid.UUID(metrics['cpu']).bytes, float('nan'), 1700000000000, 0]])
+
+    response = client.post('/snapshots/batch', data=body, content_type='application/msgpack')
+
+    assert response.status_code == 400
+    assert 'finite' in response.get_json()['error']
+
+def test_buffered_formats_are_limited_to_max_buffered_body_bytes(client, monkeypatch):
+    monkeypatch.setattr(ingest, 'MAX_BUFFERED_BODY_BYTES', 100)
+    body = msgspec.msgpack.encode([[uuid.UUID(METRIC_UUID).bytes, 1.0, 1700000000000, 0]] * 10)
+
+    response = client.post('/snapshots/batch', data=body, content_type='application/msgpack')
+
+    assert response.status_code == 413
+
+def test_line_protocol_is_not_limited_to_max_buffered_body_bytes(monkeypatch):
+    monkeypatch.setattr(ingest, 'MAX_BUFFERED_BODY_BYTES', 100)
+    body = f'{METRIC_UUID} 1.0 1700000000000 0\n'.encode() * 10
+
+    rows, _ = decode_batch_stream(io.BytesIO(body), 'text/plain', None, 10)
+
+    assert len(rows) == 10
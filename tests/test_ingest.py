@@ -0,0 +1,40 @@
+import json
+import uuid
+
+import pytest
+
+from app.ingest import IngestError, decode_batch, decode_snapshot
+
+METRIC_UUID = str(uuid.uuid4())
+
+def snapshot_body(**fields):
+    snapshot = {'metric_uuid': METRIC_UUID, 'value': 1.5, 'timestamp': '2024-01-01T00:00:00Z', 'offset': 60}
+    return json.dumps({**snapshot, **fields}).encode()
+
+def test_snapshot_is_decoded_with_epoch_ms_or_iso_timestamps():
+    iso = decode_snapshot(snapshot_body())
+    epoch = decode_snapshot(snapshot_body(timestamp=1704067200000))
+
+    assert iso['timestamp'] == epoch['timestamp']
+    assert (iso['metric_uuid'], iso['value'], iso['offset']) == (METRIC_UUID, 1.5, 60)
+
+@pytest.mark.parametrize('body, message', [
+    (snapshot_body(value='1.5'), '`$.value`'),
+    (snapshot_body(offset=1441), '`$.offset`'),
+    (snapshot_body(timestamp=-1), '`$.timestamp`'),
+    (snapshot_body(metric_uuid='x' * 37), '`$.metric_uuid`'),
+    (b'{"metric_uuid": "m", "value": NaN, "timestamp": 0, "offset": 0}', 'Body must be JSON'),
+    (b'not json', 'Body must be JSON'),
+])
+def test_invalid_snapshots_are_rejected_with_the_field(body, message):
+    with pytest.raises(IngestError, match=message.replace('$', r'\$')):
+        decode_snapshot(body)
+
+def test_batch_needs_records_and_consistent_aggregates():
+    aggregate = {'metric_uuid': METRIC_UUID, 'window_start': 0, 'window_seconds': 60, 'count': 2,
+                 'min': 1, 'max': 2, 'sum': 3, 'last': 5, 'offset': 0}
+
+    with pytest.raises(IngestError, match='Snapshots or aggregates are required'):
+        decode_batch(b'{}')
+    with pytest.raises(IngestError, match='min <= last <= max'):
+        decode_batch(json.dumps({'aggregates': [aggregate]}).encode())
@@ -0,0 +1,35 @@
+import pytest
+
+from app.commands import SQLCommandStore
+from app.routes import api
+
+def test_commands_wait_returns_queued_command(client, register):
+    aggregator_uuid, _ = register('collector')
+    client.post('/shutdown_aggregator', json={'aggregator_uuid': aggregator_uuid})
+
+    response = client.get(f'/commands/{aggregator_uuid}', query_string={'wait': '0.5'})
+
+    assert [command['command'] for command in response.get_json()['commands']] == ['shutdown']
+
+@pytest.mark.parametrize('wait', ['nan', 'inf', '-inf', '-5', 'soon'])
+def test_commands_wait_must_be_finite_and_not_negative(client, register, wait):
+    aggregator_uuid, _ = register('collector')
+
+    response = client.get(f'/commands/{aggregator_uuid}', query_string={'wait': wait})
+
+    assert response.status_code == 400
+
+def test_commands_wait_is_capped(client, register, monkeypatch):
+    monkeypatch.setattr(api, 'MAX_COMMAND_WAIT', 0)
+    aggregator_uuid, _ = register('collector')
+
+    response = client.get(f'/commands/{aggregator_uuid}', query_string={'wait': '3600'})
+
+    assert response.get_json() == {'commands': []}
+
+@pytest.mark.parametrize('timeout', [float('nan'), float('inf'), -1])
+def test_store_wait_rejects_unbounded_timeouts(app, register, timeout):
+    aggregator_uuid, _ = register('collector')
+
+    with app.app_context(), pytest.raises(ValueError):
+        SQLCommandStore().wait(aggregator_uuid, timeout)
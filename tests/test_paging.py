@@ -0,0 +1,50 @@
+import pytest
+
+from app.routes import api
+
+def submit(client, metric_uuid, count):
+    snapshots = [{'metric_uuid': metric_uuid, 'value': float(n), 'timestamp': 1700000000000 + n * 1000, 'offset': 0}
+                 for n in range(count)]
+    assert client.post('/snapshots/batch', json={'snapshots': snapshots}).status_code == 201
+
+def page(client, metric_uuid, **params):
+    return client.get('/snapshots/page', query_string={'metric_uuid': metric_uuid, **params})
+
+def test_cursor_pages_cover_every_snapshot_once(client, register):
+    _, metrics = register('paged', ['cpu'])
+    submit(client, metrics['cpu'], 7)
+
+    values, cursor = [], None
+    while True:
+        body = page(client, metrics['cpu'], limit=3, **({'cursor': cursor} if cursor else {})).get_json()
+        values += [row['value'] for row in body['snapshots']]
+        cursor = body['next_cursor']
+        if cursor is None:
+            break
+
+    assert values == [float(n) for n in range(7)]
+
+def test_offset_skips_rows_after_the_cursor(client, register):
+    _, metrics = register('paged', ['cpu'])
+    submit(client, metrics['cpu'], 10)
+    first = page(client, metrics['cpu'], limit=2).get_json()
+
+    skipped = page(client, metrics['cpu'], limit=2, offset=4, cursor=first['next_cursor']).get_json()
+
+    assert [row['value'] for row in skipped['snapshots']] == [6.0, 7.0]
+
+@pytest.mark.parametrize('params', [{'limit': 0}, {'limit': -1}, {'offset': -1}, {'limit': 'ten'}])
+def test_page_limit_and_offset_are_bounded_below(client, register, params):
+    _, metrics = register('paged', ['cpu'])
+
+    assert page(client, metrics['cpu'], **params).status_code == 400
+
+def test_deep_offsets_are_rejected(client, register, monkeypatch):
+    monkeypatch.setattr(api, 'MAX_PAGE_OFFSET', 5)
+    _, metrics = register('paged', ['cpu'])
+    submit(client, metrics['cpu'], 10)
+
+    assert page(client, metrics['cpu'], limit=2, offset=5).status_code == 200
+    response = page(client, metrics['cpu'], limit=2, offset=6)
+    assert response.status_code == 400
+    assert 'cursor' in response.get_json()['error']
@@ -0,0 +1,56 @@
+import pytest
+
+from app import db
+from app.models.models import Metric
+from app.monitoring import QueryBudgetExceeded
+
+def submit(client, snapshots=(), aggregates=()):
+    response = client.post('/snapshots/batch', json={'snapshots': list(snapshots), 'aggregates': list(aggregates)})
+    assert response.status_code == 201, response.get_json()
+
+def snapshot(metric_uuid, value, minute):
+    return {'metric_uuid': metric_uuid, 'value': value, 'timestamp': f'2024-01-01T00:{minute:02d}:00Z', 'offset': 0}
+
+def query_count(response):
+    assert response.status_code == 200, response.get_json()
+    return int(response.headers['X-Query-Count'])
+
+def test_metrics_loads_aggregators_in_one_query(client, register):
+    register('small', ['cpu'])
+    few = query_count(client.get('/metrics'))
+
+    for n in range(5):
+        register(f'agg{n}', [f'metric{m}' for m in range(5)])
+    response = client.get('/metrics')
+
+    assert query_count(response) == few == 1
+    assert len(response.get_json()) == 26
+    assert all(metric['aggregator_name'] for metric in response.get_json())
+
+
+def test_latest_snapshots_query_count_does_not_grow_with_metrics(client, register):
+    _, metrics = register('few', ['a', 'b'])
+    submit(client, [snapshot(uuid, 1.0, 0) for uuid in metrics.values()])
+    few = query_count(client.get('/latest_snapshots'))
+
+    _, metrics = register('many', [f'm{n}' for n in range(20)])
+    submit(client, [snapshot(uuid, float(minute), minute) for uuid in metrics.values() for minute in range(3)])
+    response = client.get('/latest_snapshots')
+
+    assert query_count(response) == few
+    latest = {point['metric_uuid']: point['value'] for point in response.get_json()}
+    assert len(latest) == 22
+    assert all(latest[uuid] == 2.0 for uuid in metrics.values())
+
+
+def test_repeated_statements_raise_in_tests(app, client, register):
+    @app.route('/n-plus-one')
+    def n_plus_one():
+        # One query per metric, the pattern the query budget exists to catch
+        uuids = [uuid for uuid, in db.session.query(Metric.uuid)]
+        return {'names': [db.session.get(Metric, uuid).aggregator.name for uuid in uuids]}
+
+    register('loop', [f'm{n}' for n in range(10)])
+
+    with pytest.raises(QueryBudgetExceeded):
+        client.get('/n-plus-one')
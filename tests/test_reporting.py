@@ -0,0 +1,27 @@
+from app import db
+from app.models.models import LoadSheddingState
+from app.reporting import SHARED_STATE_ID, LoadShedder, get_load_shedder
+
+def test_config_uses_the_shared_factor_not_the_workers_copy(app, client, register):
+    aggregator_uuid, _ = register('collector')
+    client.put(f'/aggregators/{aggregator_uuid}/config', json={'interval_seconds': 10})
+    with app.app_context():
+        # Another worker doubled the factor twice since this worker last evaluated it
+        db.session.merge(LoadSheddingState(id=SHARED_STATE_ID, interval_factor=4))
+        db.session.commit()
+        assert get_load_shedder().factor == 1
+
+    config = client.get(f'/aggregators/{aggregator_uuid}/config').get_json()
+
+    assert (config['interval_factor'], config['interval_seconds']) == (4, 40)
+
+def test_ensure_started_starts_one_thread(app):
+    shedder = LoadShedder(app, evaluate_interval=60)
+
+    shedder.ensure_started()
+    thread = shedder._thread
+    shedder.ensure_started()
+
+    assert shedder._thread is thread and thread.is_alive()
+    shedder.stop()
+    assert not thread.is_alive()
@@ -0,0 +1,88 @@
+import pytest
+
+from coc_client.spool import Spool
+
+def records(start, count):
+    return [{'metric_uuid': 'm', 'value': float(n)} for n in range(start, start + count)]
+
+class Server:
+    """A send function that records the key of every attempt and each accepted batch.
+
+    It fails the attempts whose number (from 1) is in ``failing``.
+    """
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.attempts = []
+        self.batches = []
+
+    def __call__(self, batch, key):
+        self.attempts.append(key)
+        if len(self.attempts) in self.failing:
+            raise ConnectionError('server unavailable')
+        self.batches.append(([record['value'] for record in batch], key))
+
+def test_replay_merges_unsent_batches_in_order(tmp_path):
+    spool = Spool(str(tmp_path))
+    for start in (0, 2, 4, 6):
+        spool.append(records(start, 2))
+    server = Server()
+
+    assert spool.replay(server, batch_size=4) == 8
+    assert [values for values, _ in server.batches] == [[0.0, 1.0, 2.0, 3.0], [4.0, 5.0, 6.0, 7.0]]
+    assert not spool.pending()
+
+def test_failed_batch_is_sent_again_with_the_same_key(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(records(0, 2))
+    spool.append(records(2, 2))
+    server = Server(failing={1})
+
+    with pytest.raises(ConnectionError):
+        spool.replay(server)
+
+    # A new Spool, as after a restart of the collector, resumes from the cursor file
+    assert Spool(str(tmp_path)).replay(server) == 4
+    assert server.batches == [([0.0, 1.0, 2.0, 3.0], server.attempts[0])]
+
+def test_already_sent_batches_are_replayed_alone_with_their_key(tmp_path):
+    spool = Spool(str(tmp_path))
+    spool.append(records(0, 1))
+    spool.append(records(1, 1), key='sent-once')
+    spool.append(records(2, 1))
+    server = Server()
+
+    spool.replay(server)
+
+    assert [values for values, _ in server.batches] == [[0.0], [1.0], [2.0]]
+    assert server.batches[1][1] == 'sent-once'
+    assert len({key for _, key in server.batches}) == 3
+
+def test_oldest_segments_are_evicted_over_max_bytes(tmp_path):
+    spool = Spool(str(tmp_path), segment_bytes=200, max_bytes=600)
+    for start in range(0, 40, 2):
+        spool.append(records(start, 2))
+    server = Server()
+
+    spool.replay(server)
+    replayed = [value for values, _ in server.batches for value in values]
+
+    assert spool.evicted_bytes > 0
+    assert 0.0 not in replayed
+    # The newest batches survive, in order
+    assert replayed == sorted(replayed)
+    assert replayed[-2:] == [38.0, 39.0]
+
+def test_replay_resumes_after_the_last_accepted_batch(tmp_path):
+    spool = Spool(str(tmp_path))
+    for start in (0, 1, 2):
+        spool.append(records(start, 1))
+    server = Server(failing={2})
+
+    with pytest.raises(ConnectionError):
+        spool.replay(server, batch_size=1)
+    spool.replay(server, batch_size=1)
+
+    assert [values for values, _ in server.batches] == [[0.0], [1.0], [2.0]]
+    assert server.attempts[2] == server.attempts[1]
+    assert len(spool) == 0